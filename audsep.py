@@ -0,0 +1,287 @@
+#
+# Пакетное разделение без GUI: python audsep.py <папка или маска> -o <папка результатов>
+#
+import utils.file_patch
+
+import argparse
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import time
+
+from pathlib import Path
+
+import soundfile as sf
+
+from utils.separation import default_device, prefetch_weights
+from utils.model_registry import get_models, get_model_info, get_cost_estimate
+from utils.shared_tensors import SharedTracks
+from utils.worker_pool import SeparationWorkerPool
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac')
+REPORT_NAME = "report.json"
+
+
+class JobEvents:
+    # Funnels events of every submitted job into one queue, tagged with the job's input
+    def __init__(self, events, job):
+        self.events = events
+        self.job = job
+
+    def put(self, item):
+        self.events.put((self.job,) + tuple(item))
+
+
+def collect_inputs(inputs):
+    # Returns (audio file, output name) pairs; directories keep their relative layout
+    found = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            root = Path(item)
+            for path in sorted(root.rglob("*")):
+                if path.suffix.lower() in AUDIO_EXTENSIONS:
+                    found[str(path)] = str(path.relative_to(root).with_suffix(""))
+        else:
+            for path in sorted(glob.glob(item, recursive=True)):
+                if Path(path).suffix.lower() in AUDIO_EXTENSIONS:
+                    found.setdefault(path, Path(path).stem)
+    return list(found.items())
+
+
+def get_report(output_dir):
+    try:
+        with open(output_dir / REPORT_NAME) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_run_settings(model, stems, quantize):
+    # What decides the content of an output directory besides the input: stored in the report and compared on
+    # rerun. stems is None for all of the model's stems
+    return {"model": model, "requested_stems": sorted(stems) if stems else None, "quantize": bool(quantize)}
+
+
+def get_report_settings(report):
+    # Reports written before the settings were stored hold the model only: all stems, no quantization
+    return get_run_settings(report.get("model"), report.get("requested_stems"), report.get("quantize"))
+
+
+def is_same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def assign_output_dirs(inputs, output_root, settings):
+    # Returns (audio file, output dir, already processed) triples. Same-named inputs (a/x.wav and b/x.wav) get
+    # numbered names: x, x_2, ... A directory whose report belongs to another input, or to the same input
+    # separated with other settings (model, stems, quantization), is never reused, so a rerun with other inputs,
+    # in another order or with another model neither overwrites nor skips the wrong file
+    taken = set()
+    assigned = []
+    for audio_file, name in inputs:
+        for index in itertools.count(1):
+            candidate = name if index == 1 else f"{name}_{index}"
+            output_dir = output_root / candidate
+            report = get_report(output_dir)
+            if candidate in taken:
+                continue
+            if report is None or (is_same_file(report.get("input") or "", audio_file) and
+                                  get_report_settings(report) == settings):
+                break
+        taken.add(candidate)
+        assigned.append((audio_file, output_dir, report is not None))
+    return assigned
+
+
+def get_audio_duration(audio_file):
+    try:
+        info = sf.info(audio_file)
+        return info.frames / info.samplerate
+    except Exception:
+        return None
+
+
+def format_stats(stats):
+    # Resumed runs and skipped silent chunks, as reported by the demixer
+    notes = []
+    if stats.get("resumed_from_chunk"):
+        notes.append(f"продолжено с фрагмента {stats['resumed_from_chunk']} из {stats['total_chunks']}")
+    if stats.get("skipped_chunks"):
+        notes.append(f"пропущено тихих фрагментов: {stats['skipped_chunks']} из {stats['total_chunks']}")
+    return "".join(f", {note}" for note in notes)
+
+
+def save_tracks(tracks, output_dir, subtype):
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = {}
+    for stem, track in tracks.items():
+        path = output_dir / f"{stem}.wav"
+        if 'data' in track:
+            sf.write(str(path), track['data'].T, track['sr'], subtype=subtype)
+        else:
+            shutil.move(track['path'], path)
+        paths[stem] = str(path)
+    return paths
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="audsep", description="Пакетное разделение аудио на стемы")
+    parser.add_argument("inputs", nargs="*", help="Папки, файлы или маски (например 'music/**/*.flac')")
+    parser.add_argument("-o", "--output", help="Папка для результатов")
+    parser.add_argument("-m", "--model", choices=list(get_models()), default="htdemucs", help="Модель разделения")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Число рабочих процессов")
+    parser.add_argument("--devices", default=None,
+                        help="Устройства через запятую, раздаются воркерам по кругу (например cuda:0,cuda:1)")
+    parser.add_argument("--threads", type=int, default=None, help="Потоков torch на воркер")
+    parser.add_argument("--stems", default=None,
+                        help="Только эти стемы через запятую (например vocals,other: other = микс минус vocals)")
+    parser.add_argument("--quantize", action="store_true",
+                        help="INT8-квантизация RoFormer-моделей для CPU (быстрее, с небольшой потерей качества)")
+    parser.add_argument("--subtype", default="FLOAT", help="Формат сэмплов WAV (FLOAT, PCM_24, PCM_16)")
+    parser.add_argument("--overwrite", action="store_true", help="Обработать заново уже готовые файлы")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="Скачать веса всех моделей параллельно (без входных файлов - только скачать и выйти)")
+    args = parser.parse_args(argv)
+    if not args.prefetch and (not args.inputs or not args.output):
+        parser.error("нужны входные файлы и папка для результатов (-o)")
+    if args.inputs and not args.output:
+        parser.error("не указана папка для результатов (-o)")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    try:
+        # Weights are fetched here, once, so that several workers never download the same file at the same time
+        prefetch_weights(get_models().values() if args.prefetch else [get_models()[args.model]])
+    except RuntimeError as e:
+        print(f"Не удалось скачать веса:\n{e}")
+        return 1
+    if not args.inputs:
+        return 0
+
+    output_root = Path(args.output)
+    devices = args.devices.split(",") if args.devices else [default_device()]
+    num_workers = max(1, args.workers)
+    num_threads = args.threads or max(1, (os.cpu_count() or 1) // num_workers)
+
+    stems = [stem.strip() for stem in args.stems.split(",") if stem.strip()] if args.stems else None
+    settings = get_run_settings(args.model, stems, args.quantize)
+
+    jobs = []
+    for audio_file, output_dir, processed in assign_output_dirs(collect_inputs(args.inputs), output_root, settings):
+        if processed and not args.overwrite:
+            print(f"Пропускаем (уже обработан): {audio_file}")
+            continue
+        jobs.append((audio_file, output_dir))
+
+    if not jobs:
+        print("Нет файлов для обработки")
+        return 0
+
+    model_info = get_model_info(args.model, device=devices[0], quantize=args.quantize or None)
+    if stems:
+        model_info["stems"] = stems
+
+    if num_workers > 1:
+        # Longest jobs first, by the model's declared cost: short ones fill the gaps at the end
+        jobs.sort(key=lambda job: -get_cost_estimate(model_info, get_audio_duration(job[0]) or 0))
+
+    print(f"Файлов к обработке: {len(jobs)}, воркеров: {num_workers}, устройства: {', '.join(devices)}, "
+          f"потоков на воркер: {num_threads}")
+
+    pool = SeparationWorkerPool(num_workers=num_workers, devices=devices, num_threads=num_threads)
+    events = queue.Queue()
+    timings = {}
+    failed = []
+
+    try:
+        for job in jobs:
+            pool.submit(job[0], model_info, events=JobEvents(events, job))
+            timings[job] = {"submitted": time.time(), "stages": []}
+
+        remaining = len(jobs)
+        while remaining:
+            job, kind, payload = events.get()
+            audio_file, output_dir = job
+            timing = timings[job]
+            now = time.time()
+
+            if kind == "started":
+                timing["started"] = now
+                timing["worker"] = payload
+                timing["last"] = now
+            elif kind == "status":
+                stages = timing["stages"]
+                if stages:
+                    stages[-1]["seconds"] = round(now - timing["last"], 3)
+                stages.append({"status": payload, "seconds": None})
+                timing["last"] = now
+            elif kind == "stats":
+                timing.setdefault("stats", {}).update(payload)
+            elif kind == "success":
+                remaining -= 1
+                if timing["stages"]:
+                    timing["stages"][-1]["seconds"] = round(now - timing["last"], 3)
+
+                shared_tracks = SharedTracks(payload)
+                try:
+                    paths = save_tracks(shared_tracks.tracks, output_dir, args.subtype)
+                finally:
+                    shared_tracks.release()
+                done = time.time()
+
+                duration = get_audio_duration(audio_file)
+                separation_seconds = now - timing["started"]
+                report = {
+                    "input": os.path.abspath(audio_file),
+                    **settings,
+                    "worker": timing["worker"],
+                    "device": devices[timing["worker"] % len(devices)],
+                    "threads": num_threads,
+                    "audio_seconds": duration,
+                    "queued_seconds": round(timing["started"] - timing["submitted"], 3),
+                    "separation_seconds": round(separation_seconds, 3),
+                    "write_seconds": round(done - now, 3),
+                    "total_seconds": round(done - timing["started"], 3),
+                    "realtime_factor": round(duration / separation_seconds, 3) if duration else None,
+                    "stages": timing["stages"],
+                    "stats": timing.get("stats", {}),
+                    "stems": paths,
+                }
+                # Отчёт пишется последним: по нему определяется, что файл обработан полностью
+                with open(output_dir / REPORT_NAME, 'w') as f:
+                    json.dump(report, f, ensure_ascii=False, indent=2)
+                print(f"[{len(jobs) - remaining}/{len(jobs)}] Готово: {audio_file} "
+                      f"({report['separation_seconds']} с{format_stats(report['stats'])})")
+            elif kind in ("error", "cancelled"):
+                remaining -= 1
+                failed.append(audio_file)
+                print(f"[{len(jobs) - remaining}/{len(jobs)}] Ошибка: {audio_file}: {payload}")
+    except KeyboardInterrupt:
+        print("Прервано пользователем")
+        return 130
+    finally:
+        pool.shutdown()
+
+    if failed:
+        print(f"Не удалось обработать файлов: {len(failed)}")
+        for audio_file in failed:
+            print(f"  {audio_file}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    multiprocessing.set_start_method('spawn', force=True)
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#
+# Compares two run_benchmarks.py outputs case by case.
+#
+#   python -m benchmarks.compare_results baseline.json candidate.json --threshold 0.05
+#
+# Exits with 1 when throughput drops, or peak RSS / load time grows, by more than the threshold.
+#
+
+import argparse
+import json
+import sys
+
+CASE_KEYS = ("model", "device", "chunk_size", "batch_size", "num_overlap", "threads")
+COLD_START_KEYS = ("model", "device", "phase")
+
+
+def index_results(results, keys):
+    return {tuple(result.get(key) for key in keys): result for result in results if "error" not in result}
+
+
+def relative_change(old, new):
+    return (new - old) / old if old else 0.0
+
+
+def compare_metric(rows, label, old, new, threshold, higher_is_better):
+    if old is None or new is None:
+        return False
+    change = relative_change(old, new)
+    regressed = -change > threshold if higher_is_better else change > threshold
+    rows.append((label, old, new, change, regressed))
+    return regressed
+
+
+def compare(baseline, candidate, threshold):
+    rows = []
+    regressed = False
+
+    old_cases = index_results(baseline.get("cases", []), CASE_KEYS)
+    for key, new in index_results(candidate.get("cases", []), CASE_KEYS).items():
+        old = old_cases.get(key)
+        if old is None:
+            continue
+        label = "/".join(str(value) for value in key)
+        regressed |= compare_metric(rows, f"{label} throughput", old["throughput"], new["throughput"],
+                                    threshold, True)
+        regressed |= compare_metric(rows, f"{label} peak_rss_mb", old["peak_rss_mb"], new["peak_rss_mb"],
+                                    threshold, False)
+        for stage, timing in sorted(new.get("stages", {}).items()):
+            old_timing = old.get("stages", {}).get(stage)
+            if old_timing is not None:
+                # Informational only: stage times are too noisy to gate on
+                compare_metric(rows, f"{label} {stage}", old_timing["seconds"], timing["seconds"], float("inf"), False)
+
+    old_loads = index_results(baseline.get("cold_start", []), COLD_START_KEYS)
+    for key, new in index_results(candidate.get("cold_start", []), COLD_START_KEYS).items():
+        old = old_loads.get(key)
+        if old is None:
+            continue
+        label = "/".join(str(value) for value in key)
+        regressed |= compare_metric(rows, f"{label} load_seconds", old["load_seconds"], new["load_seconds"],
+                                    threshold, False)
+        regressed |= compare_metric(rows, f"{label} peak_rss_mb", old["peak_rss_mb"], new["peak_rss_mb"],
+                                    threshold, False)
+
+    return rows, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.05, help="Allowed relative regression")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline {baseline['meta'].get('commit')}  candidate {candidate['meta'].get('commit')}")
+    rows, regressed = compare(baseline, candidate, args.threshold)
+    width = max((len(row[0]) for row in rows), default=0)
+    for label, old, new, change, is_regression in rows:
+        mark = "  REGRESSION" if is_regression else ""
+        print(f"{label:<{width}}  {old:>10.4g}  {new:>10.4g}  {change:+7.1%}{mark}")
+
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+#
+# Separation pipeline benchmarks on randomly initialized models built from configs/ (no weights needed).
+#
+#   python -m benchmarks.run_benchmarks -o bench.json
+#   python -m benchmarks.run_benchmarks --models bs_roformer --batch-sizes 1,2,4 --threads 1,4 -o bench.json
+#   python -m benchmarks.compare_results old.json new.json
+#
+# Every case runs in its own subprocess so that peak RSS and thread settings do not leak between cases.
+#
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+def get_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def parse_list(value, cast=int):
+    return [cast(item) for item in value.split(",")] if value else [None]
+
+
+def load_benchmark_config(model_name):
+    from utils.separation import load_config
+    from utils.model_registry import get_model_info
+    return load_config(get_model_info(model_name))
+
+
+def apply_case(config, model_name, case):
+    # Overrides chunk size, batch size and overlap; returns the effective values
+    if case.get("batch_size"):
+        config.inference.batch_size = case["batch_size"]
+    if case.get("num_overlap"):
+        config.inference.num_overlap = case["num_overlap"]
+
+    if model_name == "htdemucs":
+        if case.get("chunk_size"):
+            if case["chunk_size"] % config.training.samplerate:
+                raise ValueError("HTDemucs chunk size must be a whole number of seconds")
+            config.training.segment = case["chunk_size"] // config.training.samplerate
+        chunk_size = config.training.samplerate * config.training.segment
+    else:
+        if case.get("chunk_size"):
+            config.audio.chunk_size = case["chunk_size"]
+        chunk_size = config.audio.chunk_size
+
+    return {"chunk_size": int(chunk_size), "batch_size": int(config.inference.batch_size),
+            "num_overlap": int(config.inference.num_overlap)}
+
+
+def build_model(model_name, config):
+    # Same construction as the loaders, without the checkpoint
+    if model_name == "htdemucs":
+        from omegaconf import OmegaConf
+        from models.htdemucs import HTDemucs
+        extra = {
+            'sources': list(config.training.instruments),
+            'audio_channels': config.training.channels,
+            'samplerate': config.training.samplerate,
+            'segment': config.training.segment,
+        }
+        return HTDemucs(**extra, **OmegaConf.to_container(getattr(config, config.model), resolve=True))
+    if model_name == "bs_roformer":
+        from models.bs_roformer import BSRoformer
+        return BSRoformer(**dict(config.model))
+    if model_name == "melband_roformer":
+        from models.mel_band_roformer import MelBandRoformer
+        return MelBandRoformer(**dict(config.model))
+    raise ValueError(f"Unknown model: {model_name}")
+
+
+def instrument_model(timer, model_name, model):
+    import torch
+
+    timer.hook(model, "model")
+
+    if model_name == "htdemucs":
+        timer.patch(model, "_spec", "stft")
+        timer.patch(model, "_ispec", "istft")
+        timer.patch(model, "_mask", "mask")
+        for layers in (model.encoder, model.decoder, model.tencoder, model.tdecoder):
+            for layer in layers:
+                timer.hook(layer, "convolutions")
+        if model.crosstransformer is not None:
+            timer.hook(model.crosstransformer, "transformers")
+        return
+
+    module = sys.modules[type(model).__module__]
+    timer.patch(torch, "stft", "stft")
+    timer.patch(torch, "istft", "istft")
+    timer.hook(model.band_split, "band_split")
+    for block in model.layers:
+        for transformer in block:
+            timer.hook(transformer, "transformers")
+    timer.patch(module, "fused_mask_estimators", "mask")
+    for estimator in model.mask_estimators:
+        timer.hook(estimator, "mask")
+
+
+def run_case(case):
+    import torch
+    import numpy as np
+
+    from utils.separation import STRATEGIES
+    from utils.model_registry import get_model_info
+    from benchmarks.stage_timer import StageTimer, synchronize
+
+    if case.get("threads"):
+        torch.set_num_threads(case["threads"])
+
+    model_name = case["model"]
+    device = case["device"]
+    config = load_benchmark_config(model_name)
+    params = apply_case(config, model_name, case)
+    demix_fn = STRATEGIES[get_model_info(model_name)["strategy"]][0]
+
+    torch.manual_seed(0)
+    build_start = time.perf_counter()
+    model = build_model(model_name, config).to(device).eval()
+    build_seconds = time.perf_counter() - build_start
+
+    sample_rate = 44100
+    rng = np.random.default_rng(0)
+    mix = torch.from_numpy((rng.standard_normal((2, int(case["duration"] * sample_rate))) * 0.1).astype(np.float32))
+    mix = mix.to(device)
+
+    # Warm-up on a short excerpt: allocator, kernels and packed band weights
+    demix_fn(config, model, mix[:, :params["chunk_size"] * 2], device)
+
+    timer = StageTimer(device)
+    instrument_model(timer, model_name, model)
+
+    runs = []
+    stages = None
+    for _ in range(case["repeats"]):
+        timer.reset()
+        synchronize(device)
+        start = time.perf_counter()
+        with timer.measure("demix"):
+            demix_fn(config, model, mix, device)
+        synchronize(device)
+        runs.append(time.perf_counter() - start)
+        stages = timer.report()
+    timer.remove()
+
+    # Everything in demix outside the model forward is chunking and overlap-add
+    demix_seconds = stages.pop("demix")["seconds"]
+    model_seconds = stages.pop("model")["seconds"]
+    stages["overlap_add"] = {"seconds": round(demix_seconds - model_seconds, 4), "calls": 1}
+    inner = sum(stage["seconds"] for name, stage in stages.items() if name != "overlap_add")
+    stages["other"] = {"seconds": round(max(0.0, model_seconds - inner), 4), "calls": 0}
+
+    median = statistics.median(runs)
+    return dict(
+        case,
+        **params,
+        threads=torch.get_num_threads(),
+        build_seconds=round(build_seconds, 3),
+        seconds=[round(run, 4) for run in runs],
+        median_seconds=round(median, 4),
+        throughput=round(case["duration"] / median, 4),
+        peak_rss_mb=get_peak_rss_mb(),
+        stages=stages,
+    )
+
+
+def run_cold_start(spec):
+    # Fresh process: import of the loader module, then Loader().load() from the given checkpoint
+    start = time.perf_counter()
+    import torch
+    from utils.separation import get_loader_cls, load_config
+    from utils.model_registry import get_model_info
+    model_info = get_model_info(spec["model"])
+    loader_cls = get_loader_cls(model_info)
+    import_seconds = time.perf_counter() - start
+
+    if spec.get("threads"):
+        torch.set_num_threads(spec["threads"])
+
+    config = load_config(model_info)
+    loader = loader_cls()
+    loader.weights_path = spec["weights_path"]
+
+    start = time.perf_counter()
+    loader.load(model_info["model_id"], spec["device"], config)
+    load_seconds = time.perf_counter() - start
+
+    return dict(spec, import_seconds=round(import_seconds, 3), load_seconds=round(load_seconds, 3),
+                peak_rss_mb=get_peak_rss_mb())
+
+
+def save_random_checkpoint(spec):
+    import torch
+    torch.manual_seed(0)
+    config = load_benchmark_config(spec["model"])
+    torch.save({'state_dict': build_model(spec["model"], config).state_dict()}, spec["weights_path"])
+    return spec
+
+
+def run_in_subprocess(mode, spec):
+    command = [sys.executable, "-m", "benchmarks.run_benchmarks", f"--{mode}", json.dumps(spec)]
+    completed = subprocess.run(command, cwd=ROOT_DIR, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return dict(spec, error=(completed.stderr or completed.stdout).strip().splitlines()[-1:])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Separation pipeline benchmarks")
+    parser.add_argument("--models", default="htdemucs,bs_roformer,melband_roformer")
+    parser.add_argument("--chunk-sizes", default=None, help="Samples per chunk, comma separated (default: config)")
+    parser.add_argument("--batch-sizes", default=None, help="Comma separated (default: config)")
+    parser.add_argument("--overlaps", default=None, help="num_overlap values, comma separated (default: config)")
+    parser.add_argument("--threads", default=None, help="torch thread counts, comma separated (default: torch)")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of synthetic stereo audio")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--skip-cold-start", action="store_true")
+    parser.add_argument("-o", "--output", default=None, help="JSON file (default: stdout)")
+    parser.add_argument("--case", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--cold-start", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--checkpoint", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    for mode, fn in (("case", run_case), ("cold_start", run_cold_start), ("checkpoint", save_random_checkpoint)):
+        spec = getattr(args, mode)
+        if spec is not None:
+            print(RESULT_PREFIX + json.dumps(fn(json.loads(spec))))
+            return 0
+
+    import torch
+
+    models = args.models.split(",")
+    results = {
+        "meta": {
+            "commit": get_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "device": args.device,
+            "duration": args.duration,
+        },
+        "cases": [],
+        "cold_start": [],
+    }
+
+    for model_name in models:
+        for chunk_size in parse_list(args.chunk_sizes):
+            for batch_size in parse_list(args.batch_sizes):
+                for num_overlap in parse_list(args.overlaps):
+                    for threads in parse_list(args.threads):
+                        case = {"model": model_name, "device": args.device, "duration": args.duration,
+                                "repeats": args.repeats, "chunk_size": chunk_size, "batch_size": batch_size,
+                                "num_overlap": num_overlap, "threads": threads}
+                        result = run_in_subprocess("case", case)
+                        print(json.dumps({k: result.get(k) for k in ("model", "chunk_size", "batch_size",
+                                                                     "num_overlap", "threads", "throughput",
+                                                                     "peak_rss_mb", "error") if k in result}),
+                              file=sys.stderr)
+                        results["cases"].append(result)
+
+    if not args.skip_cold_start:
+        weights_dir = tempfile.mkdtemp(prefix="audsep_bench_")
+        try:
+            for model_name in models:
+                spec = {"model": model_name, "device": args.device,
+                        "weights_path": os.path.join(weights_dir, f"{model_name}.ckpt")}
+                created = run_in_subprocess("checkpoint", spec)
+                if "error" in created:
+                    results["cold_start"].append(created)
+                    continue
+                # First load reads the original checkpoint (and converts it), the second one is memory-mapped
+                for phase in ("first_load", "mapped_load"):
+                    result = run_in_subprocess("cold-start", dict(spec, phase=phase))
+                    result.pop("weights_path", None)
+                    print(json.dumps(result), file=sys.stderr)
+                    results["cold_start"].append(result)
+        finally:
+            shutil.rmtree(weights_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import time
+import torch
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+def synchronize(device):
+    if str(device).startswith('cuda'):
+        torch.cuda.synchronize()
+    elif str(device).startswith('mps'):
+        torch.mps.synchronize()
+
+
+class StageTimer:
+    # Accumulates wall time per pipeline stage through forward hooks and wrapped callables.
+    # Accelerators are synchronized at every stage boundary, which slightly slows them down
+    def __init__(self, device='cpu'):
+        self.device = device
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._undo = []
+
+    def reset(self):
+        self.totals.clear()
+        self.calls.clear()
+
+    def _add(self, stage, seconds):
+        self.totals[stage] += seconds
+        self.calls[stage] += 1
+
+    @contextmanager
+    def measure(self, stage):
+        synchronize(self.device)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            synchronize(self.device)
+            self._add(stage, time.perf_counter() - start)
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            with self.measure(stage):
+                return fn(*args, **kwargs)
+        return timed
+
+    def patch(self, owner, name, stage):
+        original = getattr(owner, name)
+        setattr(owner, name, self.wrap(stage, original))
+        self._undo.append(lambda: setattr(owner, name, original))
+
+    def hook(self, module, stage):
+        starts = []
+
+        def pre_hook(module, args):
+            synchronize(self.device)
+            starts.append(time.perf_counter())
+
+        def post_hook(module, args, output):
+            synchronize(self.device)
+            self._add(stage, time.perf_counter() - starts.pop())
+
+        handles = [module.register_forward_pre_hook(pre_hook), module.register_forward_hook(post_hook)]
+        self._undo.append(lambda: [handle.remove() for handle in handles])
+
+    def remove(self):
+        for undo in reversed(self._undo):
+            undo()
+        self._undo = []
+
+    def report(self):
+        return {stage: {"seconds": round(seconds, 4), "calls": self.calls[stage]}
+                for stage, seconds in sorted(self.totals.items())}
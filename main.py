@@ -1,14 +1,18 @@
 #
 # Created by Gosha Ivanov on 08.02.2025.
 #
+from utils.startup import enable_import_profiling
+
+enable_import_profiling()
+
 import utils.file_patch
 
 import sys
 
 from pathlib import Path
 
-from templates.audio_separator_app import AudioSeparatorApp
 from PyQt5.QtWidgets import QApplication
+from templates.audio_separator_app import AudioSeparatorApp
 
 import multiprocessing
 
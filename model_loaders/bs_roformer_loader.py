@@ -4,17 +4,22 @@
 
 import torch
 import os
-import requests
 import yaml
 
 from models.bs_roformer import BSRoformer
 from utils.user_data import get_weights_dir
+from utils.downloader import download
 from utils.path_utils import get_resource_path
+from utils.weights_cache import load_model
+from utils.quantization import is_quantization_enabled, load_quantized_model
 
 
 class BSRoformerLoader:
     WEIGHTS_FILENAME = 'bs_roformer.ckpt'
     WEIGHTS_URL = 'https://github.com/ZFTurbo/Music-Source-Separation-Training/releases/download/v1.0.12/model_bs_roformer_ep_17_sdr_9.6568.ckpt'
+    # Not pinned yet: pin the digest with weights.sha256 in models.yaml, or allow unpinned downloads
+    # (AUDSEP_ALLOW_UNPINNED_WEIGHTS=1, see utils/downloader.py)
+    WEIGHTS_SHA256 = None
 
     def __init__(self):
         self._initialize_paths()
@@ -23,23 +28,10 @@ class BSRoformerLoader:
         user_weights_dir = get_weights_dir()
         self.weights_path = os.path.join(user_weights_dir, self.WEIGHTS_FILENAME)
 
-    @staticmethod
-    def download_weights():
-        user_weights_dir = get_weights_dir()
-        weights_path = os.path.join(user_weights_dir, BSRoformerLoader.WEIGHTS_FILENAME)
-
-        print(f"Downloading weights to: {weights_path}")
-
-        os.makedirs(user_weights_dir, exist_ok=True)
-
-        response = requests.get(BSRoformerLoader.WEIGHTS_URL, stream=True)
-        total_size = int(response.headers.get('content-length', 0))
-
-        with open(weights_path, 'wb') as file:
-            file.write(response.content)
-
-        print(f"Downloaded weights to: {weights_path}")
-        return weights_path
+    @classmethod
+    def download_weights(cls):
+        weights_path = os.path.join(get_weights_dir(), cls.WEIGHTS_FILENAME)
+        return download(cls.WEIGHTS_URL, weights_path, cls.WEIGHTS_SHA256)
 
     def load(self, type_, device, config):
         if type_ == 'bs':
@@ -47,21 +39,20 @@ class BSRoformerLoader:
                 self._initialize_paths()
 
             if not os.path.exists(self.weights_path):
-                BSRoformerLoader.download_weights()
-
-            model = BSRoformer(
-                **dict(config.model)
-            )
+                self.download_weights()
 
-            state_dict = torch.load(self.weights_path, map_location=device, weights_only=False)
-            if 'state' in state_dict:
-                state_dict = state_dict['state']
-            if 'state_dict' in state_dict:
-                state_dict = state_dict['state_dict']
+            kwargs = dict(config.model)
+            model_factory = lambda: BSRoformer(**kwargs)
+            fingerprint = repr(sorted(kwargs.items()))
 
-            model = model.to(device)
-            model.load_state_dict(state_dict)
+            if is_quantization_enabled(config):
+                return load_quantized_model(model_factory, self.weights_path, device, fingerprint)
 
-            return model
+            return load_model(
+                model_factory,
+                self.weights_path,
+                device,
+                fingerprint=fingerprint
+            )
         else:
             raise NotImplementedError("Error! BS RoFormer supports only 'bs' version in our app")
\ No newline at end of file
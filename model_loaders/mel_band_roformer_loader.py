@@ -4,17 +4,22 @@
 
 import torch
 import os
-import requests
 import yaml
 
 from models.mel_band_roformer import MelBandRoformer
 from utils.user_data import get_weights_dir
+from utils.downloader import download
 from utils.path_utils import get_resource_path
+from utils.weights_cache import load_model
+from utils.quantization import is_quantization_enabled, load_quantized_model
 
 
 class MelBandRoformerLoader:
     WEIGHTS_FILENAME = 'melband_roformer.ckpt'
     WEIGHTS_URL = 'https://huggingface.co/KimberleyJSN/melbandroformer/resolve/main/MelBandRoformer.ckpt'
+    # Not pinned yet: pin the digest with weights.sha256 in models.yaml, or allow unpinned downloads
+    # (AUDSEP_ALLOW_UNPINNED_WEIGHTS=1, see utils/downloader.py)
+    WEIGHTS_SHA256 = None
 
     def __init__(self):
         pass
@@ -23,21 +28,10 @@ class MelBandRoformerLoader:
         user_weights_dir = get_weights_dir()
         self.weights_path = os.path.join(user_weights_dir, self.WEIGHTS_FILENAME)
 
-    @staticmethod
-    def download_weights():
-        user_weights_dir = get_weights_dir()
-        weights_path = os.path.join(user_weights_dir, MelBandRoformerLoader.WEIGHTS_FILENAME)
-
-        print(f"Downloading weights to: {weights_path}")
-
-        response = requests.get(MelBandRoformerLoader.WEIGHTS_URL, stream=True)
-        total_size = int(response.headers.get('content-length', 0))
-
-        with open(weights_path, 'wb') as file:
-            file.write(response.content)
-
-        print(f"Downloaded weights to: {weights_path}")
-        return weights_path
+    @classmethod
+    def download_weights(cls):
+        weights_path = os.path.join(get_weights_dir(), cls.WEIGHTS_FILENAME)
+        return download(cls.WEIGHTS_URL, weights_path, cls.WEIGHTS_SHA256)
 
     def load(self, type_, device, config):
         if type_ == 'base':
@@ -45,21 +39,20 @@ class MelBandRoformerLoader:
                 self._initialize_paths()
 
             if not os.path.exists(self.weights_path):
-                MelBandRoformerLoader.download_weights()
-
-            model = MelBandRoformer(
-                **dict(config.model)
-            )
+                self.download_weights()
 
-            state_dict = torch.load(self.weights_path, map_location=device, weights_only=False)
-            if 'state' in state_dict:
-                state_dict = state_dict['state']
-            if 'state_dict' in state_dict:
-                state_dict = state_dict['state_dict']
+            kwargs = dict(config.model)
+            model_factory = lambda: MelBandRoformer(**kwargs)
+            fingerprint = repr(sorted(kwargs.items()))
 
-            model = model.to(device)
-            model.load_state_dict(state_dict)
+            if is_quantization_enabled(config):
+                return load_quantized_model(model_factory, self.weights_path, device, fingerprint)
 
-            return model
+            return load_model(
+                model_factory,
+                self.weights_path,
+                device,
+                fingerprint=fingerprint
+            )
         else:
             raise NotImplementedError("Error! MelBand RoFormer supports only 'base' version in our app")
\ No newline at end of file
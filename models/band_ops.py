@@ -0,0 +1,417 @@
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+# fused per-band projections shared by bs_roformer and mel_band_roformer
+#
+# the band split runs one RMSNorm + Linear per band (60+ small kernels for every chunk). here neighbouring
+# bands are grouped into buckets, zero-padded to the widest band of the bucket, and each bucket is
+# projected with one batched matmul. zero padding leaves the l2 norm untouched and the RMSNorm gain and
+# scale are folded into the packed weight, so the result matches the per-band modules
+
+# share of padded (wasted) multiply-adds allowed in a bucket. on cpu the matmuls are compute bound and
+# padding only costs time, so only runs of equal-width bands are merged there; accelerators are bound by
+# kernel launches and merge more aggressively
+MAX_PADDING_WASTE = 0.25
+MAX_PADDING_WASTE_CPU = 0.
+
+
+def get_max_padding_waste(device):
+    return MAX_PADDING_WASTE_CPU if device.type == 'cpu' else MAX_PADDING_WASTE
+
+
+def get_band_buckets(dim_inputs, max_waste=MAX_PADDING_WASTE):
+    # greedy grouping of consecutive bands; a new bucket starts once padding would exceed max_waste of it
+    buckets = []
+    current = []
+    for band, dim_in in enumerate(dim_inputs):
+        candidate = current + [band]
+        width = max(dim_inputs[i] for i in candidate)
+        total = sum(dim_inputs[i] for i in candidate)
+        if current and 1 - total / (width * len(candidate)) > max_waste:
+            buckets.append(current)
+            candidate = [band]
+        current = candidate
+
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+def get_band_offsets(dim_inputs):
+    offsets = [0]
+    for dim_in in dim_inputs:
+        offsets.append(offsets[-1] + dim_in)
+    return offsets
+
+
+def get_bucket_index(dim_inputs, offsets, bucket):
+    # flat (bands * width) column indices inside the bucket's slice; padding points at an extra zero column.
+    # None when every band of the bucket has the same width and the slice can simply be reshaped
+    width = max(dim_inputs[i] for i in bucket)
+    if all(dim_inputs[i] == width for i in bucket):
+        return None
+
+    start, end = offsets[bucket[0]], offsets[bucket[-1] + 1]
+    index = torch.full((len(bucket), width), end - start, dtype=torch.long)
+    for row, band in enumerate(bucket):
+        index[row, :dim_inputs[band]] = torch.arange(offsets[band] - start, offsets[band + 1] - start)
+    return index.reshape(-1)
+
+
+def gather_bucket(x, start, end, index, num_bands, width):
+    # (n, features) -> (n, bands, width)
+    part = x[:, start:end]
+    if index is None:
+        return part.reshape(x.shape[0], num_bands, width)
+    part = F.pad(part, (0, 1)).index_select(1, index)
+    return part.view(x.shape[0], num_bands, width)
+
+
+def is_norm_linear(net):
+    if not isinstance(net, nn.Sequential) or len(net) != 2:
+        return False
+    norm, linear = net
+    return hasattr(norm, 'gamma') and hasattr(norm, 'scale') and type(linear) is nn.Linear
+
+
+def get_params_version(module):
+    return tuple((p.data_ptr(), p._version, p.dtype) for p in module.parameters())
+
+
+class PackedBandSplit:
+    def __init__(self, module):
+        self.version = get_params_version(module)
+        self.num_bands = len(module.dim_inputs)
+
+        dim_inputs = module.dim_inputs
+        offsets = get_band_offsets(dim_inputs)
+        device = next(module.parameters()).device
+
+        self.buckets = []
+        for bucket in get_band_buckets(dim_inputs, get_max_padding_waste(device)):
+            width = max(dim_inputs[i] for i in bucket)
+            weights = []
+            biases = []
+            for band in bucket:
+                norm, linear = module.to_features[band]
+                weight = linear.weight * (norm.gamma * norm.scale)
+                weights.append(F.pad(weight, (0, width - weight.shape[-1])))
+                biases.append(linear.bias)
+
+            index = get_bucket_index(dim_inputs, offsets, bucket)
+            self.buckets.append((
+                offsets[bucket[0]],
+                offsets[bucket[-1] + 1],
+                index.to(device) if index is not None else None,
+                torch.stack(weights).transpose(1, 2).contiguous(),  # (bands, width, dim)
+                torch.stack(biases).unsqueeze(1)  # (bands, 1, dim)
+            ))
+
+    def __call__(self, x):
+        batch_shape = x.shape[:-1]
+        x = x.reshape(-1, x.shape[-1])
+
+        outs = []
+        for start, end, index, weight, bias in self.buckets:
+            bands = gather_bucket(x, start, end, index, weight.shape[0], weight.shape[1])
+            bands = F.normalize(bands, dim=-1)
+            out = torch.baddbmm(bias.to(bands.dtype), bands.transpose(0, 1), weight.to(bands.dtype))
+            outs.append(out.transpose(0, 1))
+
+        return torch.cat(outs, dim=1).reshape(*batch_shape, self.num_bands, -1)
+
+
+def fused_band_split(module, x):
+    # returns None when the band split cannot be fused (e.g. quantized or otherwise replaced linears)
+    if not all(is_norm_linear(net) for net in module.to_features):
+        return None
+
+    if module.training and torch.is_grad_enabled():
+        # packing is differentiable, but has to be redone after every optimizer step anyway
+        return PackedBandSplit(module)(x)
+
+    packed = getattr(module, '_packed', None)
+    if packed is None or packed.version != get_params_version(module):
+        with torch.no_grad():
+            packed = PackedBandSplit(module)
+        module._packed = packed
+
+    return packed(x)
+
+
+# fused mask head
+#
+# every (stem, band) pair owns an MLP followed by a GLU. neighbouring bands are grouped into buckets and
+# each layer of a bucket is packed into one tensor over (bands, stems): the first linear of all stems runs
+# as one wide projection (the input is shared), the others as batched matmuls. the pack holds the only copy
+# of the weights, the original linears are turned into views of it; a checkpoint saved from a packed model
+# loads straight into that layout. a bucket is walked a few bands at a time to bound the intermediate
+# activations: on cpu they are kept small enough to stay in cache, on accelerators large enough to amortize
+# launches
+#
+# only the output width of the last layer depends on the band. in a bucket of bands of different widths it
+# is zero-padded to the widest band after the band's own columns, so every linear is still a view of the
+# pack (its leading columns), and the GLU picks the value and gate columns of each band through an index,
+# which also drops the padding. the last layer is a small part of the MLP for narrow bands, so merging them
+# pays off on cpu as well; wide bands are kept apart there
+
+# share of the last layer's multiply-adds allowed to be padding in a bucket
+MAX_MASK_PADDING_WASTE = 0.25
+MAX_MASK_PADDING_WASTE_CPU = 0.1
+
+MAX_HIDDEN_ELEMENTS = 2 ** 24
+MAX_HIDDEN_ELEMENTS_CPU = 2 ** 20
+
+
+def get_max_hidden_elements(device):
+    return MAX_HIDDEN_ELEMENTS_CPU if device.type == 'cpu' else MAX_HIDDEN_ELEMENTS
+
+
+def get_max_mask_padding_waste(device):
+    return MAX_MASK_PADDING_WASTE_CPU if device.type == 'cpu' else MAX_MASK_PADDING_WASTE
+
+
+def get_mlp_glu_layers(net):
+    # Sequential(MLP(Linear, act, ..., Linear), GLU) -> ([linears], activation) or None
+    if not isinstance(net, nn.Sequential) or len(net) != 2 or not isinstance(net[1], nn.GLU):
+        return None
+    mlp = net[0]
+    if not isinstance(mlp, nn.Sequential) or net[1].dim != -1:
+        return None
+
+    linears = list(mlp[0::2])
+    activations = list(mlp[1::2])
+    if not all(type(linear) is nn.Linear for linear in linears) or len(activations) != len(linears) - 1:
+        return None
+    if len({type(activation) for activation in activations}) > 1:
+        return None
+    return linears, activations[0] if activations else None
+
+
+def get_out_dim(linears):
+    return max(linear.out_features for band in linears for linear in band)
+
+
+def pack_layer(linears, first):
+    # linears[band][stem] -> weight (bands, in, stems, out) and bias (bands, 1, stems, out) for the first layer,
+    # so that all stems flatten into one projection without a copy; (bands, stems, in, out) and
+    # (bands, stems, 1, out) for the others. out is the widest output of the bucket, narrower ones are padded
+    out_dim = get_out_dim(linears)
+
+    def pad(tensor):
+        return F.pad(tensor, (0, out_dim - tensor.shape[-1]))
+
+    if first:
+        weight = torch.stack([torch.stack([pad(linear.weight.t()) for linear in band], dim=1) for band in linears])
+        bias = torch.stack([torch.stack([pad(linear.bias) for linear in band]) for band in linears]).unsqueeze(1)
+    else:
+        weight = torch.stack([torch.stack([pad(linear.weight.t()) for linear in band]) for band in linears])
+        bias = torch.stack([torch.stack([pad(linear.bias) for linear in band]) for band in linears]).unsqueeze(2)
+    return weight, bias
+
+
+def get_layer_shapes(linears, first):
+    out_dim, in_dim = get_out_dim(linears), linears[0][0].in_features
+    num_bands, num_stems = len(linears), len(linears[0])
+    if first:
+        return (num_bands, in_dim, num_stems, out_dim), (num_bands, 1, num_stems, out_dim)
+    return (num_bands, num_stems, in_dim, out_dim), (num_bands, num_stems, 1, out_dim)
+
+
+def get_layer_views(weight, bias, row, stem, first, out_dim):
+    # the (weight, bias) of one linear inside the packed layer: the first out_dim columns of its slice
+    if first:
+        return weight[row, :, stem, :out_dim].t(), bias[row, 0, stem, :out_dim]
+    return weight[row, stem, :, :out_dim].t(), bias[row, stem, 0, :out_dim]
+
+
+def view_storage(tensor, shape):
+    # contiguous tensor of the given shape over the storage of tensor, starting where tensor starts; None if
+    # the storage is too small
+    numel = 1
+    for size in shape:
+        numel *= size
+    if (tensor.storage_offset() + numel) * tensor.element_size() > tensor.untyped_storage().nbytes():
+        return None
+
+    strides = []
+    stride = 1
+    for size in reversed(shape):
+        strides.insert(0, stride)
+        stride *= size
+    return tensor.new_empty(0).set_(tensor.untyped_storage(), tensor.storage_offset(), shape, strides)
+
+
+def is_same_view(a, b):
+    return a.untyped_storage().data_ptr() == b.untyped_storage().data_ptr() and \
+        a.storage_offset() == b.storage_offset() and a.shape == b.shape and a.stride() == b.stride()
+
+
+def find_packed_layer(linears, first):
+    # the packed layer the linears already are views of (a model loaded from a packed checkpoint), or None
+    weight_shape, bias_shape = get_layer_shapes(linears, first)
+    weight = view_storage(linears[0][0].weight, weight_shape)
+    bias = view_storage(linears[0][0].bias, bias_shape)
+    if weight is None or bias is None:
+        return None
+
+    for row, band in enumerate(linears):
+        for stem, linear in enumerate(band):
+            weight_view, bias_view = get_layer_views(weight, bias, row, stem, first, linear.out_features)
+            if not is_same_view(linear.weight, weight_view) or not is_same_view(linear.bias, bias_view):
+                return None
+    return weight, bias
+
+
+def share_layer(linears, weight, bias, first):
+    # points the parameters of the linears at their slices of the packed layer
+    for row, band in enumerate(linears):
+        for stem, linear in enumerate(band):
+            linear.weight.data, linear.bias.data = get_layer_views(weight, bias, row, stem, first, linear.out_features)
+
+
+def get_glu_index(dim_inputs, bucket, device):
+    # value and gate columns of every band in the flattened (bands * 2 * width) output of a padded bucket, and
+    # where each band's columns start in them. None when the bucket needs no padding
+    width = max(dim_inputs[i] for i in bucket)
+    if all(dim_inputs[i] == width for i in bucket):
+        return None
+
+    values, gates, starts = [], [], [0]
+    for row, band in enumerate(bucket):
+        columns = torch.arange(dim_inputs[band]) + row * 2 * width
+        values.append(columns)
+        gates.append(columns + dim_inputs[band])
+        starts.append(starts[-1] + dim_inputs[band])
+    return torch.cat(values).to(device), torch.cat(gates).to(device), starts, 2 * width
+
+
+def get_glu_columns(glu_index, start, end):
+    # the columns of bands start:end, relative to the output of those bands alone
+    values, gates, starts, row_width = glu_index
+    offset = start * row_width
+    return values[starts[start]:starts[end]] - offset, gates[starts[start]:starts[end]] - offset
+
+
+class PackedMaskEstimators:
+    def __init__(self, estimators, share_weights=False):
+        # share_weights: the estimators' linears become views of the packed layers (inference); otherwise the
+        # pack is a differentiable copy of them
+        self.num_stems = len(estimators)
+
+        dim_inputs = estimators[0].dim_inputs
+        device = next(estimators[0].parameters()).device
+        self.activation = get_mlp_glu_layers(estimators[0].to_freqs[0])[1]
+        self.max_hidden_elements = get_max_hidden_elements(device)
+
+        self.buckets = []
+        for bucket in get_band_buckets(dim_inputs, get_max_mask_padding_waste(device)):
+            # linears[layer][band][stem]
+            per_band = [[get_mlp_glu_layers(estimator.to_freqs[band])[0] for estimator in estimators]
+                        for band in bucket]
+            linears = [[[stem[index] for stem in band] for band in per_band] for index in range(len(per_band[0][0]))]
+
+            layers = []
+            for index, layer in enumerate(linears):
+                first = index == 0
+                packed = find_packed_layer(layer, first) if share_weights else None
+                if packed is None:
+                    packed = pack_layer(layer, first)
+                    if share_weights:
+                        share_layer(layer, *packed, first)
+                layers.append(packed)
+            self.buckets.append((bucket[0], layers, get_glu_index(dim_inputs, bucket, device)))
+
+        self.version = tuple(get_params_version(estimator) for estimator in estimators)
+
+    def __call__(self, x, stems=None):
+        # (..., bands, dim) -> (..., stems, sum(dim_inputs)) with the stem axis right before the features.
+        # stems: indices of the estimators to run, in output order; all of them by default
+        if stems is None or list(stems) == list(range(self.num_stems)):
+            return self.run(x)
+        return torch.cat([self.run(x, stem) for stem in stems], dim=-2)
+
+    def run(self, x, stem=None):
+        # all stems, or the given one alone through views of its slices of the pack
+        batch_shape = x.shape[:-2]
+        x = x.reshape(-1, *x.shape[-2:])
+        n = x.shape[0]
+        stems = self.num_stems if stem is None else 1
+
+        outs = []
+        for first, layers, glu_index in self.buckets:
+            (first_weight, first_bias), other_layers = layers[0], layers[1:]
+            num_bands = first_weight.shape[0]
+            max_dim = max(weight.shape[-1] for weight, _ in layers)
+            step = max(1, self.max_hidden_elements // (n * max_dim * stems))
+
+            for start in range(0, num_bands, step):
+                end = min(start + step, num_bands)
+                k = end - start
+
+                if stem is None:
+                    weight, bias = first_weight[start:end].flatten(2), first_bias[start:end].flatten(2)
+                else:
+                    weight, bias = first_weight[start:end, :, stem], first_bias[start:end, :, stem]
+                h = x[:, first + start:first + end].transpose(0, 1)  # (bands, n, dim)
+                h = torch.baddbmm(bias.to(h.dtype), h, weight.to(h.dtype))
+                h = h.view(k, n, stems, -1).transpose(1, 2)  # (bands, stems, n, out)
+
+                for weight, bias in other_layers:
+                    h = self.activation(h).reshape(k * stems, n, -1)
+                    if stem is None:
+                        weight, bias = weight[start:end].flatten(0, 1), bias[start:end].flatten(0, 1)
+                    else:
+                        weight, bias = weight[start:end, stem], bias[start:end, stem]
+                    h = torch.baddbmm(bias.to(h.dtype), h, weight.to(h.dtype)).view(k, stems, n, -1)
+
+                if glu_index is None:
+                    h = F.glu(h, dim=-1)  # (bands, stems, n, width)
+                    outs.append(h.permute(1, 2, 0, 3).reshape(stems, n, -1))
+                else:
+                    h = h.permute(1, 2, 0, 3).reshape(stems, n, -1)  # (stems, n, bands * 2 * width)
+                    value, gate = get_glu_columns(glu_index, start, end)
+                    outs.append(h.index_select(-1, value) * torch.sigmoid(h.index_select(-1, gate)))
+
+        out = torch.cat(outs, dim=-1)
+        return out.transpose(0, 1).reshape(*batch_shape, stems, -1)
+
+
+def get_estimators(owner):
+    return list(owner) if isinstance(owner, nn.ModuleList) else [owner]
+
+
+def is_fusable(estimators):
+    return all(get_mlp_glu_layers(net) is not None for estimator in estimators for net in estimator.to_freqs)
+
+
+def pack_mask_estimators(owner):
+    # the inference pack of owner (a mask estimator or a ModuleList of them), cached on it and rebuilt when the
+    # parameters change; None when the estimators cannot be fused
+    estimators = get_estimators(owner)
+    if not is_fusable(estimators):
+        return None
+
+    packed = getattr(owner, '_packed', None)
+    if packed is None or packed.version != tuple(get_params_version(estimator) for estimator in estimators):
+        # the previous pack goes first, it may hold the only copy of the weights it was built from. packed
+        # outside inference mode: the parameters become views of it and must stay usable for autograd
+        owner._packed = None
+        with torch.inference_mode(False), torch.no_grad():
+            packed = PackedMaskEstimators(estimators, share_weights=True)
+        owner._packed = packed
+    return packed
+
+
+def fused_mask_estimators(owner, x, stems=None):
+    # all (or the given) stems at once: returns (..., stems, features) or None when the estimators cannot be
+    # fused. owner is a mask estimator or a ModuleList of them
+    estimators = get_estimators(owner)
+    if not is_fusable(estimators):
+        return None
+
+    if any(estimator.training for estimator in estimators) and torch.is_grad_enabled():
+        return PackedMaskEstimators(estimators)(x, stems)
+
+    return pack_mask_estimators(owner)(x, stems)
@@ -1,11 +1,11 @@
-from functools import partial
-
 import torch
 from torch import nn, einsum, Tensor
 from torch.nn import Module, ModuleList
 import torch.nn.functional as F
 
 from models.attend import Attend
+from models.band_ops import fused_band_split, fused_mask_estimators, pack_mask_estimators
+from models.spectral import STFT, gather_bands
 from torch.utils.checkpoint import checkpoint
 
 from beartype.typing import Tuple, Optional, List, Callable
@@ -239,6 +239,10 @@ class BandSplit(Module):
             self.to_features.append(net)
 
     def forward(self, x):
+        fused = fused_band_split(self, x)
+        if exists(fused):
+            return fused
+
         x = x.split(self.dim_inputs, dim=-1)
 
         outs = []
@@ -299,6 +303,10 @@ class MaskEstimator(Module):
             self.to_freqs.append(mlp)
 
     def forward(self, x):
+        fused = fused_mask_estimators(self, x)
+        if exists(fused):
+            return fused[..., 0, :]
+
         x = x.unbind(dim=-2)
 
         outs = []
@@ -398,16 +406,15 @@ class BSRoformer(Module):
 
         self.final_norm = RMSNorm(dim)
 
-        self.stft_kwargs = dict(
+        self.stft = STFT(
             n_fft=stft_n_fft,
             hop_length=stft_hop_length,
             win_length=stft_win_length,
-            normalized=stft_normalized
+            normalized=stft_normalized,
+            window_fn=stft_window_fn
         )
 
-        self.stft_window_fn = partial(default(stft_window_fn, torch.hann_window), stft_win_length)
-
-        freqs = torch.stft(torch.randn(1, 4096), **self.stft_kwargs, window=torch.ones(stft_win_length), return_complex=True).shape[1]
+        freqs = self.stft.num_freqs
 
         assert len(freqs_per_bands) > 1
         assert sum(
@@ -444,11 +451,17 @@ class BSRoformer(Module):
             normalized=multi_stft_normalized
         )
 
+    def pack_weights(self):
+        # lays the mask estimator weights out the way the fused mask head runs them, so a checkpoint saved
+        # afterwards already holds the packed tensors
+        pack_mask_estimators(self.mask_estimators)
+
     def forward(
             self,
             raw_audio,
             target=None,
-            return_loss_breakdown=False
+            return_loss_breakdown=False,
+            stems=None
     ):
         """
         einops
@@ -460,13 +473,12 @@ class BSRoformer(Module):
         n - number of 'stems'
         c - complex (2)
         d - feature dimension
+
+        stems - optional indices of the mask estimators to run, in output order
         """
 
         device = raw_audio.device
 
-        # defining whether model is loaded on MPS (MacOS GPU accelerator)
-        x_is_mps = True if device.type == "mps" else False
-
         if raw_audio.ndim == 2:
             raw_audio = rearrange(raw_audio, 'b t -> b 1 t')
 
@@ -474,26 +486,11 @@ class BSRoformer(Module):
         assert (not self.stereo and channels == 1) or (
                     self.stereo and channels == 2), 'stereo needs to be set to True if passing in audio signal that is stereo (channel dimension of 2). also need to be False if mono (channel dimension of 1)'
 
-        # to stft
+        # to stft, stereo / mono merged into the frequency, with frequency leading dimension, for band splitting
 
-        raw_audio, batch_audio_channel_packed_shape = pack_one(raw_audio, '* t')
+        stft_repr = self.stft(raw_audio)
 
-        stft_window = self.stft_window_fn(device=device)
-
-        # RuntimeError: FFT operations are only supported on MacOS 14+
-        # Since it's tedious to define whether we're on correct MacOS version - simple try-catch is used
-        try:
-            stft_repr = torch.stft(raw_audio, **self.stft_kwargs, window=stft_window, return_complex=True)
-        except:
-            stft_repr = torch.stft(raw_audio.cpu() if x_is_mps else raw_audio, **self.stft_kwargs, window=stft_window.cpu() if x_is_mps else stft_window, return_complex=True).to(device)
-
-        stft_repr = torch.view_as_real(stft_repr)
-
-        stft_repr = unpack_one(stft_repr, batch_audio_channel_packed_shape, '* f t c')
-        stft_repr = rearrange(stft_repr,
-                              'b s f t c -> b (f s) t c')  # merge stereo / mono into the frequency, with frequency leading dimension, for band splitting
-
-        x = rearrange(stft_repr, 'b f t c -> b t (f c)')
+        x = gather_bands(stft_repr)
 
         if self.use_torch_checkpoint:
             x = checkpoint(self.band_split, x, use_reentrant=False)
@@ -546,36 +543,33 @@ class BSRoformer(Module):
 
         x = self.final_norm(x)
 
-        num_stems = len(self.mask_estimators)
+        # only the requested stems: the skipped mask estimators are never evaluated
+        mask_estimators = self.mask_estimators if not exists(stems) else [self.mask_estimators[i] for i in stems]
+        num_stems = len(mask_estimators)
 
         if self.use_torch_checkpoint:
-            mask = torch.stack([checkpoint(fn, x, use_reentrant=False) for fn in self.mask_estimators], dim=1)
+            mask = torch.stack([checkpoint(fn, x, use_reentrant=False) for fn in mask_estimators], dim=1)
         else:
-            mask = torch.stack([fn(x) for fn in self.mask_estimators], dim=1)
+            mask = fused_mask_estimators(self.mask_estimators, x, stems)
+            if exists(mask):
+                mask = rearrange(mask, 'b t n f -> b n t f')
+            else:
+                mask = torch.stack([fn(x) for fn in mask_estimators], dim=1)
         mask = rearrange(mask, 'b n t (f c) -> b n f t c', c=2)
 
         # modulate frequency representation
 
-        stft_repr = rearrange(stft_repr, 'b f t c -> b 1 f t c')
+        stft_repr = rearrange(stft_repr, 'b f t -> b 1 f t')
 
         # complex number multiplication
 
-        stft_repr = torch.view_as_complex(stft_repr)
         mask = torch.view_as_complex(mask)
 
         stft_repr = stft_repr * mask
 
         # istft
 
-        stft_repr = rearrange(stft_repr, 'b n (f s) t -> (b n s) f t', s=self.audio_channels)
-
-        # same as torch.stft() fix for MacOS MPS above
-        try:
-            recon_audio = torch.istft(stft_repr, **self.stft_kwargs, window=stft_window, return_complex=False, length=raw_audio.shape[-1])
-        except:
-            recon_audio = torch.istft(stft_repr.cpu() if x_is_mps else stft_repr, **self.stft_kwargs, window=stft_window.cpu() if x_is_mps else stft_window, return_complex=False, length=raw_audio.shape[-1]).to(device)
-
-        recon_audio = rearrange(recon_audio, '(b n s) t -> b n s t', s=self.audio_channels, n=num_stems)
+        recon_audio = self.stft.inverse(stft_repr, self.audio_channels, length=raw_audio.shape[-1])
 
         if num_stems == 1:
             recon_audio = rearrange(recon_audio, 'b 1 s t -> b s t')
@@ -11,7 +11,6 @@ from demucs.demucs import Demucs
 from demucs.hdemucs import HDemucs
 
 import math
-from openunmix.filtering import wiener
 from torch import nn
 from torch.nn import functional as F
 from fractions import Fraction
@@ -23,6 +22,7 @@ from demucs.demucs import rescale_module
 from demucs.states import capture_init
 from demucs.spec import spectro, ispectro
 from demucs.hdemucs import pad1d, ScaledEmbedding, HEncLayer, MultiWrap, HDecLayer
+from models.wiener import windowed_wiener
 
 
 class HTDemucs(nn.Module):
@@ -491,27 +491,7 @@ class HTDemucs(nn.Module):
         residual = self.wiener_residual
 
         B, S, C, Fq, T = mag_out.shape
-        mag_out = mag_out.permute(0, 4, 3, 2, 1)
-        mix_stft = torch.view_as_real(mix_stft.permute(0, 3, 2, 1))
-
-        outs = []
-        for sample in range(B):
-            pos = 0
-            out = []
-            for pos in range(0, T, wiener_win_len):
-                frame = slice(pos, pos + wiener_win_len)
-                z_out = wiener(
-                    mag_out[sample, frame],
-                    mix_stft[sample, frame],
-                    niters,
-                    residual=residual,
-                )
-                out.append(z_out.transpose(-1, -2))
-            outs.append(torch.cat(out, dim=0))
-        out = torch.view_as_complex(torch.stack(outs, 0))
-        out = out.permute(0, 4, 3, 2, 1).contiguous()
-        if residual:
-            out = out[:, :-1]
+        out = windowed_wiener(mag_out, mix_stft, niters, residual=residual, window=wiener_win_len)
         assert list(out.shape) == [B, S, C, Fq, T]
         return out.to(init)
 
@@ -545,7 +525,9 @@ class HTDemucs(nn.Module):
         x = x.reshape(b, c // k, f * k, t)
         return x
 
-    def forward(self, mix):
+    def forward(self, mix, stems=None):
+        # `stems`: optional indices of the sources to return. The decoder is shared by all sources,
+        # the masking, Wiener filtering and iSTFT only run for the requested ones.
         length = mix.shape[-1]
         length_pre_pad = None
         if self.use_train_segment:
@@ -673,7 +655,13 @@ class HTDemucs(nn.Module):
         x = x * std[:, None] + mean[:, None]
         # print("X returned: {}".format(x.shape))
 
+        # Wiener EM couples the sources, so with it they can only be dropped after masking.
+        joint_mask = not self.cac and (self.end_iters if self.training else self.wiener_iters) > 0
+        if stems is not None and not joint_mask:
+            x = x[:, stems]
         zout = self._mask(z, x)
+        if stems is not None and joint_mask:
+            zout = zout[:, stems]
         if self.use_train_segment:
             if self.training:
                 x = self._ispec(zout, length)
@@ -689,6 +677,8 @@ class HTDemucs(nn.Module):
                 xt = xt.view(B, S, -1, training_length)
         else:
             xt = xt.view(B, S, -1, length)
+        if stems is not None:
+            xt = xt[:, stems]
         xt = xt * stdt[:, None] + meant[:, None]
         x = x.to(self.encoder[0].conv.weight.device)
         x = xt + x
@@ -1,11 +1,11 @@
-from functools import partial
-
 import torch
 from torch import nn, einsum, Tensor
 from torch.nn import Module, ModuleList
 import torch.nn.functional as F
 
 from models.attend import Attend
+from models.band_ops import fused_band_split, fused_mask_estimators, pack_mask_estimators
+from models.spectral import STFT, gather_bands
 from torch.utils.checkpoint import checkpoint
 
 from beartype.typing import Tuple, Optional, List, Callable
@@ -248,6 +248,10 @@ class BandSplit(Module):
             self.to_features.append(net)
 
     def forward(self, x):
+        fused = fused_band_split(self, x)
+        if exists(fused):
+            return fused
+
         x = x.split(self.dim_inputs, dim=-1)
 
         outs = []
@@ -308,6 +312,10 @@ class MaskEstimator(Module):
             self.to_freqs.append(mlp)
 
     def forward(self, x):
+        fused = fused_mask_estimators(self, x)
+        if exists(fused):
+            return fused[..., 0, :]
+
         x = x.unbind(dim=-2)
 
         outs = []
@@ -393,16 +401,15 @@ class MelBandRoformer(Module):
             )
             self.layers.append(nn.ModuleList(tran_modules))
 
-        self.stft_window_fn = partial(default(stft_window_fn, torch.hann_window), stft_win_length)
-
-        self.stft_kwargs = dict(
+        self.stft = STFT(
             n_fft=stft_n_fft,
             hop_length=stft_hop_length,
             win_length=stft_win_length,
-            normalized=stft_normalized
+            normalized=stft_normalized,
+            window_fn=stft_window_fn
         )
 
-        freqs = torch.stft(torch.randn(1, 4096), **self.stft_kwargs, window=torch.ones(stft_n_fft), return_complex=True).shape[1]
+        freqs = self.stft.num_freqs
 
         # create mel filter bank
         # with librosa.filters.mel as in section 2 of paper
@@ -477,11 +484,17 @@ class MelBandRoformer(Module):
 
         self.match_input_audio_length = match_input_audio_length
 
+    def pack_weights(self):
+        # lays the mask estimator weights out the way the fused mask head runs them, so a checkpoint saved
+        # afterwards already holds the packed tensors
+        pack_mask_estimators(self.mask_estimators)
+
     def forward(
             self,
             raw_audio,
             target=None,
-            return_loss_breakdown=False
+            return_loss_breakdown=False,
+            stems=None
     ):
         """
         einops
@@ -493,6 +506,8 @@ class MelBandRoformer(Module):
         n - number of 'stems'
         c - complex (2)
         d - feature dimension
+
+        stems - optional indices of the mask estimators to run, in output order
         """
 
         device = raw_audio.device
@@ -507,30 +522,14 @@ class MelBandRoformer(Module):
         assert (not self.stereo and channels == 1) or (
                     self.stereo and channels == 2), 'stereo needs to be set to True if passing in audio signal that is stereo (channel dimension of 2). also need to be False if mono (channel dimension of 1)'
 
-        # to stft
-
-        raw_audio, batch_audio_channel_packed_shape = pack_one(raw_audio, '* t')
-
-        stft_window = self.stft_window_fn(device=device)
+        # to stft, stereo / mono merged into the frequency, with frequency leading dimension, for band splitting
 
-        stft_repr = torch.stft(raw_audio, **self.stft_kwargs, window=stft_window, return_complex=True)
-        stft_repr = torch.view_as_real(stft_repr)
+        stft_repr = self.stft(raw_audio)
 
-        stft_repr = unpack_one(stft_repr, batch_audio_channel_packed_shape, '* f t c')
-        stft_repr = rearrange(stft_repr,
-                              'b s f t c -> b (f s) t c')  # merge stereo / mono into the frequency, with frequency leading dimension, for band splitting
+        # index out all frequencies for all frequency ranges across bands ascending in one go (stereo accounted
+        # for in freq_indices), folding the complex (real and imag) into the frequencies dimension
 
-        # index out all frequencies for all frequency ranges across bands ascending in one go
-
-        batch_arange = torch.arange(batch, device=device)[..., None]
-
-        # account for stereo
-
-        x = stft_repr[batch_arange, self.freq_indices]
-
-        # fold the complex (real and imag) into the frequencies dimension
-
-        x = rearrange(x, 'b f t c -> b t (f c)')
+        x = gather_bands(stft_repr, self.freq_indices)
 
         if self.use_torch_checkpoint:
             x = checkpoint(self.band_split, x, use_reentrant=False)
@@ -581,20 +580,25 @@ class MelBandRoformer(Module):
             if self.skip_connection:
                 store[i] = x
 
-        num_stems = len(self.mask_estimators)
+        # only the requested stems: the skipped mask estimators are never evaluated
+        mask_estimators = self.mask_estimators if not exists(stems) else [self.mask_estimators[i] for i in stems]
+        num_stems = len(mask_estimators)
         if self.use_torch_checkpoint:
-            masks = torch.stack([checkpoint(fn, x, use_reentrant=False) for fn in self.mask_estimators], dim=1)
+            masks = torch.stack([checkpoint(fn, x, use_reentrant=False) for fn in mask_estimators], dim=1)
         else:
-            masks = torch.stack([fn(x) for fn in self.mask_estimators], dim=1)
+            masks = fused_mask_estimators(self.mask_estimators, x, stems)
+            if exists(masks):
+                masks = rearrange(masks, 'b t n f -> b n t f')
+            else:
+                masks = torch.stack([fn(x) for fn in mask_estimators], dim=1)
         masks = rearrange(masks, 'b n t (f c) -> b n f t c', c=2)
 
         # modulate frequency representation
 
-        stft_repr = rearrange(stft_repr, 'b f t c -> b 1 f t c')
+        stft_repr = rearrange(stft_repr, 'b f t -> b 1 f t')
 
         # complex number multiplication
 
-        stft_repr = torch.view_as_complex(stft_repr)
         masks = torch.view_as_complex(masks)
 
         masks = masks.type(stft_repr.dtype)
@@ -603,8 +607,7 @@ class MelBandRoformer(Module):
 
         scatter_indices = repeat(self.freq_indices, 'f -> b n f t', b=batch, n=num_stems, t=stft_repr.shape[-1])
 
-        stft_repr_expanded_stems = repeat(stft_repr, 'b 1 ... -> b n ...', n=num_stems)
-        masks_summed = torch.zeros_like(stft_repr_expanded_stems).scatter_add_(2, scatter_indices, masks)
+        masks_summed = stft_repr.new_zeros((batch, num_stems, *stft_repr.shape[2:])).scatter_add_(2, scatter_indices, masks)
 
         denom = repeat(self.num_bands_per_freq, 'f -> (f r) 1', r=channels)
 
@@ -616,12 +619,7 @@ class MelBandRoformer(Module):
 
         # istft
 
-        stft_repr = rearrange(stft_repr, 'b n (f s) t -> (b n s) f t', s=self.audio_channels)
-
-        recon_audio = torch.istft(stft_repr, **self.stft_kwargs, window=stft_window, return_complex=False,
-                                  length=istft_length)
-
-        recon_audio = rearrange(recon_audio, '(b n s) t -> b n s t', b=batch, s=self.audio_channels, n=num_stems)
+        recon_audio = self.stft.inverse(stft_repr, self.audio_channels, length=istft_length)
 
         if num_stems == 1:
             recon_audio = rearrange(recon_audio, 'b 1 s t -> b s t')
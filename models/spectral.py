@@ -0,0 +1,93 @@
+import torch
+from torch.nn import Module
+
+from einops import rearrange, pack, unpack
+
+# stft front-end shared by bs_roformer and mel_band_roformer
+#
+# the analysis window is a (non persistent) buffer, so it follows the model across devices instead of being
+# rebuilt for every chunk batch. devices whose fft kernels fail (mps before macos 14) are remembered, and
+# later calls go straight to the cpu instead of raising and retrying every time
+
+
+def exists(val):
+    return val is not None
+
+
+class STFT(Module):
+    def __init__(
+            self,
+            n_fft=2048,
+            hop_length=512,
+            win_length=2048,
+            normalized=False,
+            window_fn=None
+    ):
+        super().__init__()
+        self.stft_kwargs = dict(
+            n_fft=n_fft,
+            hop_length=hop_length,
+            win_length=win_length,
+            normalized=normalized
+        )
+
+        window_fn = window_fn if exists(window_fn) else torch.hann_window
+        self.register_buffer('window', window_fn(win_length), persistent=False)
+
+        # one sided spectrum of a real signal
+        self.num_freqs = n_fft // 2 + 1
+
+        # device -> window copy, for devices other than the one holding the buffer (the cpu fallback)
+        self._windows = {}
+        # device type -> whether its own fft kernels work
+        self._native = {}
+
+    def get_window(self, device):
+        if self.window.device == device:
+            return self.window
+        key = str(device)
+        window = self._windows.get(key)
+        if not exists(window) or window.device != device or window.dtype != self.window.dtype:
+            window = self.window.to(device)
+            self._windows[key] = window
+        return window
+
+    def _run(self, fn, x, **kwargs):
+        device = x.device
+        if self._native.get(device.type, True):
+            try:
+                return fn(x, **self.stft_kwargs, window=self.get_window(device), **kwargs)
+            except RuntimeError:
+                # only the mps fft is known to be missing, anything else is a real error
+                if device.type != 'mps':
+                    raise
+                self._native[device.type] = False
+
+        cpu = torch.device('cpu')
+        return fn(x.to(cpu), **self.stft_kwargs, window=self.get_window(cpu), **kwargs).to(device)
+
+    def forward(self, raw_audio):
+        # (b, s, t) -> complex (b, (f s), t), stereo merged into the frequencies for band splitting
+        raw_audio, ps = pack([raw_audio], '* t')
+        stft_repr = self._run(torch.stft, raw_audio, return_complex=True)
+        stft_repr, = unpack(stft_repr, ps, '* f t')
+        return rearrange(stft_repr, 'b s f t -> b (f s) t')
+
+    def inverse(self, stft_repr, audio_channels, length=None):
+        # complex (b, n, (f s), t) -> (b, n, s, t)
+        b, n = stft_repr.shape[:2]
+        stft_repr = rearrange(stft_repr, 'b n (f s) t -> (b n s) f t', s=audio_channels)
+        recon_audio = self._run(torch.istft, stft_repr, return_complex=False, length=length)
+        return rearrange(recon_audio, '(b n s) t -> b n s t', b=b, n=n, s=audio_channels)
+
+
+def gather_bands(stft_repr, freq_indices=None):
+    # complex (b, f, t) -> real band split input (b, t, (f c)), optionally only the frequencies at freq_indices.
+    # the gather writes straight into the (b, t, f, c) layout, so the full resolution spectrum is never
+    # copied into an intermediate transposed or gathered tensor
+    x = torch.view_as_real(stft_repr).transpose(1, 2)
+
+    if exists(freq_indices):
+        x = x.index_select(2, freq_indices)
+
+    return x.reshape(*x.shape[:2], -1)
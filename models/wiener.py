@@ -0,0 +1,118 @@
+"""
+Batched multichannel Wiener filtering.
+
+Same algorithm as `openunmix.filtering.wiener` (mixture phase as initial estimate, optional
+residual source, EM refinement), but on complex tensors with any number of leading batch
+dimensions, so every sample and every window of a track is filtered in one call.
+"""
+import torch
+
+# Upper bound on the elements of one group of windows (per source and channel pair), keeps the
+# temporaries of the EM step at a few hundred MB for long tracks
+WIENER_MAX_ELEMENTS = 1 << 24
+
+
+def _invert(m):
+    # closed form for the usual mono / stereo case, generic inverse otherwise
+    channels = m.shape[-1]
+    if channels == 1:
+        return 1 / m
+    if channels == 2:
+        a, b = m[..., 0, 0], m[..., 0, 1]
+        c, d = m[..., 1, 0], m[..., 1, 1]
+        inv_det = 1 / (a * d - b * c)
+        return torch.stack([
+            torch.stack([d, -b], dim=-1),
+            torch.stack([-c, a], dim=-1),
+        ], dim=-2) * inv_det[..., None, None]
+    return torch.linalg.inv(m)
+
+
+def expectation_maximization(y, x, iterations=1, eps=1e-10):
+    """
+    EM refinement of the source estimates.
+
+    Args:
+        y: complex estimates, shape `[*, T, Fq, C, S]`.
+        x: complex mixture, shape `[*, T, Fq, C]`.
+
+    Spatial covariances are estimated over the T axis independently for every leading index.
+    """
+    channels = x.shape[-1]
+    eye = torch.eye(channels, dtype=x.dtype, device=x.device)
+    regularization = eps ** 0.5 * eye
+    for _ in range(iterations):
+        # power spectral densities, [*, T, Fq, S]
+        v = y.real.square().add(y.imag.square()).mean(dim=-2)
+        # spatial covariance matrices, [*, Fq, C, C, S]
+        weight = eps + v.sum(dim=-3)
+        R = torch.einsum('...tfcs,...tfds->...fcds', y, y.conj())
+        R = R / weight[..., None, None, :]
+
+        cxx = torch.einsum('...tfs,...fcds->...tfcd', v.to(x.dtype), R) + regularization
+        z = torch.einsum('...tfcd,...tfd->...tfc', _invert(cxx), x)
+        y = torch.einsum('...fcds,...tfd->...tfcs', R, z) * v[..., None, :]
+    return y
+
+
+def wiener(targets_spectrograms, mix_stft, iterations=1, residual=False, scale_factor=10.0, eps=1e-10):
+    """
+    Args:
+        targets_spectrograms: magnitudes, shape `[*, T, Fq, C, S]`.
+        mix_stft: complex mixture, shape `[*, T, Fq, C]`.
+
+    Returns the complex estimates, `[*, T, Fq, C, S]` (or `S + 1` sources with `residual`).
+    Everything along T shares one covariance estimate and one scaling, as one call of the
+    OpenUnmix version would.
+    """
+    phase = torch.polar(torch.ones_like(mix_stft.real), mix_stft.angle())
+    y = targets_spectrograms.to(phase.dtype) * phase[..., None]
+    if residual:
+        y = torch.cat([y, mix_stft[..., None] - y.sum(dim=-1, keepdim=True)], dim=-1)
+    if iterations == 0:
+        return y
+
+    max_abs = mix_stft.abs().flatten(-3).max(dim=-1).values / scale_factor
+    max_abs = max_abs.clamp(min=1.0)[..., None, None, None]
+    y = expectation_maximization(y / max_abs[..., None], mix_stft / max_abs, iterations, eps=eps)
+    return y * max_abs[..., None]
+
+
+def windowed_wiener(mag_out, mix_stft, iterations, residual=False, window=300,
+                    max_elements=WIENER_MAX_ELEMENTS):
+    """
+    Wiener filtering in independent windows of `window` frames, all batch items and windows
+    at once.
+
+    Args:
+        mag_out: magnitudes, shape `[B, S, C, Fq, T]`.
+        mix_stft: complex mixture, shape `[B, C, Fq, T]`.
+
+    Returns complex estimates of shape `[B, S, C, Fq, T]`, the residual source dropped.
+    Zero frames padding the last window change neither the covariances nor the scaling, so
+    the result matches filtering each window on its own.
+    """
+    B, S, C, Fq, T = mag_out.shape
+    windows = -(-T // window)
+    pad = windows * window - T
+    mag_out = torch.nn.functional.pad(mag_out, (0, pad))
+    mix_stft = torch.nn.functional.pad(mix_stft, (0, pad))
+
+    # [B * windows, window, Fq, C, S] and [B * windows, window, Fq, C]
+    mag_out = mag_out.view(B, S, C, Fq, windows, window).permute(0, 4, 5, 3, 2, 1)
+    mag_out = mag_out.reshape(B * windows, window, Fq, C, S)
+    mix_stft = mix_stft.view(B, C, Fq, windows, window).permute(0, 3, 4, 2, 1)
+    mix_stft = mix_stft.reshape(B * windows, window, Fq, C)
+
+    sources = S + 1 if residual else S
+    per_window = window * Fq * C * max(C, sources)
+    group = max(1, max_elements // per_window) if iterations else B * windows
+    out = []
+    for start in range(0, B * windows, group):
+        sl = slice(start, start + group)
+        out.append(wiener(mag_out[sl], mix_stft[sl], iterations, residual=residual)[..., :S])
+    out = torch.cat(out, dim=0)
+
+    out = out.view(B, windows, window, Fq, C, S).permute(0, 5, 4, 3, 1, 2)
+    out = out.reshape(B, S, C, Fq, windows * window)
+    return out[..., :T]
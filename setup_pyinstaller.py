@@ -161,6 +161,7 @@ def build_app():
             '--hidden-import=demucs.htdemucs',
             '--hidden-import=PyQt5.QtCore',
             '--hidden-import=PyQt5.QtGui',
+            '--hidden-import=PyQt5.QtMultimedia',
             '--hidden-import=demucs',
             '--hidden-import=soundfile',
             '--hidden-import=customtkinter',
@@ -1,21 +1,17 @@
 import numpy as np
-import torch
-import torchaudio
-import vlc
-import tempfile
 import os
-import soundfile as sf
-import matplotlib.pyplot as plt
-from matplotlib.figure import Figure
-from PIL import Image
-import io
 import time
 from PyQt5.QtWidgets import (QWidget, QLabel, QPushButton, QSlider, QVBoxLayout,
                              QHBoxLayout, QFrame, QScrollArea, QFileDialog, QGraphicsView,
-                             QGraphicsScene, QGraphicsPixmapItem, QSizePolicy, QApplication, QDialog)
+                             QGraphicsScene, QGraphicsPixmapItem, QSizePolicy, QApplication, QDialog,
+                             QProgressDialog)
 from PyQt5.QtCore import Qt, QSize, QTimer, QThread, pyqtSignal, QPropertyAnimation, QEasingCurve
 from PyQt5.QtGui import QPixmap, QImage, QFont, QPainter, QColor, QIcon, QPalette, QBrush, QLinearGradient, QPen
 
+from templates.waveform import PeakPyramid, render_waveform
+from templates.mixer import ArraySource, FileSource, StemMixer, MixerPlayback
+from templates.export import ExportThread, EXPORT_FILTER
+
 
 class AudioPlayer:
     def __init__(self, root, tracks_data, original_file=None):
@@ -23,8 +19,7 @@ class AudioPlayer:
         self.tracks = {}
         self.audio_data = tracks_data
         self.playing = False
-        self.active_players = {}
-        self.temp_files = []
+        self.export_thread = None
         self.original_file = original_file
 
         self.waveform_views = {}
@@ -32,9 +27,6 @@ class AudioPlayer:
         self.waveform_originals = {}
         self.position_markers = {}
 
-        self.base_waveform_width = 1500
-        self.base_waveform_height = 300
-
         if self.root.layout() is not None:
             QWidget().setLayout(self.root.layout())
 
@@ -252,21 +244,19 @@ class AudioPlayer:
         main_layout.addWidget(tracks_container, 1)
 
         self.track_colors = {
-            'vocals': {"main": "#FF5555", "bg": "#4D1919", "plot": [1.0, 0.33, 0.33]},
-            'bass': {"main": "#5555FF", "bg": "#19194D", "plot": [0.33, 0.33, 1.0]},
-            'drums': {"main": "#55FF55", "bg": "#194D19", "plot": [0.33, 1.0, 0.33]},
-            'guitar': {"main": "#FFFF55", "bg": "#4D4D19", "plot": [1.0, 1.0, 0.33]},
-            'piano': {"main": "#FF55FF", "bg": "#4D194D", "plot": [1.0, 0.33, 1.0]},
-            'other': {"main": "#55FFFF", "bg": "#194D4D", "plot": [0.33, 1.0, 1.0]}
+            'vocals': {"main": "#FF5555", "bg": "#4D1919"},
+            'bass': {"main": "#5555FF", "bg": "#19194D"},
+            'drums': {"main": "#55FF55", "bg": "#194D19"},
+            'guitar': {"main": "#FFFF55", "bg": "#4D4D19"},
+            'piano': {"main": "#FF55FF", "bg": "#4D194D"},
+            'other': {"main": "#55FFFF", "bg": "#194D4D"}
         }
 
-        self.default_color = {"main": "#FFFFFF", "bg": "#4D4D4D", "plot": [1.0, 1.0, 1.0]}
+        self.default_color = {"main": "#FFFFFF", "bg": "#4D4D4D"}
 
         for name, data in self.audio_data.items():
             self.prepare_track(name, data)
-            waveform_data = data['waveform_data']
-            color = self.track_colors.get(name.lower(), self.default_color)["plot"]
-            self.waveform_originals[name.lower()] = self.create_original_waveform(waveform_data, color)
+            self.waveform_originals[name.lower()] = data['peaks']
 
         for name, data in self.audio_data.items():
             track_color = self.track_colors.get(name.lower(), self.default_color)
@@ -279,8 +269,8 @@ class AudioPlayer:
 
         QTimer.singleShot(200, self.init_waveforms)
 
-        self.vlc_instance = vlc.Instance()
         self.master_volume_value = 1.0
+        self.create_mixer()
 
     def init_waveforms(self):
         for name in self.audio_data.keys():
@@ -389,12 +379,7 @@ class AudioPlayer:
                 width = 400
 
             if name in self.waveform_originals:
-                pixmap = self.create_waveform_pixmap(
-                    self.waveform_originals[name],
-                    width,
-                    height,
-                    high_quality=True
-                )
+                pixmap = self.create_waveform_pixmap(name, width, height)
 
                 self.waveform_images[name] = pixmap
 
@@ -416,23 +401,31 @@ class AudioPlayer:
             import traceback
             traceback.print_exc()
 
+    def create_mixer(self):
+        # Все стемы микшируются из памяти в один аудиовыход, громкость трека - это его коэффициент в миксе
+        self.mixer_names = [name.lower() for name in self.audio_data]
+        # Стемы воспроизводятся нормализованными по пику, как и раньше
+        self.mixer_scales = np.array([1 / data['peaks'].peak for data in self.audio_data.values()], dtype=np.float32)
+        sources = []
+        for track_data in self.audio_data.values():
+            sources.append(ArraySource(track_data['data']) if 'data' in track_data else FileSource(track_data['path']))
+
+        self.sample_rate = next(iter(self.audio_data.values()))['sr'] if self.audio_data else 44100
+        self.mixer = StemMixer(sources, self.sample_rate)
+        self.playback = MixerPlayback(self.mixer, self.root, on_finished=self.on_playback_finished)
+
+        self.track_duration = self.mixer.frames / self.sample_rate
+        self.total_time_label.setText(self.format_time(self.track_duration))
+        self.update_tracks_volume()
+
     def play_all(self):
         if not self.playing:
             self.playing = True
             self.play_button.setText("⏸")
-
-            tracks_to_play = self.get_tracks_to_play()
-
-            for name in tracks_to_play:
-                if name in self.active_players:
-                    self.active_players[name].play()
-                else:
-                    self.play_track(name)
-
+            self.playback.play()
             self.start_position_updater()
         else:
-            for name, player in self.active_players.items():
-                player.pause()
+            self.playback.pause()
             self.playing = False
             self.play_button.setText("▶")
 
@@ -443,62 +436,49 @@ class AudioPlayer:
             self.position_timer.start(30)
 
     def update_position_slider(self):
-        if self.slider_being_dragged or not self.active_players:
+        if self.slider_being_dragged or self.mixer.frames == 0:
             return
 
-        player = next(iter(self.active_players.values()))
-
-        current_time = player.get_time() / 1000
-        duration = player.get_length() / 1000
-
-        if duration > 0 and abs(duration - self.track_duration) > 0.1:
-            self.track_duration = duration
-            self.total_time_label.setText(self.format_time(duration))
-
-        if current_time >= 0 and duration > 0:
-            self.current_position = current_time
-            self.current_time_label.setText(self.format_time(current_time))
-            position_value = int((current_time / duration) * 1000)
-            self.position_slider.setValue(position_value)
-
-            for name in self.active_players:
-                if name in self.position_markers and name in self.waveform_views:
-                    position_ratio = current_time / duration
-                    view_width = self.waveform_views[name].width()
-                    x_pos = int(position_ratio * view_width)
-
-                    marker = self.position_markers[name]
-                    marker.setLine(x_pos, 0, x_pos, self.waveform_views[name].height())
+        position_ratio = self.playback.playhead() / self.mixer.frames
+        current_time = position_ratio * self.track_duration
 
-    def update_position(self, name):
-        if name in self.active_players:
-            player = self.active_players[name]
+        self.current_position = current_time
+        self.current_time_label.setText(self.format_time(current_time))
+        self.position_slider.setValue(int(position_ratio * 1000))
+        self.update_position_markers(position_ratio)
 
-            duration = player.get_length() / 1000
-            if duration > 0:
-                current_time = player.get_time() / 1000
-                position_ratio = current_time / duration
-                view_width = self.waveform_views[name].width()
-                x_pos = int(position_ratio * view_width)
+    def update_position_markers(self, position_ratio):
+        for name, marker in self.position_markers.items():
+            if name in self.waveform_views:
+                view = self.waveform_views[name]
+                x_pos = int(position_ratio * view.width())
+                marker.setLine(x_pos, 0, x_pos, view.height())
 
-                scene = self.waveform_views[name].scene()
-                if scene and name in self.position_markers:
-                    marker = self.position_markers[name]
-                    marker.setLine(x_pos, 0, x_pos, self.waveform_views[name].height())
-
-            QTimer.singleShot(30, lambda: self.update_position(name))
+    def on_playback_finished(self):
+        self.playing = False
+        self.play_button.setText("▶")
+        self.update_position_slider()
 
     def stop_all(self):
-        for name, player in self.active_players.items():
-            player.stop()
-            if self.tracks[name]['data']['temp_file']:
-                media = self.vlc_instance.media_new(self.tracks[name]['data']['temp_file'])
-                player.set_media(media)
+        self.playback.stop()
 
         self.playing = False
         self.play_button.setText("▶")
         self.position_slider.setValue(0)
         self.current_time_label.setText("0:00")
+        self.update_position_markers(0)
+
+    def close(self):
+        if self.export_thread is not None:
+            # Стемы могут лежать в общей памяти, которую освободят сразу после закрытия плеера
+            self.export_thread.requestInterruption()
+            self.export_thread.wait()
+            self.export_thread = None
+
+        if hasattr(self, 'position_timer') and self.position_timer is not None:
+            self.position_timer.stop()
+            self.position_timer = None
+        self.playback.close()
 
     def get_tracks_to_play(self):
         solo_tracks = [name for name, track in self.tracks.items() if track['is_solo']]
@@ -508,224 +488,107 @@ class AudioPlayer:
         else:
             return [name for name, track in self.tracks.items() if not track['is_muted']]
 
-    def stop_track(self, name):
-        if name.lower() in self.active_players:
-            self.active_players[name.lower()].stop()
-            del self.active_players[name.lower()]
-
-    def play_track(self, name):
-        try:
-            track = self.tracks[name.lower()]
-            temp_file = track['data']['temp_file']
-            volume_val = track['volume'].value() / 100
-
-            adjusted_volume = volume_val * self.master_volume_value
-
-            media = self.vlc_instance.media_new(temp_file)
-            player = self.vlc_instance.media_player_new()
-            player.set_media(media)
-
-            player.audio_set_volume(int(adjusted_volume * 100))
-
-            player.play()
-            self.active_players[name.lower()] = player
-
-            QTimer.singleShot(100, lambda: self.update_position(name.lower()))
-
-        except Exception as e:
-            print(f"Ошибка при воспроизведении трека {name}: {e}")
-            import traceback
-            traceback.print_exc()
-
     def update_master_volume(self, value):
         self.master_volume_value = value
-
-        for name, player in self.active_players.items():
-            track_volume = self.tracks[name]['volume'].value() / 100
-            adjusted_volume = int(track_volume * value * 100)
-            player.audio_set_volume(adjusted_volume)
+        self.update_tracks_volume()
 
     def update_volume(self, name, value):
-        if name.lower() in self.active_players:
-            adjusted_volume = value * self.master_volume_value
-            self.active_players[name.lower()].audio_set_volume(int(adjusted_volume * 100))
+        self.update_tracks_volume()
 
     def save_results(self):
+        from PyQt5.QtWidgets import QMessageBox
+
         if self.playing:
             self.stop_all()
 
+        if self.export_thread is not None:
+            QMessageBox.information(self.root, "Сохранение", "Экспорт уже выполняется.")
+            return
+
         tracks_to_mix = self.get_tracks_to_play()
 
         if not tracks_to_mix:
-            from PyQt5.QtWidgets import QMessageBox
             QMessageBox.warning(self.root, "Внимание",
                                 "Нечего сохранять: все треки заглушены. Включите хотя бы один трек.")
             return
 
-        first_track = self.audio_data[tracks_to_mix[0].lower()]
-        sample_rate = first_track['sr']
-
-        mixed_data = None
-
-        for track_name in tracks_to_mix:
-            track_data = self.audio_data[track_name.lower()]['data']
-            volume = self.tracks[track_name.lower()]['volume'].value() / 100
-
-            if isinstance(track_data, torch.Tensor):
-                track_data = track_data.cpu().numpy()
-
-            scaled_data = track_data * volume
-
-            if mixed_data is None:
-                mixed_data = scaled_data
-            else:
-                if mixed_data.shape != scaled_data.shape:
-                    if len(mixed_data.shape) == 1 and len(scaled_data.shape) == 1:
-                        mixed_data = mixed_data + scaled_data
-                    elif len(mixed_data.shape) == 1:
-                        mixed_data = np.vstack([mixed_data, mixed_data]) + scaled_data
-                    elif len(scaled_data.shape) == 1:
-                        scaled_data = np.vstack([scaled_data, scaled_data])
-                        mixed_data = mixed_data + scaled_data
-                else:
-                    mixed_data = mixed_data + scaled_data
-
-        if mixed_data is not None:
-            max_val = np.max(np.abs(mixed_data))
-            if max_val > 0:
-                mixed_data = mixed_data / max_val
-
-            file_path, _ = QFileDialog.getSaveFileName(
-                self.root,
-                "Сохранить микс",
-                "",
-                "WAV файлы (*.wav);;Все файлы (*.*)"
-            )
-
-            if file_path:
-                try:
-                    if len(mixed_data.shape) == 1:
-                        mixed_data_sf = mixed_data.reshape(-1, 1)
-                    else:
-                        if mixed_data.shape[0] == 2:
-                            mixed_data_sf = mixed_data.T
-                        else:
-                            mixed_data_sf = mixed_data
-
-                    sf.write(file_path, mixed_data_sf, sample_rate)
-
-                    from PyQt5.QtWidgets import QMessageBox
-                    QMessageBox.information(self.root, "Сохранение",
-                                            f"Микс успешно сохранен в:\n{file_path}")
-
-                except Exception as e:
-                    from PyQt5.QtWidgets import QMessageBox
-                    QMessageBox.critical(self.root, "Ошибка",
-                                         f"Не удалось сохранить файл:\n{str(e)}")
-
-                    print(f"Ошибка при сохранении файла: {e}")
-                    import traceback
-                    traceback.print_exc()
-
-    def create_waveform_pixmap(self, original_img, width, height, high_quality=True):
-        if width < 1:
-            width = 400
-        if height < 1:
-            height = 60
-
-        try:
-            img_copy = original_img.copy()
-            method = Image.BILINEAR if high_quality else Image.NEAREST
-            if width < 50:
-                width = 50
-
-            resized_img = img_copy.resize((width, height), method)
-            img_data = resized_img.convert("RGBA").tobytes("raw", "RGBA")
-            qimg = QImage(img_data, width, height, QImage.Format_RGBA8888)
-            return QPixmap.fromImage(qimg)
-        except Exception as e:
-            print(f"Ошибка при ресайзе изображения: {e}")
-            return QPixmap(width, height)
-
-    def prepare_track(self, name, track_data):
-        data = track_data['data']
-        sr = track_data['sr']
-
-        if isinstance(data, torch.Tensor):
-            data = data.cpu().numpy()
-            waveform_data = data.copy()
-        else:
-            waveform_data = data.copy()
-
-        if waveform_data.ndim > 1:
-            if waveform_data.shape[0] == 2:
-                waveform_data = np.mean(waveform_data, axis=0)
-            else:
-                waveform_data = waveform_data[0]
-
-        downsample_factor = max(1, len(waveform_data) // 2000)
-        waveform_data = waveform_data[::downsample_factor]
-
-        fd, temp_path = tempfile.mkstemp(suffix='.wav')
-        os.close(fd)
-        self.temp_files.append(temp_path)
+        file_path, _ = QFileDialog.getSaveFileName(
+            self.root,
+            "Сохранить микс и стемы",
+            "",
+            EXPORT_FILTER
+        )
 
-        data = data.astype(np.float32)
-        data = data / np.max(np.abs(data) + 1e-7)
+        if not file_path:
+            return
 
-        if data.ndim == 1:
-            data = data.reshape(1, -1)
-        elif data.shape[0] == 2:
-            pass
-        else:
-            data = data.T
+        if not os.path.splitext(file_path)[1]:
+            file_path += ".wav"
 
-        tensor_data = torch.tensor(data)
-        torchaudio.save(temp_path, tensor_data, sr)
+        # Микс собирается блоками в фоновом потоке, стемы пишутся рядом с ним за тот же проход. Коэффициенты те же,
+        # что при воспроизведении (громкость трека на нормализацию стема по пику), так что баланс микса совпадает
+        # с услышанным. Общая громкость не учитывается: микс при экспорте всё равно нормализуется по пику
+        gains = np.array([self.tracks[name]['volume'].value() / 100 if name in tracks_to_mix else 0.0
+                          for name in self.mixer_names], dtype=np.float32) * self.mixer_scales
 
-        track_data['temp_file'] = temp_path
-        track_data['waveform_data'] = waveform_data
+        self.export_progress = QProgressDialog("Сохранение...", "Отмена", 0, 100, self.root)
+        self.export_progress.setWindowTitle("Сохранение")
+        self.export_progress.setMinimumDuration(0)
 
-    def create_original_waveform(self, waveform_data, color):
-        if len(waveform_data) == 0:
-            waveform_data = np.zeros(100)
+        self.export_thread = ExportThread(dict(self.audio_data), gains, file_path, self.sample_rate)
+        self.export_thread.progress.connect(self.export_progress.setValue)
+        self.export_thread.finished_export.connect(self.on_export_finished)
+        self.export_thread.error.connect(self.on_export_error)
+        self.export_progress.canceled.connect(self.export_thread.requestInterruption)
+        self.save_button.setEnabled(False)
+        self.export_thread.start()
 
-        data = waveform_data.copy()
+    def finish_export(self):
+        self.export_thread.wait()
+        self.export_thread = None
+        self.export_progress.close()
+        self.save_button.setEnabled(True)
 
-        if data.ndim > 1:
-            data = data[0]
+    def on_export_finished(self, written):
+        from PyQt5.QtWidgets import QMessageBox
 
-        data = np.nan_to_num(data)
+        self.finish_export()
+        files = "\n".join(written)
+        QMessageBox.information(self.root, "Сохранение", f"Микс и стемы успешно сохранены:\n{files}")
 
-        max_val = np.max(np.abs(data)) or 1.0
-        data = data / max_val
+    def on_export_error(self, message):
+        from PyQt5.QtWidgets import QMessageBox
 
-        print(f"Создание waveform. Форма данных: {data.shape}, макс: {np.max(data)}, мин: {np.min(data)}")
+        self.finish_export()
+        print(f"Ошибка при сохранении файла: {message}")
+        QMessageBox.critical(self.root, "Ошибка", f"Не удалось сохранить файл:\n{message}")
 
-        fig = Figure(figsize=(self.base_waveform_width / 100, self.base_waveform_height / 100), dpi=100)
-        ax = fig.add_subplot(111)
+    def create_waveform_pixmap(self, name, width, height):
+        if width < 1:
+            width = 400
+        if height < 1:
+            height = 60
 
-        x = np.arange(len(data))
-        ax.plot(x, data, color=color, linewidth=1.2)
-        ax.fill_between(x, data, alpha=0.4, color=color)
+        try:
+            color = self.track_colors.get(name, self.default_color)["main"]
+            return QPixmap.fromImage(render_waveform(self.waveform_originals[name], width, height, color))
+        except Exception as e:
+            print(f"Ошибка при отрисовке waveform: {e}")
+            return QPixmap(width, height)
 
-        ax.set_ylim(-1, 1)
-        ax.axis('off')
-        fig.subplots_adjust(left=0, right=1, top=1, bottom=0, wspace=0, hspace=0)
-        fig.patch.set_alpha(0.0)
+    def prepare_track(self, name, track_data):
+        if 'data' not in track_data:
+            track_data['peaks'] = PeakPyramid.from_file(track_data['path'])
+            return
 
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png', bbox_inches='tight', pad_inches=0, transparent=True)
-        buf.seek(0)
-        original_img = Image.open(buf).copy()
-        plt.close(fig)
+        data = track_data['data']
 
-        if original_img:
-            print(f"Создано изображение размером {original_img.size}")
-        else:
-            print("ОШИБКА: Не удалось создать изображение!")
+        # Тензоры torch переводятся в numpy без импорта torch: плеер загружается в процессе GUI
+        if hasattr(data, 'numpy'):
+            data = data.cpu().numpy()
 
-        return original_img
+        # Стем может быть представлением общей памяти воркера: пики считаются без полной копии
+        track_data['peaks'] = PeakPyramid.from_array(data)
 
     def on_view_resize(self, name, width, height):
         if width > 10 and height > 10:
@@ -747,12 +610,7 @@ class AudioPlayer:
                 scene.clear()
 
             if name in self.waveform_originals:
-                pixmap = self.create_waveform_pixmap(
-                    self.waveform_originals[name],
-                    width,
-                    height,
-                    high_quality=True
-                )
+                pixmap = self.create_waveform_pixmap(name, width, height)
 
                 self.waveform_images[name] = pixmap
 
@@ -789,52 +647,14 @@ class AudioPlayer:
             self.current_time_label.setText(self.format_time(current_time))
 
     def seek_all_tracks(self, position_percent):
-        if not self.active_players:
-            return
-
-        for name, player in self.active_players.items():
-            duration = player.get_length()
-            if duration > 0:
-                new_position = int(position_percent * duration)
-                player.set_time(new_position)
+        self.playback.seek(int(position_percent * self.mixer.frames))
+        self.update_position_slider()
 
     def format_time(self, seconds):
         minutes = int(seconds // 60)
         seconds = int(seconds % 60)
         return f"{minutes}:{seconds:02d}"
 
-    def update_position(self, name):
-        if name in self.active_players and self.playing:
-            player = self.active_players[name]
-
-            current_time = player.get_time() / 1000
-            duration = player.get_length() / 1000
-
-            if duration > 0 and abs(duration - self.track_duration) > 0.1:
-                self.track_duration = duration
-                self.total_time_label.setText(self.format_time(duration))
-
-            if current_time >= 0:
-                self.current_position = current_time
-                if not self.slider_being_dragged:
-                    self.current_time_label.setText(self.format_time(current_time))
-                    if duration > 0:
-                        position_value = int((current_time / duration) * 1000)
-                        self.position_slider.setValue(position_value)
-
-            if duration > 0:
-                position_ratio = current_time / duration
-                view_width = self.waveform_views[name].width()
-
-                x_pos = int(position_ratio * view_width)
-
-                scene = self.waveform_views[name].scene()
-                if scene and name in self.position_markers:
-                    marker = self.position_markers[name]
-                    marker.setLine(x_pos, 0, x_pos, self.waveform_views[name].height())
-
-            QTimer.singleShot(30, lambda: self.update_position(name))
-
     def solo_track(self, name):
         track = self.tracks[name.lower()]
         track['is_solo'] = not track['is_solo']
@@ -870,15 +690,14 @@ class AudioPlayer:
     def update_tracks_volume(self):
         solo_tracks = [name for name, track in self.tracks.items() if track['is_solo']]
 
-        for name, player in self.active_players.items():
-            track = self.tracks[name]
+        gains = np.zeros(len(self.mixer_names), dtype=np.float32)
+        for index, name in enumerate(self.mixer_names):
+            track = self.tracks.get(name)
+            if track is None or (solo_tracks and name not in solo_tracks) or track['is_muted']:
+                continue
+            gains[index] = track['volume'].value() / 100 * self.master_volume_value
 
-            if (solo_tracks and name not in solo_tracks) or track['is_muted']:
-                player.audio_set_volume(0)
-            else:
-                volume_val = track['volume'].value() / 100
-                adjusted_volume = int(volume_val * self.master_volume_value * 100)
-                player.audio_set_volume(adjusted_volume)
+        self.mixer.set_gains(gains * self.mixer_scales)
 
     def draw_waveform(self, name):
         view = self.waveform_views[name]
@@ -894,11 +713,7 @@ class AudioPlayer:
             height = view.height() or 60
 
             if name.lower() in self.waveform_originals:
-                pixmap = self.create_waveform_pixmap(
-                    self.waveform_originals[name.lower()],
-                    width,
-                    height
-                )
+                pixmap = self.create_waveform_pixmap(name.lower(), width, height)
                 self.waveform_images[name] = pixmap
 
             if name in self.waveform_images and self.waveform_images[name]:
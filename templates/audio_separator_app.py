@@ -8,32 +8,30 @@ from PyQt5.QtWidgets import (QMainWindow, QWidget, QLabel, QPushButton,
                              QFileDialog, QDialog, QScrollArea, QMessageBox, QApplication)
 from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer, QSize, QUrl, QMutex, QWaitCondition
 from PyQt5.QtGui import QFont, QIcon, QColor, QPalette, QDragEnterEvent, QDropEvent
-import torch
-import torchaudio
 import threading
-import yaml
 import os
 import mimetypes
 import time
 import gc
 import signal
 import multiprocessing
-import pickle
 
 from pathlib import Path
 
-from ml_collections import ConfigDict
+# Only PyQt and light modules are imported before the window appears: torch and the models live in the
+# worker processes, the player (numpy, soundfile, QtMultimedia) is preloaded in the background after the first paint
+from utils.worker_pool import SeparationWorkerPool, detect_default_device
+from utils.startup import report_startup, preload_modules
+from utils.model_registry import get_models, get_model_info
+from utils.job_queue import JobQueue, QUEUED, RUNNING, DONE, FAILED, CANCELLED, ACTIVE_STATES, AUTO_DEVICE
 
-from model_loaders import htdemucs_loader
-from omegaconf import OmegaConf
-from utils.demix_track_demucs import demix_track_demucs
+PRELOAD_MODULES = ("templates.audio_player",)
 
-from .audio_player import (AudioPlayer)
-
-from model_loaders.mel_band_roformer_loader import MelBandRoformerLoader
-from utils.demix_track import demix_track
-from utils.path_utils import get_resource_path
-from model_loaders.bs_roformer_loader import BSRoformerLoader
+DROP_HINT = "🎵\n\nПеретащите аудиофайлы или папки сюда\n\nПоддерживаемые форматы: MP3, WAV, FLAC"
+# How often the ETA of running jobs is recalculated, ms
+ETA_REFRESH_INTERVAL = 1000
+# A cancelled job stops after its current batch; its worker is killed if it has not stopped after this long, ms
+CANCEL_TIMEOUT = 10000
 
 STYLE = """
 QMainWindow, QDialog {
@@ -154,7 +152,7 @@ QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical {
     height: 0px;
 }
 
-QFrame#modelFrame, QFrame#infoFrame {
+QFrame#modelFrame, QFrame#infoFrame, QFrame#jobFrame {
     background-color: #2D2D30;
     border-radius: 10px;
     padding: 5px;
@@ -177,323 +175,78 @@ QWidget#centralWidget {
 }
 """
 
-
-class ProgressReporter:
-    def __init__(self, progress_queue, cancel_event):
-        self.progress_queue = progress_queue
-        self.cancel_event = cancel_event
-
-    def update_progress(self, progress):
-        try:
-            self.progress_queue.put(("progress", min(100, max(0, int(progress)))))
-        except:
-            pass
-
-    def update_status(self, status):
-        try:
-            self.progress_queue.put(("status", str(status)))
-        except:
-            pass
-
-    def is_cancelled(self):
-        return self.cancel_event.is_set()
-
-    def emit(self, value):
-        self.update_progress(value)
-
-
-def processing_worker(audio_file, model_info, progress_queue, result_queue, cancel_event):
-    try:
-        def signal_handler(signum, frame):
-            print(f"Процесс получил сигнал {signum}, завершаемся...")
-            try:
-                torch.cuda.empty_cache() if torch.cuda.is_available() else None
-                if hasattr(torch, 'mps') and torch.backends.mps.is_available():
-                    torch.mps.empty_cache()
-            except:
-                pass
-            os._exit(0)
-
-        signal.signal(signal.SIGTERM, signal_handler)
-        signal.signal(signal.SIGINT, signal_handler)
-
-        progress_reporter = ProgressReporter(progress_queue, cancel_event)
-
-        if cancel_event.is_set():
-            return
-
-        progress_reporter.update_status("Загрузка аудио...")
-        # progress_reporter.update_progress(5)
-
-        mix, sample_rate = torchaudio.load(audio_file)
-        print(f"Аудио загружено: {mix.shape}")
-
-        if cancel_event.is_set():
-            return
-
-        progress_reporter.update_status("Подготовка модели...")
-        # progress_reporter.update_progress(10)
-
-        if model_info["processor"] == "_process_htdemucs":
-            if cancel_event.is_set():
-                return
-
-            progress_reporter.update_status("Загрузка модели HTDemucs...")
-            # progress_reporter.update_progress(15)
-
-            loader = htdemucs_loader.HTDemucsLoader()
-            config = OmegaConf.load(get_resource_path(model_info["config"]))
-            model = loader.load(model_info["model_id"], model_info["device"], config)
-
-            if cancel_event.is_set():
-                return
-
-            progress_reporter.update_status("Обработка аудио...")
-            # progress_reporter.update_progress(25)
-
-            mix = mix.to(model_info["device"])
-
-            if cancel_event.is_set():
-                return
-
-            waveform = demix_track_demucs(
-                config,
-                model,
-                mix,
-                model_info["device"],
-                pbar=False,
-                progress_bar=progress_reporter
-            )
-
-            if cancel_event.is_set():
-                return
-
-            progress_reporter.update_status("Формирование результата...")
-            # progress_reporter.update_progress(95)
-
-            tracks = {}
-            for stem in config.training.instruments:
-                if cancel_event.is_set():
-                    return
-                tracks[stem] = {'data': torch.tensor(waveform[stem]).float(), 'sr': sample_rate}
-
-            result_queue.put(("success", tracks))
-
-        elif model_info["processor"] == "_process_melband_roformer":
-            if cancel_event.is_set():
-                return
-
-            progress_reporter.update_status("Загрузка модели MelBand RoFormer...")
-            # progress_reporter.update_progress(15)
-
-            with open(get_resource_path(model_info["config"]), 'r') as f:
-                config_dict = yaml.load(f, Loader=yaml.SafeLoader)
-            config = ConfigDict(config_dict)
-
-            loader = MelBandRoformerLoader()
-            model = loader.load(model_info["model_id"], model_info["device"], config)
-
-            if cancel_event.is_set():
-                return
-
-            progress_reporter.update_status("Обработка аудио...")
-            # progress_reporter.update_progress(25)
-
-            mix = mix.to(model_info["device"])
-
-            if cancel_event.is_set():
-                return
-
-            waveform = demix_track(
-                config,
-                model,
-                mix,
-                model_info["device"],
-                pbar=False,
-                progress_bar=progress_reporter
-            )
-
-            if cancel_event.is_set():
-                return
-
-            progress_reporter.update_status("Формирование результата...")
-            # progress_reporter.update_progress(95)
-
-            tracks = {}
-            for stem in waveform.keys():
-                if cancel_event.is_set():
-                    return
-                tracks[stem] = {'data': torch.tensor(waveform[stem]).float(), 'sr': sample_rate}
-
-            result_queue.put(("success", tracks))
-
-        elif model_info["processor"] == "_process_bs_roformer":
-            if cancel_event.is_set():
-                return
-
-            progress_reporter.update_status("Загрузка модели BS RoFormer...")
-            # progress_reporter.update_progress(15)
-
-            with open(get_resource_path(model_info["config"]), 'r') as f:
-                config_dict = yaml.load(f, Loader=yaml.SafeLoader)
-            config = ConfigDict(config_dict)
-
-            loader = BSRoformerLoader()
-            model = loader.load(model_info["model_id"], model_info["device"], config)
-
-            if cancel_event.is_set():
-                return
-
-            progress_reporter.update_status("Обработка аудио...")
-            # progress_reporter.update_progress(25)
-
-            mix = mix.to(model_info["device"])
-
-            if cancel_event.is_set():
-                return
-
-            waveform = demix_track(
-                config,
-                model,
-                mix,
-                model_info["device"],
-                pbar=False,
-                progress_bar=progress_reporter
-            )
-
-            if cancel_event.is_set():
-                return
-
-            progress_reporter.update_status("Формирование результата...")
-            # progress_reporter.update_progress(95)
-
-            tracks = {}
-            for stem in waveform.keys():
-                if cancel_event.is_set():
-                    return
-                tracks[stem] = {'data': torch.tensor(waveform[stem]).float(), 'sr': sample_rate}
-
-            result_queue.put(("success", tracks))
-
-        progress_reporter.update_progress(100)
-        progress_reporter.update_status("Готово!")
-
-    except Exception as e:
-        if not cancel_event.is_set():
-            result_queue.put(("error", str(e)))
-        else:
-            print("Процесс был отменен во время исключения")
-
-
 class ProcessMonitoringThread(QThread):
     update_status = pyqtSignal(str)
-    update_progress = pyqtSignal(int)
-    processing_finished = pyqtSignal(dict)
+    update_progress = pyqtSignal(object)
+    processing_finished = pyqtSignal(object)
     processing_error = pyqtSignal(str)
     processing_cancelled = pyqtSignal()
 
-    def __init__(self, audio_file, model_info, device):
+    def __init__(self, audio_file, model_info, device, worker_pool):
         super().__init__()
         self.audio_file = audio_file
         self.model_info = model_info
         self.device = device
+        self.worker_pool = worker_pool
         self._is_cancelled = False
-        self._process = None
-        self._cancel_event = None
+        self._job_id = None
 
         self._force_kill_timer = QTimer()
         self._force_kill_timer.timeout.connect(self._force_kill_process)
         self._force_kill_timer.setSingleShot(True)
 
     def cancel(self):
-        print("Запрос отмены - завершаем процесс")
+        print("Запрос отмены - останавливаем задачу")
         self._is_cancelled = True
         self.update_status.emit("Отменяется...")
 
-        if self._cancel_event:
-            self._cancel_event.set()
-
-        self._force_kill_timer.start(2000)
+        if self._job_id is not None:
+            self.worker_pool.cancel(self._job_id)
 
-        if self._process and self._process.is_alive():
-            print("Отправляем сигнал SIGTERM")
-            try:
-                self._process.terminate()
-            except:
-                pass
+        self._force_kill_timer.start(CANCEL_TIMEOUT)
 
     def _force_kill_process(self):
-        if self._process and self._process.is_alive():
-            print("Принудительное уничтожение процесса")
-            try:
-                self._process.kill()
-                self._process.join(timeout=1)
-            except:
-                pass
-
-        if not self._is_cancelled:
-            self._is_cancelled = True
-            self.processing_cancelled.emit()
+        if self._job_id is not None:
+            self.worker_pool.kill_job(self._job_id)
 
     def run(self):
         try:
-            progress_queue = multiprocessing.Queue()
-            result_queue = multiprocessing.Queue()
-            self._cancel_event = multiprocessing.Event()
-
-            model_info_serializable = {
-                "config": self.model_info["config"],
-                "model_id": self.model_info["model_id"],
-                "device": self.model_info["device"],
-                "processor": self.model_info["processor"].__name__ if hasattr(self.model_info["processor"], '__name__') else str(self.model_info["processor"])
-            }
-
-            self._process = multiprocessing.Process(
-                target=processing_worker,
-                args=(str(self.audio_file), model_info_serializable, progress_queue, result_queue, self._cancel_event)
-            )
-
-            print("Запускаем процесс обработки")
-            self._process.start()
-
-            while self._process.is_alive() and not self._is_cancelled:
-                try:
-                    while not progress_queue.empty():
-                        msg_type, data = progress_queue.get_nowait()
-                        if msg_type == "status":
-                            self.update_status.emit(data)
-                        elif msg_type == "progress":
-                            # self.update_progress.emit(data)
-                            pass
-                except:
-                    pass
-
-                try:
-                    if not result_queue.empty():
-                        result_type, data = result_queue.get_nowait()
-                        if result_type == "success":
-                            print("Процесс завершился успешно")
-                            self._force_kill_timer.stop()
-                            self.processing_finished.emit(data)
-                            return
-                        elif result_type == "error":
-                            print(f"Ошибка в процессе: {data}")
-                            self._force_kill_timer.stop()
-                            self.processing_error.emit(data)
-                            return
-                except:
-                    pass
-
-                self.msleep(100)
-
-            if self._is_cancelled:
-                print("Обработка отменена")
-                self.processing_cancelled.emit()
-            else:
-                if self._process.exitcode != 0:
-                    self.processing_error.emit("Процесс завершился с ошибкой")
-                else:
+            model_info_serializable = dict(self.model_info, device=str(self.model_info["device"]))
+
+            print("Отправляем задачу в пул обработки")
+            self._job_id, events = self.worker_pool.submit(self.audio_file, model_info_serializable)
+
+            # Blocks until the pool delivers the next event of the job; every job ends with success, error or
+            # cancelled (also when its worker dies or is killed, or the pool shuts down)
+            while True:
+                msg_type, data = events.get()
+
+                if msg_type == "status":
+                    self.update_status.emit(data)
+                elif msg_type == "progress":
+                    self.update_progress.emit(data)
+                elif msg_type == "success":
+                    print("Задача завершилась успешно")
+                    self._force_kill_timer.stop()
+                    if self._is_cancelled:
+                        self.processing_cancelled.emit()
+                    else:
+                        # Задачи приложения пишут стемы в свою папку: воркер возвращает только пути к файлам
+                        self.processing_finished.emit(data["files"])
+                    return
+                elif msg_type == "error":
+                    print(f"Ошибка в процессе: {data}")
+                    self._force_kill_timer.stop()
+                    if self._is_cancelled:
+                        self.processing_cancelled.emit()
+                    else:
+                        self.processing_error.emit(data)
+                    return
+                elif msg_type == "cancelled":
+                    print("Обработка отменена")
+                    self._force_kill_timer.stop()
                     self.processing_cancelled.emit()
+                    return
 
         except Exception as e:
             print(f"Ошибка в мониторинге: {e}")
@@ -502,24 +255,19 @@ class ProcessMonitoringThread(QThread):
             else:
                 self.processing_cancelled.emit()
         finally:
-            if self._process and self._process.is_alive():
-                self._process.terminate()
-                self._process.join(timeout=2)
-                if self._process.is_alive():
-                    self._process.kill()
-
             self._force_kill_timer.stop()
 
     def stop_thread(self):
         print("Останавливаем мониторинг...")
         self.cancel()
+        self._force_kill_process()
         self.wait(5000)
         if self.isRunning():
             self.terminate()
 
 
 class DropZone(QFrame):
-    file_dropped = pyqtSignal(str)
+    files_dropped = pyqtSignal(list)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -530,7 +278,7 @@ class DropZone(QFrame):
         layout = QVBoxLayout(self)
         layout.setAlignment(Qt.AlignCenter)
 
-        self.drop_label = QLabel("🎵\n\nПеретащите аудиофайл сюда\n\nПоддерживаемые форматы: MP3, WAV, FLAC")
+        self.drop_label = QLabel(DROP_HINT)
         self.drop_label.setAlignment(Qt.AlignCenter)
         self.drop_label.setStyleSheet("""
             QLabel {
@@ -542,7 +290,7 @@ class DropZone(QFrame):
         """)
         layout.addWidget(self.drop_label)
 
-        self.select_file_btn = QPushButton("Или выберите файл")
+        self.select_file_btn = QPushButton("Или выберите файлы")
         self.select_file_btn.setStyleSheet("""
             QPushButton {
                 background-color: transparent;
@@ -564,12 +312,12 @@ class DropZone(QFrame):
         if event.mimeData().hasUrls():
             for url in event.mimeData().urls():
                 file_path = url.toLocalFile()
-                if self.is_audio_file(file_path):
+                if self.is_audio_file(file_path) or os.path.isdir(file_path):
                     event.acceptProposedAction()
                     self.setProperty("active", "true")
                     self.style().unpolish(self)
                     self.style().polish(self)
-                    self.drop_label.setText("🎵\n\nОтпустите файл для загрузки")
+                    self.drop_label.setText("🎵\n\nОтпустите файлы для загрузки")
                     self.drop_label.setStyleSheet("""
                         QLabel {
                             color: #007BFF;
@@ -584,7 +332,7 @@ class DropZone(QFrame):
         self.setProperty("active", "false")
         self.style().unpolish(self)
         self.style().polish(self)
-        self.drop_label.setText("🎵\n\nПеретащите аудиофайл сюда\n\nПоддерживаемые форматы: MP3, WAV, FLAC")
+        self.drop_label.setText(DROP_HINT)
         self.drop_label.setStyleSheet("""
             QLabel {
                 color: #6C757D;
@@ -595,29 +343,27 @@ class DropZone(QFrame):
         """)
 
     def dropEvent(self, event: QDropEvent):
-        files = [url.toLocalFile() for url in event.mimeData().urls()]
-
-        for file_path in files:
-            if self.is_audio_file(file_path):
-                self.file_dropped.emit(file_path)
-                self.setProperty("active", "false")
-                self.style().unpolish(self)
-                self.style().polish(self)
-                self.drop_label.setText("\n\nФайл загружен успешно!")
-                self.drop_label.setStyleSheet("""
-                    QLabel {
-                        color: #28A745;
-                        font-size: 16px;
-                        font-weight: bold;
-                    }
-                """)
-                QTimer.singleShot(2000, self.reset_drop_zone)
-                break
+        files = self.collect_audio_files([url.toLocalFile() for url in event.mimeData().urls()])
+
+        self.setProperty("active", "false")
+        self.style().unpolish(self)
+        self.style().polish(self)
+        if files:
+            self.files_dropped.emit(files)
+            self.drop_label.setText(f"\n\nЗагружено файлов: {len(files)}")
+            self.drop_label.setStyleSheet("""
+                QLabel {
+                    color: #28A745;
+                    font-size: 16px;
+                    font-weight: bold;
+                }
+            """)
+        QTimer.singleShot(2000, self.reset_drop_zone)
 
         event.acceptProposedAction()
 
     def reset_drop_zone(self):
-        self.drop_label.setText("🎵\n\nПеретащите аудиофайл сюда\n\nПоддерживаемые форматы: MP3, WAV, FLAC")
+        self.drop_label.setText(DROP_HINT)
         self.drop_label.setStyleSheet("""
             QLabel {
                 color: #6C757D;
@@ -643,6 +389,111 @@ class DropZone(QFrame):
 
         return False
 
+    def collect_audio_files(self, paths):
+        # Папки обходятся рекурсивно, файлы в них сортируются по пути
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in sorted(os.walk(path)):
+                    files.extend(os.path.join(root, name) for name in sorted(names)
+                                 if self.is_audio_file(os.path.join(root, name)))
+            elif self.is_audio_file(path):
+                files.append(path)
+        return list(dict.fromkeys(files))
+
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class JobRow(QFrame):
+    open_requested = pyqtSignal(int)
+    cancel_requested = pyqtSignal(int)
+    retry_requested = pyqtSignal(int)
+    remove_requested = pyqtSignal(int)
+
+    STATE_TEXT = {
+        QUEUED: "В очереди",
+        RUNNING: "Обработка",
+        DONE: "Готово",
+        FAILED: "Ошибка",
+        CANCELLED: "Отменено",
+    }
+
+    STATE_COLORS = {
+        QUEUED: "#6C757D",
+        RUNNING: "#17A2B8",
+        DONE: "#28A745",
+        FAILED: "#DC3545",
+        CANCELLED: "#FFC107",
+    }
+
+    def __init__(self, job, model_name, parent=None):
+        super().__init__(parent)
+        self.job_id = job.job_id
+        self.setObjectName("jobFrame")
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(15, 10, 15, 10)
+        layout.setSpacing(15)
+
+        text_layout = QVBoxLayout()
+        self.name_label = QLabel(f"{job.name}  ·  {model_name}")
+        self.name_label.setFont(QFont("Arial", 13, QFont.Bold))
+        text_layout.addWidget(self.name_label)
+
+        self.state_label = QLabel("")
+        self.state_label.setWordWrap(True)
+        text_layout.addWidget(self.state_label)
+        layout.addLayout(text_layout, 3)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(True)
+        self.progress_bar.setFormat("%p%")
+        layout.addWidget(self.progress_bar, 2)
+
+        self.open_button = self._add_button(layout, "Открыть", "#28A745", self.open_requested)
+        self.retry_button = self._add_button(layout, "Повторить", "#007BFF", self.retry_requested)
+        self.cancel_button = self._add_button(layout, "Отмена", "#DC3545", self.cancel_requested)
+        self.remove_button = self._add_button(layout, "✕", "#6C757D", self.remove_requested)
+        self.remove_button.setFixedWidth(45)
+
+        self.update_job(job)
+
+    def _add_button(self, layout, text, color, signal):
+        button = QPushButton(text)
+        button.setStyleSheet(f"background-color: {color}; min-height: 30px; padding: 5px 10px; font-size: 13px;")
+        button.clicked.connect(lambda: signal.emit(self.job_id))
+        layout.addWidget(button)
+        return button
+
+    def update_job(self, job):
+        text = self.STATE_TEXT[job.state]
+        if job.state == RUNNING:
+            if job.status:
+                text = job.status
+            eta = job.eta()
+            if job.chunks is not None and job.chunks[1]:
+                text += f"  ·  фрагменты {job.chunks[0]}/{job.chunks[1]}"
+                if job.speed:
+                    text += f" ({job.speed:.1f}/с)"
+            if eta is not None:
+                text += f"  ·  осталось ~{format_eta(eta)}"
+        elif job.state == FAILED and job.error:
+            text = f"Ошибка: {job.error}"
+
+        self.state_label.setText(text)
+        self.state_label.setStyleSheet(f"color: {self.STATE_COLORS[job.state]}; font-size: 13px;")
+        self.progress_bar.setValue(int(job.progress))
+
+        self.open_button.setVisible(job.state == DONE)
+        self.retry_button.setVisible(job.state in (FAILED, CANCELLED))
+        self.cancel_button.setVisible(job.state in ACTIVE_STATES)
+        self.remove_button.setVisible(job.state not in ACTIVE_STATES)
+
 
 class ModelsInfoDialog(QDialog):
     def __init__(self, parent, available_models):
@@ -696,6 +547,8 @@ class ModelsInfoDialog(QDialog):
 
 
 class AudioSeparatorApp(QMainWindow):
+    auto_device_detected = pyqtSignal(str)
+
     def __init__(self):
         super().__init__()
         os.environ['PYTORCH_ENABLE_MPS_FALLBACK'] = '1'
@@ -714,8 +567,7 @@ class AudioSeparatorApp(QMainWindow):
         main_layout.setContentsMargins(40, 40, 40, 40)
         main_layout.setSpacing(25)
 
-        self.is_processing = False
-        self.processing_thread = None
+        self.worker_pools = {}
 
         app_title = QLabel("AudSep")
         app_title.setFont(QFont("Arial", 24, QFont.Bold))
@@ -732,47 +584,9 @@ class AudioSeparatorApp(QMainWindow):
         model_label.setFont(QFont("Arial", 14))
         model_layout.addWidget(model_label)
 
-        if torch.cuda.is_available():
-            self.device = torch.device("cuda")
-        elif hasattr(torch, 'mps') and hasattr(torch.mps, 'is_available') and torch.mps.is_available():
-            self.device = torch.device("mps")
-        else:
-            self.device = torch.device("cpu")
-
-        print(f"Используется устройство: {self.device}")
-
-        if str(self.device) == "mps":
-            try:
-                print(f"Доступная память MPS: {torch.mps.current_allocated_memory() / (1024 ** 3):.2f}GB")
-            except:
-                print("Не удалось получить информацию о памяти MPS")
-
-        self.available_models = {
-            "HTDemucs (6 стемов)": {
-                "loader": htdemucs_loader.HTDemucsLoader(),
-                "config": "./configs/config_htdemucs_6stems.yaml",
-                "model_id": "6s",
-                "processor": self._process_htdemucs,
-                "description": "HTDemucs - базовая модель разделения аудио на отдельные компоненты.",
-                "device": 'cpu'
-            },
-            "MelBand RoFormer": {
-                "loader": MelBandRoformerLoader,
-                "config": "./configs/config_vocals_mel_band_roformer_kj.yaml",
-                "model_id": "base",
-                "processor": self._process_melband_roformer,
-                "description": "MelBandRoformer - модель для выделения вокала из аудио.",
-                "device": 'cpu'
-            },
-            "BS RoFormer": {
-                "loader": BSRoformerLoader,
-                "config": "./configs/config_bs_roformer.yaml",
-                "model_id": "bs",
-                "processor": self._process_bs_roformer,
-                "description": "Band-Split RoFormer модель для более точного разделения аудио на отдельные компоненты.",
-                "device": self.device
-            }
-        }
+        # Display name -> registry entry (configs/models.yaml); "auto" devices are resolved by the worker,
+        # detecting them here would import torch before the window
+        self.available_models = {model_info["name"]: model_info for model_info in get_models().values()}
 
         self.model_dropdown = QComboBox()
         self.model_dropdown.addItems(list(self.available_models.keys()))
@@ -788,11 +602,11 @@ class AudioSeparatorApp(QMainWindow):
         main_layout.addWidget(model_frame)
 
         self.drop_zone = DropZone()
-        self.drop_zone.file_dropped.connect(self.handle_dropped_file)
+        self.drop_zone.files_dropped.connect(self.handle_dropped_files)
         self.drop_zone.select_file_btn.clicked.connect(self.select_file)
         main_layout.addWidget(self.drop_zone)
 
-        self.file_label = QLabel("Файл не выбран")
+        self.file_label = QLabel("Файлы не выбраны")
         self.file_label.setStyleSheet("background-color: #2D2D30; padding: 15px; border-radius: 6px; font-size: 14px;")
         self.file_label.setWordWrap(True)
         main_layout.addWidget(self.file_label)
@@ -806,7 +620,7 @@ class AudioSeparatorApp(QMainWindow):
 
         buttons_layout = QHBoxLayout()
 
-        self.process_button = QPushButton("Разделить")
+        self.process_button = QPushButton("Добавить в очередь")
         self.process_button.setIcon(QIcon.fromTheme("media-playback-start"))
         self.process_button.setIconSize(QSize(24, 24))
         self.process_button.setFont(QFont("Arial", 14, QFont.Bold))
@@ -815,7 +629,7 @@ class AudioSeparatorApp(QMainWindow):
         self.process_button.setEnabled(False)
         buttons_layout.addWidget(self.process_button)
 
-        self.cancel_button = QPushButton("Отмена")
+        self.cancel_button = QPushButton("Отменить все")
         self.cancel_button.setObjectName("cancelButton")
         self.cancel_button.setIcon(QIcon.fromTheme("process-stop"))
         self.cancel_button.setIconSize(QSize(24, 24))
@@ -824,6 +638,12 @@ class AudioSeparatorApp(QMainWindow):
         self.cancel_button.setVisible(False)
         buttons_layout.addWidget(self.cancel_button)
 
+        self.clear_button = QPushButton("Убрать завершённые")
+        self.clear_button.setStyleSheet("background-color: #6C757D;")
+        self.clear_button.clicked.connect(self.clear_finished_jobs)
+        self.clear_button.setVisible(False)
+        buttons_layout.addWidget(self.clear_button)
+
         main_layout.addLayout(buttons_layout)
 
         self.status_label = QLabel("")
@@ -831,20 +651,46 @@ class AudioSeparatorApp(QMainWindow):
         self.status_label.setAlignment(Qt.AlignCenter)
         main_layout.addWidget(self.status_label)
 
+        jobs_area = QScrollArea()
+        jobs_area.setWidgetResizable(True)
+        jobs_area.setFrameShape(QFrame.NoFrame)
+        jobs_content = QWidget()
+        self.jobs_layout = QVBoxLayout(jobs_content)
+        self.jobs_layout.setSpacing(10)
+        self.jobs_layout.addStretch()
+        jobs_area.setWidget(jobs_content)
+        main_layout.addWidget(jobs_area, 1)
+
         footer_label = QLabel("©️ Gosha Ivanov, 2025")
         footer_label.setStyleSheet("color: #6C757D; font-size: 12px;")
         footer_label.setAlignment(Qt.AlignRight | Qt.AlignBottom)
         main_layout.addWidget(footer_label)
 
-        self.selected_file = None
-        self.separated_tracks = {}
+        self.selected_files = []
+
+        # Очередь сохраняется в файл: после перезапуска незавершённые задачи выполняются заново,
+        # готовые результаты (стемы на диске) можно открыть
+        self.job_queue = JobQueue()
+        self.auto_device_detected.connect(self.set_auto_device)
+        self.job_rows = {}
+        self.monitors = {}
+        self.players = {}
+        self.auto_open_job = None
+        for job in self.job_queue.jobs:
+            self.add_job_row(job)
+        self.update_queue_status()
+
+        self.eta_timer = QTimer(self)
+        self.eta_timer.timeout.connect(self.refresh_running_jobs)
+        self.eta_timer.start(ETA_REFRESH_INTERVAL)
 
     def closeEvent(self, event):
-        if self.processing_thread and self.processing_thread.isRunning():
+        if self.monitors:
             reply = QMessageBox.question(
                 self,
                 "Закрытие приложения",
-                "Обработка еще не завершена. Вы уверены, что хотите закрыть приложение?",
+                "Обработка еще не завершена. Вы уверены, что хотите закрыть приложение?\n"
+                "Незавершённые задачи будут выполнены заново при следующем запуске.",
                 QMessageBox.Yes | QMessageBox.No,
                 QMessageBox.No
             )
@@ -854,7 +700,18 @@ class AudioSeparatorApp(QMainWindow):
                 return
 
             print("Принудительно завершаем обработку при закрытии")
-            self.processing_thread.stop_thread()
+            # Состояние очереди уже сохранено: запущенные задачи остаются в ней как незавершённые
+            for monitor in list(self.monitors.values()):
+                monitor.processing_cancelled.disconnect()
+                monitor.processing_error.disconnect()
+                monitor.finished.disconnect()
+                monitor.stop_thread()
+
+        for player_dialog, _ in list(self.players.values()):
+            player_dialog.close()
+
+        for worker_pool in self.worker_pools.values():
+            worker_pool.shutdown()
 
         event.accept()
 
@@ -862,18 +719,15 @@ class AudioSeparatorApp(QMainWindow):
         if event.mimeData().hasUrls():
             for url in event.mimeData().urls():
                 file_path = url.toLocalFile()
-                if self.is_audio_file(file_path):
+                if self.is_audio_file(file_path) or os.path.isdir(file_path):
                     event.acceptProposedAction()
                     return
         event.ignore()
 
     def dropEvent(self, event: QDropEvent):
-        files = [url.toLocalFile() for url in event.mimeData().urls()]
-
-        for file_path in files:
-            if self.is_audio_file(file_path):
-                self.handle_dropped_file(file_path)
-                break
+        files = self.drop_zone.collect_audio_files([url.toLocalFile() for url in event.mimeData().urls()])
+        if files:
+            self.handle_dropped_files(files)
 
         event.acceptProposedAction()
 
@@ -893,14 +747,15 @@ class AudioSeparatorApp(QMainWindow):
 
         return False
 
-    def handle_dropped_file(self, file_path):
-        if self.is_processing:
-            QMessageBox.warning(self, "Внимание", "Дождитесь завершения текущей обработки или отмените её")
-            return
-
+    def handle_dropped_files(self, file_paths):
         try:
-            self.selected_file = Path(file_path)
-            self.file_label.setText(f"Выбран файл: {self.selected_file.name}")
+            self.selected_files = [Path(file_path) for file_path in file_paths]
+            if len(self.selected_files) == 1:
+                self.file_label.setText(f"Выбран файл: {self.selected_files[0].name}")
+            else:
+                names = ", ".join(path.name for path in self.selected_files[:3])
+                more = f" и ещё {len(self.selected_files) - 3}" if len(self.selected_files) > 3 else ""
+                self.file_label.setText(f"Выбрано файлов: {len(self.selected_files)} ({names}{more})")
             self.process_button.setEnabled(True)
 
             original_style = self.file_label.styleSheet()
@@ -908,25 +763,22 @@ class AudioSeparatorApp(QMainWindow):
                 "background-color: #28A745; padding: 15px; border-radius: 6px; font-size: 14px; color: white;")
             QTimer.singleShot(1500, lambda: self.file_label.setStyleSheet(original_style))
 
-            self.status_label.setText(f"Файл загружен: {self.selected_file.name}")
+            self.status_label.setText(f"Файлов загружено: {len(self.selected_files)}")
 
         except Exception as e:
             self.status_label.setText(f"Ошибка при загрузке файла: {str(e)}")
             QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить файл: {str(e)}")
 
     def select_file(self):
-        if self.is_processing:
-            return
-
         try:
-            file_path, _ = QFileDialog.getOpenFileName(
+            file_paths, _ = QFileDialog.getOpenFileNames(
                 self,
-                "Выбрать аудио файл",
+                "Выбрать аудио файлы",
                 "",
                 "Audio Files (*.mp3 *.wav *.flac);;MP3 Files (*.mp3);;WAV Files (*.wav);;FLAC Files (*.flac)"
             )
-            if file_path:
-                self.handle_dropped_file(file_path)
+            if file_paths:
+                self.handle_dropped_files(file_paths)
         except Exception as e:
             self.status_label.setText(f"Ошибка при выборе файла: {str(e)}")
             QMessageBox.critical(self, "Ошибка", f"Не удалось выбрать файл: {str(e)}")
@@ -936,110 +788,250 @@ class AudioSeparatorApp(QMainWindow):
         info_dialog.exec_()
 
     def process_audio(self):
-        if self.is_processing:
-            return
-
-        if not self.selected_file or not self.selected_file.exists():
-            QMessageBox.warning(self, "Внимание", "Выберите аудиофайл для обработки")
+        files = [path for path in self.selected_files if path.exists()]
+        if not files:
+            QMessageBox.warning(self, "Внимание", "Выберите аудиофайлы для обработки")
             return
 
-        self.is_processing = True
-        self.drop_zone.setEnabled(False)
-        self.process_button.setVisible(False)
-        self.cancel_button.setVisible(True)
-
-        self.status_label.setText("Подготовка...")
-        self.progress_bar.setValue(0)
+        model_info = self.available_models[self.model_dropdown.currentText()]
+        jobs = [self.job_queue.add(audio_file, model_info) for audio_file in files]
+        for job in jobs:
+            self.add_job_row(job)
+        # Плеер открывается сам только для одиночного файла, не для пакета
+        self.auto_open_job = jobs[0].job_id if len(jobs) == 1 else None
 
-        selected_model_name = self.model_dropdown.currentText()
-        model_info = self.available_models[selected_model_name]
-
-        self.processing_thread = ProcessMonitoringThread(self.selected_file, model_info, self.device)
-        self.processing_thread.update_status.connect(self.update_status)
-        self.processing_thread.update_progress.connect(self.progress_bar.setValue)
-        self.processing_thread.processing_finished.connect(self.processing_complete)
-        self.processing_thread.processing_error.connect(self.processing_error)
-        self.processing_thread.processing_cancelled.connect(self.processing_cancelled)
-        self.processing_thread.finished.connect(self.thread_finished)
+        self.selected_files = []
+        self.file_label.setText("Файлы не выбраны")
+        self.process_button.setEnabled(False)
+        self.schedule_jobs()
+
+    def add_job_row(self, job):
+        model_info = get_models().get(job.model)
+        row = JobRow(job, model_info["name"] if model_info else job.model)
+        row.open_requested.connect(self.open_job)
+        row.cancel_requested.connect(self.cancel_job)
+        row.retry_requested.connect(self.retry_job)
+        row.remove_requested.connect(self.remove_job)
+        self.jobs_layout.insertWidget(self.jobs_layout.count() - 1, row)
+        self.job_rows[job.job_id] = row
+
+    def update_job_row(self, job):
+        row = self.job_rows.get(job.job_id)
+        if row is not None:
+            row.update_job(job)
+        self.update_queue_status()
+
+    def update_queue_status(self):
+        running = self.job_queue.count(RUNNING)
+        queued = self.job_queue.count(QUEUED)
+        done = self.job_queue.count(DONE)
+        failed = self.job_queue.count(FAILED)
+
+        active = [job for job in self.job_queue.jobs if job.state in ACTIVE_STATES]
+        self.progress_bar.setValue(int(sum(job.progress for job in active) / len(active)) if active else 0)
+        self.cancel_button.setVisible(bool(active))
+        self.clear_button.setVisible(len(active) < len(self.job_queue.jobs))
+
+        if self.job_queue.jobs:
+            text = f"Обрабатывается: {running}, в очереди: {queued}, готово: {done}"
+            if failed:
+                text += f", с ошибкой: {failed}"
+            self.status_label.setText(text)
+
+    def refresh_running_jobs(self):
+        for job in self.job_queue.jobs:
+            if job.state == RUNNING:
+                self.job_rows[job.job_id].update_job(job)
+
+    def schedule_jobs(self):
+        for job in self.job_queue.next_jobs():
+            self.start_job(job)
+        self.update_queue_status()
+
+    def start_job(self, job):
+        if job.model not in get_models():
+            self.job_queue.finish(job, FAILED, error=f"Неизвестная модель: {job.model}")
+            self.update_job_row(job)
+            return
 
-        self.processing_thread.start()
+        device = self.job_queue.get_device(job)
+        model_info = get_model_info(job.model, device=device, output_dir=job.output_dir)
+        self.job_queue.start(job)
+
+        monitor = ProcessMonitoringThread(Path(job.audio_file), model_info, device, self.get_worker_pool(device))
+        job_id = job.job_id
+        monitor.update_status.connect(lambda message: self.job_status(job_id, message))
+        monitor.update_progress.connect(lambda progress: self.job_progress(job_id, progress))
+        monitor.processing_finished.connect(lambda tracks: self.job_complete(job_id, tracks))
+        monitor.processing_error.connect(lambda message: self.job_error(job_id, message))
+        monitor.processing_cancelled.connect(lambda: self.job_cancelled(job_id))
+        monitor.finished.connect(lambda: self.monitor_finished(job_id))
+        self.monitors[job_id] = monitor
+        self.update_job_row(job)
+
+        monitor.start()
+
+    def monitor_finished(self, job_id):
+        monitor = self.monitors.pop(job_id, None)
+        if monitor is not None:
+            monitor.deleteLater()
+        self.schedule_jobs()
+
+    def job_status(self, job_id, message):
+        job = self.job_queue.get(job_id)
+        if job is not None and job.state == RUNNING:
+            job.status = message
+            self.update_job_row(job)
+
+    def job_progress(self, job_id, progress):
+        job = self.job_queue.get(job_id)
+        if job is not None and job.state == RUNNING:
+            job.update_progress(progress)
+            self.update_job_row(job)
+
+    def job_complete(self, job_id, tracks):
+        job = self.job_queue.get(job_id)
+        if job is None:
+            return
+        self.job_queue.finish(job, DONE, tracks=tracks)
+        self.update_job_row(job)
+
+        if job_id == self.auto_open_job:
+            self.auto_open_job = None
+            self.open_job(job_id)
+
+    def job_error(self, job_id, error_message):
+        job = self.job_queue.get(job_id)
+        if job is not None:
+            self.job_queue.finish(job, FAILED, error=error_message)
+            self.update_job_row(job)
+
+    def job_cancelled(self, job_id):
+        job = self.job_queue.get(job_id)
+        if job is not None and job.state in ACTIVE_STATES:
+            self.job_queue.finish(job, CANCELLED)
+            self.update_job_row(job)
+
+    def cancel_job(self, job_id):
+        job = self.job_queue.get(job_id)
+        if job is None:
+            return
 
-    def thread_finished(self):
-        if self.processing_thread:
-            self.processing_thread.deleteLater()
-            self.processing_thread = None
+        if job.job_id in self.monitors:
+            print(f"Отмена задачи {job.name}")
+            job.status = "Отменяется..."
+            self.update_job_row(job)
+            self.monitors[job.job_id].cancel()
+        elif job.state == QUEUED:
+            self.job_cancelled(job_id)
 
     def cancel_processing(self):
-        if self.processing_thread and self.processing_thread.isRunning():
-            print("Немедленная отмена обработки")
-
-            self.cancel_button.setEnabled(False)
-            self.cancel_button.setText("Отменяется...")
-            self.status_label.setText("Принудительная остановка...")
-
-            self.processing_thread.cancel()
-
-            QTimer.singleShot(1000, self.force_reset_ui)
-
-    def force_reset_ui(self):
-        if self.is_processing:
-            print("Принудительный сброс UI")
-            self.processing_cancelled()
-
-    def update_status(self, message):
-        self.status_label.setText(message)
-
-    def processing_complete(self, tracks):
-        self.separated_tracks = tracks
-        self.reset_ui_after_processing()
-        self.status_label.setText("Разделение завершено успешно!")
-        self.status_label.setStyleSheet("font-size: 14px; color: #28A745; min-height: 30px; margin-top: 10px;")
-
-        QTimer.singleShot(3000, lambda: self.status_label.setStyleSheet(
-            "font-size: 14px; color: #17A2B8; min-height: 30px; margin-top: 10px;"))
-
-        self.open_player()
-
-    def processing_error(self, error_message):
-        self.status_label.setText(f"Ошибка: {error_message}")
-        self.status_label.setStyleSheet("font-size: 14px; color: #DC3545; min-height: 30px; margin-top: 10px;")
-        self.reset_ui_after_processing()
-        QMessageBox.critical(self, "Ошибка обработки", f"Произошла ошибка при обработке аудио:\n{error_message}")
-
-    def processing_cancelled(self):
-        self.status_label.setText("Обработка отменена пользователем")
-        self.status_label.setStyleSheet("font-size: 14px; color: #FFC107; min-height: 30px; margin-top: 10px;")
-        self.reset_ui_after_processing()
-        self.progress_bar.setValue(0)
-
-        QTimer.singleShot(3000, lambda: self.status_label.setStyleSheet(
-            "font-size: 14px; color: #17A2B8; min-height: 30px; margin-top: 10px;"))
+        print("Отмена всех задач")
+        for job in list(self.job_queue.jobs):
+            if job.state in ACTIVE_STATES:
+                self.cancel_job(job.job_id)
+
+    def retry_job(self, job_id):
+        job = self.job_queue.get(job_id)
+        if job is not None and job.state in (FAILED, CANCELLED):
+            self.job_queue.retry(job)
+            self.update_job_row(job)
+            self.schedule_jobs()
+
+    def remove_job(self, job_id):
+        job = self.job_queue.get(job_id)
+        if job is None or job.state in ACTIVE_STATES:
+            return
+        # Стемы задачи удаляются вместе с ней: открытый плеер закрывается раньше
+        if job_id in self.players:
+            self.players[job_id][0].close()
+        self.job_queue.remove(job)
+        row = self.job_rows.pop(job_id)
+        row.deleteLater()
+        self.update_queue_status()
+
+    def clear_finished_jobs(self):
+        for job in list(self.job_queue.jobs):
+            if job.state not in ACTIVE_STATES and job.job_id not in self.players:
+                self.remove_job(job.job_id)
+
+    def get_worker_pool(self, device):
+        # device - конкретное устройство, не "auto". Отдельный пул на каждое устройство: в нём столько воркеров, сколько задач на устройстве идёт параллельно
+        if device not in self.worker_pools:
+            num_workers = self.job_queue.get_parallelism(device)
+            num_threads = max(1, (os.cpu_count() or 1) // num_workers) if num_workers > 1 else None
+            # Воркеры живут до закрытия приложения и держат загруженные модели в памяти
+            self.worker_pools[device] = SeparationWorkerPool(num_workers=num_workers, num_threads=num_threads)
+        return self.worker_pools[device]
+
+    def start_worker_pool(self):
+        model_info = self.available_models.get(self.model_dropdown.currentText())
+        if model_info is None:
+            return
+        device = str(model_info["device"])
+        device = self.job_queue.auto_device if device == AUTO_DEVICE else device
+        if device is not None:
+            self.get_worker_pool(device)
+
+    def detect_auto_device(self):
+        # "auto" is resolved once, in a child process (the GUI does not import torch); until then "auto" jobs wait
+        models = list(get_models().values())
+        if any(str(info.get("device")) == AUTO_DEVICE for info in models) or \
+                any(job.device == AUTO_DEVICE for job in self.job_queue.jobs):
+            threading.Thread(target=lambda: self.auto_device_detected.emit(detect_default_device()),
+                             daemon=True).start()
+
+    def set_auto_device(self, device):
+        print(f"Устройство для \"auto\": {device}")
+        self.job_queue.set_auto_device(device)
+        self.start_worker_pool()
+        self.schedule_jobs()
+
+    def warm_up(self):
+        # After the first paint: workers import torch and the models in their own processes meanwhile
+        report_startup("Окно показано")
+        self.detect_auto_device()
+        self.start_worker_pool()
+        preload_modules(PRELOAD_MODULES)
+        self.schedule_jobs()
+
+    def open_job(self, job_id):
+        job = self.job_queue.get(job_id)
+        if job is None or job.state != DONE:
+            return
 
-    def reset_ui_after_processing(self):
-        self.is_processing = False
-        self.drop_zone.setEnabled(True)
-        self.process_button.setVisible(True)
-        self.process_button.setEnabled(True)
-        self.cancel_button.setVisible(False)
-        self.cancel_button.setEnabled(True)
-        self.cancel_button.setText("Отмена")
+        if job_id in self.players:
+            self.players[job_id][0].raise_()
+            self.players[job_id][0].activateWindow()
+            return
 
-    def _process_htdemucs(self, mix, sample_rate, device, model_info, thread=None):
-        pass
+        tracks = {stem: dict(track) for stem, track in (job.tracks or {}).items()}
+        missing = [track['path'] for track in tracks.values() if not os.path.exists(track['path'])]
+        if not tracks or missing:
+            QMessageBox.warning(self, "Внимание", "Файлы результата не найдены:\n" + "\n".join(missing))
+            return
 
-    def _process_melband_roformer(self, mix, sample_rate, device, model_info, thread=None):
-        pass
+        self.open_player(job_id, tracks, Path(job.audio_file))
 
-    def _process_bs_roformer(self, mix, sample_rate, device, model_info, thread=None):
-        pass
+    def open_player(self, job_id, tracks, original_file):
+        from templates.audio_player import AudioPlayer
 
-    def open_player(self):
+        # Плеер не модальный: очередь продолжает работать, можно открыть несколько результатов
         player_dialog = QDialog(self)
-        player_dialog.setWindowTitle("Аудио плеер")
+        player_dialog.setWindowTitle(f"Аудио плеер - {original_file.name}")
         player_dialog.setMinimumSize(1000, 700)
+        player_dialog.setAttribute(Qt.WA_DeleteOnClose)
+
+        player = AudioPlayer(player_dialog, tracks, original_file)
+        player_dialog.finished.connect(lambda: self.close_player(job_id))
+        self.players[job_id] = (player_dialog, player)
+        player_dialog.show()
 
-        player = AudioPlayer(player_dialog, self.separated_tracks, self.selected_file)
-        player_dialog.exec_()
+    def close_player(self, job_id):
+        entry = self.players.pop(job_id, None)
+        if entry is not None:
+            entry[1].close()
 
     def run(self):
         self.show()
+        QTimer.singleShot(0, self.warm_up)
@@ -0,0 +1,147 @@
+import os
+import numpy as np
+import soundfile as sf
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from templates.mixer import ArraySource, FileSource, OUTPUT_CHANNELS, to_output_channels
+
+EXPORT_BLOCK_FRAMES = 1 << 16
+EXPORT_FORMATS = {'.wav': 'WAV', '.flac': 'FLAC', '.ogg': 'OGG'}
+EXPORT_FILTER = "WAV файлы (*.wav);;FLAC файлы (*.flac);;Ogg Vorbis (*.ogg)"
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def get_export_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXPORT_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат: {ext or path}")
+    return EXPORT_FORMATS[ext]
+
+
+def get_stem_path(mix_path, stem):
+    base, ext = os.path.splitext(mix_path)
+    return f"{base}_{stem}{ext}"
+
+
+def open_track_source(track_data):
+    # Separate sources for the export thread: the player keeps reading its own file handles meanwhile
+    if 'data' in track_data:
+        return ArraySource(track_data['data'])
+    return FileSource(track_data['path'])
+
+
+class BlockMixer:
+    # Mixes one block at a time into a preallocated accumulator, so memory does not grow with track length
+    def __init__(self, sources, gains, block_frames=EXPORT_BLOCK_FRAMES):
+        self.sources = sources
+        self.gains = gains
+        self.frames = max((source.frames for source in sources), default=0)
+        self.block_frames = block_frames
+        self.accumulator = np.zeros((OUTPUT_CHANNELS, block_frames), dtype=np.float32)
+
+    def blocks(self):
+        # Yields (stem blocks, mix block); the mix block is reused and only valid until the next step
+        for start in range(0, self.frames, self.block_frames):
+            frames = min(self.block_frames, self.frames - start)
+            mix = self.accumulator[:, :frames]
+            mix.fill(0)
+
+            stems = []
+            for source, gain in zip(self.sources, self.gains):
+                block = source.read(start, frames)
+                stems.append(block)
+                if gain and block.shape[-1]:
+                    mix[:, :block.shape[-1]] += to_output_channels(block) * gain
+            yield start, stems, mix
+
+
+def export_tracks(tracks, gains, mix_path, sample_rate, export_stems=True, progress=None, is_cancelled=None):
+    # Two passes over the stems: the first finds the peak of the mix, the second writes the normalized mix
+    # and every stem side by side. Returns the written paths
+    file_format = get_export_format(mix_path)
+    names = list(tracks)
+    sources = [open_track_source(tracks[name]) for name in names]
+    mixer = BlockMixer(sources, gains)
+    total_steps = max(1, 2 * mixer.frames)
+
+    def step(done):
+        if is_cancelled is not None and is_cancelled():
+            raise ExportCancelled()
+        if progress is not None:
+            progress(int(100 * done / total_steps))
+
+    written = []
+    files = []
+    try:
+        peak = 0.0
+        for start, _, mix in mixer.blocks():
+            peak = max(peak, float(np.abs(mix).max()))
+            step(start + mix.shape[-1])
+        scale = 1 / peak if peak > 0 else 1.0
+
+        mix_file = sf.SoundFile(mix_path, 'w', sample_rate, OUTPUT_CHANNELS, format=file_format)
+        files.append(mix_file)
+        written.append(mix_path)
+
+        stem_files = []
+        if export_stems:
+            for name, source in zip(names, sources):
+                channels = source.read(0, 1).shape[0] or 1
+                stem_path = get_stem_path(mix_path, name)
+                stem_files.append(sf.SoundFile(stem_path, 'w', sample_rate, channels, format=file_format))
+                files.append(stem_files[-1])
+                written.append(stem_path)
+
+        for start, stems, mix in mixer.blocks():
+            mix *= scale
+            mix_file.write(mix.T)
+            for stem_file, block in zip(stem_files, stems):
+                if block.shape[-1] < mix.shape[-1]:
+                    block = np.pad(block, ((0, 0), (0, mix.shape[-1] - block.shape[-1])))
+                stem_file.write(np.clip(block, -1, 1).T)
+            step(mixer.frames + start + mix.shape[-1])
+    except BaseException:
+        for f in files:
+            f.close()
+        for path in written:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        for f in files:
+            f.close()
+        for source in sources:
+            source.close()
+
+    return written
+
+
+class ExportThread(QThread):
+    progress = pyqtSignal(int)
+    finished_export = pyqtSignal(list)
+    error = pyqtSignal(str)
+
+    def __init__(self, tracks, gains, mix_path, sample_rate, export_stems=True):
+        super().__init__()
+        self.tracks = tracks
+        self.gains = gains
+        self.mix_path = mix_path
+        self.sample_rate = sample_rate
+        self.export_stems = export_stems
+
+    def run(self):
+        try:
+            written = export_tracks(self.tracks, self.gains, self.mix_path, self.sample_rate,
+                                    export_stems=self.export_stems, progress=self.progress.emit,
+                                    is_cancelled=self.isInterruptionRequested)
+            self.finished_export.emit(written)
+        except ExportCancelled:
+            self.error.emit("Экспорт отменён")
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.error.emit(str(e))
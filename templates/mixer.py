@@ -0,0 +1,190 @@
+import numpy as np
+import soundfile as sf
+
+from PyQt5.QtCore import QIODevice
+from PyQt5.QtMultimedia import QAudio, QAudioFormat, QAudioOutput
+
+from templates.waveform import as_channels_first
+
+OUTPUT_CHANNELS = 2
+# Audio buffered ahead of the playhead; smaller reacts faster to seeks and gain changes, larger survives GUI stalls
+BUFFER_SECONDS = 0.1
+INT16_SCALE = 32767
+
+
+class ArraySource:
+    # Stem held in memory (possibly a view into the worker's shared memory); read() returns views, not copies
+    def __init__(self, data):
+        self.data = as_channels_first(np.asarray(data, dtype=np.float32))
+        self.frames = self.data.shape[-1]
+
+    def read(self, start, frames):
+        return self.data[:, start:start + frames]
+
+    def close(self):
+        self.data = None
+
+
+class FileSource:
+    # Stem streamed to disk during separation: read block by block instead of loading it whole
+    def __init__(self, path):
+        self.file = sf.SoundFile(path)
+        self.frames = self.file.frames
+
+    def read(self, start, frames):
+        self.file.seek(start)
+        return self.file.read(frames, dtype='float32', always_2d=True).T
+
+    def close(self):
+        self.file.close()
+
+
+def to_output_channels(block):
+    if block.shape[0] == OUTPUT_CHANNELS:
+        return block
+    if block.shape[0] == 1:
+        return np.broadcast_to(block, (OUTPUT_CHANNELS, block.shape[-1]))
+    return block[:OUTPUT_CHANNELS]
+
+
+class StemMixer(QIODevice):
+    # Pull-mode source for QAudioOutput: every readData() call mixes the next block of all audible stems with
+    # one gain per stem. Gains are ramped over the block, so volume, mute and solo changes do not click
+    def __init__(self, sources, sample_rate, parent=None):
+        super().__init__(parent)
+        self.sources = sources
+        self.sample_rate = sample_rate
+        self.frames = max((source.frames for source in sources), default=0)
+        self.position = 0
+
+        self.gains = np.ones(len(sources), dtype=np.float32)
+        self.applied_gains = self.gains.copy()
+
+        self.open(QIODevice.ReadOnly)
+
+    def set_gains(self, gains):
+        self.gains = np.asarray(gains, dtype=np.float32)
+
+    def seek_frame(self, frame):
+        self.position = min(max(0, int(frame)), self.frames)
+
+    def at_end(self):
+        return self.position >= self.frames
+
+    def mix(self, frames):
+        frames = min(frames, self.frames - self.position)
+        out = np.zeros((OUTPUT_CHANNELS, frames), dtype=np.float32)
+        if frames <= 0:
+            return out
+
+        ramp = np.linspace(0, 1, frames, endpoint=False, dtype=np.float32)
+        for source, start_gain, end_gain in zip(self.sources, self.applied_gains, self.gains):
+            if start_gain == 0 and end_gain == 0:
+                continue
+            block = to_output_channels(source.read(self.position, frames))
+            length = block.shape[-1]
+            if length == 0:
+                continue
+            gain = start_gain + (end_gain - start_gain) * ramp[:length] if start_gain != end_gain else start_gain
+            out[:, :length] += block * gain
+
+        self.applied_gains = self.gains.copy()
+        self.position += frames
+        return out
+
+    def readData(self, max_size):
+        frames = max_size // (OUTPUT_CHANNELS * 2)
+        out = self.mix(frames)
+        samples = np.clip(out.T, -1, 1) * INT16_SCALE
+        return samples.astype('<i2').tobytes()
+
+    def writeData(self, data):
+        return -1
+
+    def isSequential(self):
+        return True
+
+    def bytesAvailable(self):
+        return (self.frames - self.position) * OUTPUT_CHANNELS * 2 + super().bytesAvailable()
+
+    def release(self):
+        self.close()
+        for source in self.sources:
+            source.close()
+
+
+def create_audio_format(sample_rate):
+    audio_format = QAudioFormat()
+    audio_format.setSampleRate(sample_rate)
+    audio_format.setChannelCount(OUTPUT_CHANNELS)
+    audio_format.setSampleSize(16)
+    audio_format.setCodec("audio/pcm")
+    audio_format.setByteOrder(QAudioFormat.LittleEndian)
+    audio_format.setSampleType(QAudioFormat.SignedInt)
+    return audio_format
+
+
+class MixerPlayback:
+    # One audio output for all stems; the playhead is the mixer's read position minus what is still buffered
+    def __init__(self, mixer, parent=None, on_finished=None):
+        self.mixer = mixer
+        self.output = QAudioOutput(create_audio_format(mixer.sample_rate), parent)
+        self.output.setBufferSize(int(mixer.sample_rate * BUFFER_SECONDS) * OUTPUT_CHANNELS * 2)
+        self.output.stateChanged.connect(self.on_state_changed)
+        self.on_finished = on_finished
+        self.paused = False
+
+    def on_state_changed(self, state):
+        # The output goes idle once the mixer has nothing left to read
+        if state == QAudio.IdleState and self.mixer.at_end():
+            self.output.stop()
+            if self.on_finished is not None:
+                self.on_finished()
+
+    def start(self):
+        if not self.mixer.isOpen():
+            self.mixer.open(QIODevice.ReadOnly)
+        self.output.start(self.mixer)
+
+    def is_active(self):
+        return self.output.state() in (QAudio.ActiveState, QAudio.IdleState)
+
+    def play(self):
+        if self.paused:
+            self.output.resume()
+        else:
+            if self.mixer.at_end():
+                self.mixer.seek_frame(0)
+            self.start()
+        self.paused = False
+
+    def pause(self):
+        self.output.suspend()
+        self.paused = True
+
+    def stop(self):
+        self.output.stop()
+        self.paused = False
+        self.mixer.seek_frame(0)
+
+    def seek(self, frame):
+        # Drops the audio already queued, so playback continues exactly from the new frame
+        active = self.is_active() or self.paused
+        paused = self.paused
+        self.output.stop()
+        self.mixer.seek_frame(frame)
+        self.paused = False
+        if active:
+            self.start()
+            if paused:
+                self.pause()
+
+    def playhead(self):
+        if self.output.state() == QAudio.StoppedState:
+            return self.mixer.position
+        queued = (self.output.bufferSize() - self.output.bytesFree()) // (OUTPUT_CHANNELS * 2)
+        return max(0, self.mixer.position - queued)
+
+    def close(self):
+        self.output.stop()
+        self.mixer.release()
@@ -0,0 +1,128 @@
+import numpy as np
+import soundfile as sf
+
+from PyQt5.QtCore import Qt, QLineF, QPointF
+from PyQt5.QtGui import QImage, QPainter, QColor, QPen, QPolygonF
+
+# Samples per entry of the finest pyramid level; each next level halves the resolution
+PEAK_BLOCK_SIZE = 128
+MIN_LEVEL_SIZE = 256
+MAX_CHANNELS = 8
+
+FILL_ALPHA = 0.4
+
+
+def as_channels_first(data):
+    if data.ndim == 1:
+        return data.reshape(1, -1)
+    if 0 < data.shape[-1] < data.shape[0] and data.shape[-1] <= MAX_CHANNELS:
+        # (frames, channels)
+        return data.T
+    return data
+
+
+def block_peaks(data, block_size=PEAK_BLOCK_SIZE):
+    # (channels, frames) -> min and max of every block over all channels, without copying the signal
+    frames = data.shape[-1]
+    full = frames // block_size
+
+    mins = []
+    maxs = []
+    if full:
+        blocks = data[:, :full * block_size].reshape(data.shape[0], full, block_size)
+        mins.append(blocks.min(axis=(0, 2)))
+        maxs.append(blocks.max(axis=(0, 2)))
+    if frames % block_size:
+        tail = data[:, full * block_size:]
+        mins.append(tail.min(axis=(0, 1), keepdims=True)[0])
+        maxs.append(tail.max(axis=(0, 1), keepdims=True)[0])
+
+    if not mins:
+        return np.zeros(1, dtype=np.float32), np.zeros(1, dtype=np.float32)
+    return np.concatenate(mins).astype(np.float32), np.concatenate(maxs).astype(np.float32)
+
+
+class PeakPyramid:
+    # Min/max envelope of a track at several resolutions, computed once; columns() picks the level closest
+    # to the requested width, so drawing costs the same for any track length
+    def __init__(self, mins, maxs, frames, block_size=PEAK_BLOCK_SIZE):
+        self.frames = frames
+        self.block_size = block_size
+        self.levels = [(mins, maxs)]
+
+        while len(mins) > MIN_LEVEL_SIZE:
+            if len(mins) % 2:
+                mins = np.append(mins, mins[-1])
+                maxs = np.append(maxs, maxs[-1])
+            mins = np.minimum(mins[0::2], mins[1::2])
+            maxs = np.maximum(maxs[0::2], maxs[1::2])
+            self.levels.append((mins, maxs))
+
+        self.peak = float(max(np.abs(mins).max(), np.abs(maxs).max())) or 1.0
+
+    @classmethod
+    def from_array(cls, data, block_size=PEAK_BLOCK_SIZE):
+        data = as_channels_first(np.asarray(data))
+        mins, maxs = block_peaks(data, block_size)
+        return cls(mins, maxs, data.shape[-1], block_size)
+
+    @classmethod
+    def from_file(cls, path, block_size=PEAK_BLOCK_SIZE):
+        # Read in blocks, so a stem on disk is never fully loaded into memory
+        mins = []
+        maxs = []
+        frames = 0
+        for block in sf.blocks(path, blocksize=block_size * 4096, dtype='float32', always_2d=True):
+            block_mins, block_maxs = block_peaks(block.T, block_size)
+            mins.append(block_mins)
+            maxs.append(block_maxs)
+            frames += len(block)
+
+        if not frames:
+            return cls(np.zeros(1, dtype=np.float32), np.zeros(1, dtype=np.float32), 0, block_size)
+        return cls(np.concatenate(mins), np.concatenate(maxs), frames, block_size)
+
+    def columns(self, width, start=0, end=None):
+        # Min and max per pixel column for frames [start, end)
+        end = self.frames if end is None else end
+        samples_per_column = max(1, end - start) / width
+
+        level = 0
+        while level + 1 < len(self.levels) and self.block_size << (level + 1) <= samples_per_column:
+            level += 1
+        level_block = self.block_size << level
+        mins, maxs = self.levels[level]
+
+        last = max(1, min(len(mins), -(-end // level_block)))
+        edges = np.linspace(start, end, width + 1)[:-1] // level_block
+        edges = np.clip(edges.astype(np.int64), 0, last - 1)
+        return np.minimum.reduceat(mins[:last], edges), np.maximum.reduceat(maxs[:last], edges)
+
+
+def render_waveform(peaks, width, height, color, start=0, end=None):
+    width = max(1, int(width))
+    height = max(1, int(height))
+
+    image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.transparent)
+
+    mins, maxs = peaks.columns(width, start, end)
+    middle = height / 2
+    tops = middle - np.clip(maxs / peaks.peak, -1, 1) * (middle - 1)
+    bottoms = middle - np.clip(mins / peaks.peak, -1, 1) * (middle - 1)
+
+    painter = QPainter(image)
+
+    fill_color = QColor(color)
+    fill_color.setAlphaF(FILL_ALPHA)
+    painter.setPen(QPen(fill_color, 1))
+    painter.drawLines([QLineF(x + 0.5, top, x + 0.5, bottom)
+                       for x, (top, bottom) in enumerate(zip(tops.tolist(), bottoms.tolist()))])
+
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(QPen(QColor(color), 1.2))
+    for edge in (tops, bottoms):
+        painter.drawPolyline(QPolygonF([QPointF(x + 0.5, y) for x, y in enumerate(edge.tolist())]))
+
+    painter.end()
+    return image
@@ -0,0 +1,118 @@
+#
+# The fused band split and mask head (models/band_ops.py) against the per-band modules they replace.
+#
+#   python -m pytest tests
+#
+
+import pytest
+import torch
+
+import models.band_ops as band_ops
+from models.bs_roformer import BSRoformer
+from models.mel_band_roformer import MelBandRoformer
+
+DIM = 16
+# Outputs reach ~50 with these weights; the per-band loop itself is ~1e-5 off a float64 reference there
+TOLERANCE = dict(rtol=1e-4, atol=1e-4)
+
+
+def build_model(name):
+    # The band layouts are the models' defaults (the shipped configs keep them); only the width is reduced
+    common = dict(dim=DIM, depth=1, stereo=True, num_stems=4, time_transformer_depth=1, freq_transformer_depth=1,
+                  dim_head=8, heads=2, mask_estimator_depth=2)
+    if name == 'bs_roformer':
+        model = BSRoformer(**common)
+    else:
+        model = MelBandRoformer(num_bands=60, sample_rate=44100, **common)
+
+    generator = torch.Generator().manual_seed(0)
+    with torch.no_grad():
+        for param in model.parameters():
+            param.copy_(torch.randn(param.shape, generator=generator) * 0.5 + (1 if param.dim() == 1 else 0))
+    return model.eval()
+
+
+def reference_band_split(module, x):
+    splits = x.split(module.dim_inputs, dim=-1)
+    return torch.stack([net(split) for split, net in zip(splits, module.to_features)], dim=-2)
+
+
+def reference_mask_estimators(estimators, x, stems=None):
+    stems = range(len(estimators)) if stems is None else stems
+    masks = []
+    for stem in stems:
+        estimator = estimators[stem]
+        bands = x.unbind(dim=-2)
+        masks.append(torch.cat([mlp(band) for band, mlp in zip(bands, estimator.to_freqs)], dim=-1))
+    return torch.stack(masks, dim=-2)
+
+
+@pytest.fixture(scope='module', params=['bs_roformer', 'mel_band_roformer'])
+def model(request):
+    return build_model(request.param)
+
+
+@pytest.mark.parametrize("max_waste", [0., 0.25, 1.])
+def test_band_split_matches_per_band_loop(model, monkeypatch, max_waste):
+    # max_waste 0 keeps equal-width runs only (the cpu default), the others merge bands of different widths
+    monkeypatch.setattr(band_ops, 'MAX_PADDING_WASTE_CPU', max_waste)
+    module = model.band_split
+    module._packed = None
+    x = torch.randn(2, 5, sum(module.dim_inputs), generator=torch.Generator().manual_seed(1))
+
+    with torch.inference_mode():
+        fused = band_ops.fused_band_split(module, x)
+        expected = reference_band_split(module, x)
+
+    assert fused.shape == expected.shape == (2, 5, len(module.dim_inputs), DIM)
+    torch.testing.assert_close(fused, expected, **TOLERANCE)
+
+
+def test_band_split_is_repacked_after_weight_update(model):
+    module = model.band_split
+    x = torch.randn(1, 3, sum(module.dim_inputs), generator=torch.Generator().manual_seed(2))
+
+    with torch.inference_mode():
+        band_ops.fused_band_split(module, x)
+    with torch.no_grad():
+        module.to_features[0][0].gamma.mul_(2)
+    with torch.inference_mode():
+        fused = band_ops.fused_band_split(module, x)
+        expected = reference_band_split(module, x)
+
+    torch.testing.assert_close(fused, expected, **TOLERANCE)
+
+
+@pytest.mark.parametrize("max_waste", [0., 0.25, 1.])
+@pytest.mark.parametrize("stems", [None, [3], [2, 0]])
+def test_mask_estimators_match_per_band_loop(model, monkeypatch, stems, max_waste):
+    # max_waste 0 keeps equal-width runs only, the others pad the last layer of narrower bands
+    monkeypatch.setattr(band_ops, 'MAX_MASK_PADDING_WASTE_CPU', max_waste)
+    model.mask_estimators._packed = None
+    num_bands = len(model.mask_estimators[0].to_freqs)
+    x = torch.randn(2, 5, num_bands, DIM, generator=torch.Generator().manual_seed(3))
+
+    with torch.inference_mode():
+        fused = band_ops.fused_mask_estimators(model.mask_estimators, x, stems)
+        expected = reference_mask_estimators(model.mask_estimators, x, stems)
+
+    torch.testing.assert_close(fused, expected, **TOLERANCE)
+
+
+def test_mask_estimator_buckets_are_padded(model):
+    # both default layouts have runs of bands of different widths that are merged into one bucket on cpu
+    model.mask_estimators._packed = None
+    dim_inputs = model.mask_estimators[0].dim_inputs
+    packed = band_ops.pack_mask_estimators(model.mask_estimators)
+
+    assert len(packed.buckets) < len(band_ops.get_band_buckets(dim_inputs, max_waste=0.))
+    assert any(glu_index is not None for _, _, glu_index in packed.buckets)
+
+
+def test_mask_estimator_weights_are_views_of_the_pack(model):
+    size = sum(p.numel() for p in model.mask_estimators.parameters())
+    packed = band_ops.pack_mask_estimators(model.mask_estimators)
+
+    storages = {t.untyped_storage().data_ptr() for _, layers, _ in packed.buckets for layer in layers for t in layer}
+    assert {p.untyped_storage().data_ptr() for p in model.mask_estimators.parameters()} == storages
+    assert sum(p.numel() for p in model.mask_estimators.parameters()) == size
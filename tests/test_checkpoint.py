@@ -0,0 +1,62 @@
+#
+# Resuming overlap_add_demix from a DemixCheckpoint (utils/checkpoint.py).
+#
+#   python -m pytest tests
+#
+
+import pytest
+import torch
+
+from test_overlap_add import ChunkModel, NUM_STEMS, CHANNELS
+from utils.checkpoint import DemixCheckpoint
+from utils.overlap_add import DemixCancelled, overlap_add_demix
+
+CHUNK_SIZE, STEP, BATCH_SIZE = 64, 32, 2
+PARAMS = {"model": "ChunkModel", "chunk_size": CHUNK_SIZE, "step": STEP}
+
+
+class CancelAfter:
+    # Progress reporter that cancels the job once `chunks` chunks are done
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.done = 0
+
+    def update_progress(self, percent):
+        pass
+
+    def update_chunks(self, done, total):
+        self.done = done
+
+    def is_cancelled(self):
+        return self.done >= self.chunks
+
+
+def demix(mix, checkpoint=None, progress_bar=None):
+    with torch.inference_mode():
+        return overlap_add_demix(ChunkModel(), mix, CHUNK_SIZE, STEP, BATCH_SIZE, NUM_STEMS, 'cpu',
+                                 progress_bar=progress_bar, checkpoint=checkpoint)
+
+
+def interrupt(mix, tmp_path, params):
+    with pytest.raises(DemixCancelled):
+        demix(mix, DemixCheckpoint("job", checkpoint_dir=tmp_path, params=params), CancelAfter(4))
+
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path):
+    mix = torch.randn(CHANNELS, 500, generator=torch.Generator().manual_seed(0))
+    interrupt(mix, tmp_path, PARAMS)
+
+    checkpoint = DemixCheckpoint("job", checkpoint_dir=tmp_path, params=PARAMS)
+    assert checkpoint.load()["next_frame"] == 4
+    torch.testing.assert_close(demix(mix, checkpoint), demix(mix), rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize("changed", [{"model": "OtherModel"}, {"quantize": "int8"}, {"chunk_size": 128},
+                                     {"step": 16}, None])
+def test_checkpoint_of_other_params_is_discarded(tmp_path, changed):
+    mix = torch.randn(CHANNELS, 500, generator=torch.Generator().manual_seed(1))
+    interrupt(mix, tmp_path, PARAMS)
+
+    checkpoint = DemixCheckpoint("job", checkpoint_dir=tmp_path, params=dict(PARAMS, **changed) if changed else None)
+    assert checkpoint.load() is None
+    assert not checkpoint.path.exists()
@@ -0,0 +1,107 @@
+#
+# overlap_add_demix against a plain per-chunk loop (the demix loop it replaced).
+#
+#   python -m pytest tests
+#
+
+import pytest
+import torch
+import torch.nn as nn
+
+from utils.overlap_add import get_fade_window, overlap_add_demix
+
+NUM_STEMS = 3
+CHANNELS = 2
+
+
+class ChunkModel(nn.Module):
+    # Deterministic stand-in for a separation model: every stem depends on the whole chunk and on the
+    # position inside it, so a misplaced or misweighted chunk shows up in the result
+    def __init__(self, num_stems=NUM_STEMS):
+        super().__init__()
+        generator = torch.Generator().manual_seed(0)
+        self.scale = nn.Parameter(torch.rand(num_stems, generator=generator) + 0.5)
+
+    def forward(self, x):
+        position = torch.linspace(0, 1, x.shape[-1])
+        mean = x.mean(dim=-1, keepdim=True)
+        return torch.tanh(x[:, None] * self.scale[:, None, None] + mean[:, None] * position)
+
+
+def reference_demix(model, mix, chunk_size, step, batch_size, num_stems, fade_size=None, pad_mode='constant'):
+    length = mix.shape[-1]
+    starts = list(range(0, length, step)) or [0]
+    result = torch.zeros((num_stems, mix.shape[0], length), dtype=torch.float64)
+    counter = torch.zeros(length, dtype=torch.float64)
+
+    for first in range(0, len(starts), batch_size):
+        batch = starts[first:first + batch_size]
+        parts = []
+        for start in batch:
+            part = mix[:, start:start + chunk_size]
+            part_length = part.shape[-1]
+            if part_length < chunk_size:
+                if pad_mode == 'reflect' and part_length > chunk_size // 2 + 1:
+                    part = nn.functional.pad(part, (0, chunk_size - part_length), mode='reflect')
+                else:
+                    part = nn.functional.pad(part, (0, chunk_size - part_length))
+            parts.append(part)
+        x = model(torch.stack(parts)).double()
+
+        for j, start in enumerate(batch):
+            index = first + j
+            window = get_fade_window(chunk_size, fade_size) if fade_size else torch.ones(chunk_size)
+            if fade_size and index == 0:
+                window[:fade_size] = 1
+            if fade_size and index == len(starts) - 1:
+                window[-fade_size:] = 1
+            window = window.double()
+
+            part_length = min(chunk_size, length - start)
+            result[..., start:start + part_length] += x[j][..., :part_length] * window[:part_length]
+            counter[start:start + part_length] += window[:part_length]
+
+    return torch.nan_to_num(result / counter, nan=0.0).float()
+
+
+@pytest.mark.parametrize("chunk_size, num_overlap", [(64, 1), (64, 2), (64, 4), (100, 3), (37, 5)])
+@pytest.mark.parametrize("length_factor", [0.3, 0.9, 1.0, 2.5, 7.3])
+@pytest.mark.parametrize("batch_size", [1, 3])
+@pytest.mark.parametrize("fade", [False, True])
+def test_matches_per_chunk_loop(chunk_size, num_overlap, length_factor, batch_size, fade):
+    step = chunk_size // num_overlap
+    fade_size = chunk_size // 10 if fade else None
+    length = max(1, int(chunk_size * length_factor))
+    mix = torch.randn(CHANNELS, length, generator=torch.Generator().manual_seed(length))
+    model = ChunkModel()
+
+    with torch.inference_mode():
+        expected = reference_demix(model, mix, chunk_size, step, batch_size, NUM_STEMS, fade_size)
+        result = overlap_add_demix(model, mix, chunk_size, step, batch_size, NUM_STEMS, 'cpu', fade_size=fade_size)
+
+    assert result.shape == (NUM_STEMS, CHANNELS, length)
+    torch.testing.assert_close(result, expected, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize("length", [20, 40, 95, 150, 333])
+def test_reflect_padding_matches_per_chunk_loop(length):
+    chunk_size, step = 64, 16
+    mix = torch.randn(CHANNELS, length, generator=torch.Generator().manual_seed(length))
+    model = ChunkModel()
+
+    with torch.inference_mode():
+        expected = reference_demix(model, mix, chunk_size, step, 4, NUM_STEMS, pad_mode='reflect')
+        result = overlap_add_demix(model, mix, chunk_size, step, 4, NUM_STEMS, 'cpu', pad_mode='reflect')
+
+    torch.testing.assert_close(result, expected, rtol=0, atol=1e-6)
+
+
+def test_complement_is_mix_minus_stems():
+    chunk_size, step = 64, 32
+    mix = torch.randn(CHANNELS, 200, generator=torch.Generator().manual_seed(1))
+
+    with torch.inference_mode():
+        result = overlap_add_demix(ChunkModel(), mix, chunk_size, step, 2, NUM_STEMS, 'cpu', complement=True)
+
+    assert result.shape == (NUM_STEMS + 1, CHANNELS, 200)
+    torch.testing.assert_close(result.sum(dim=0), mix, rtol=0, atol=1e-5)
@@ -0,0 +1,77 @@
+#
+# The batched Wiener filter (models/wiener.py) against a per-sample, per-window loop written the way
+# openunmix.filtering.wiener does it (the code htdemucs called before).
+#
+#   python -m pytest tests
+#
+
+import pytest
+import torch
+
+from models.wiener import windowed_wiener
+
+WINDOW = 300
+
+
+def reference_em(y, x, iterations, eps=1e-10):
+    # y: [T, Fq, C, S], x: [T, Fq, C]; one covariance matrix per source and bin, estimated over the window
+    channels, sources = x.shape[-1], y.shape[-1]
+    regularization = eps ** 0.5 * torch.eye(channels, dtype=x.dtype)
+    for _ in range(iterations):
+        v = (y.abs() ** 2).mean(dim=-2)
+        R = []
+        for j in range(sources):
+            covariance = y[..., :, None, j] * y[..., None, :, j].conj()
+            R.append(covariance.sum(dim=0) / (eps + v[..., j].sum(dim=0))[:, None, None])
+
+        Cxx = regularization + sum(v[..., j, None, None] * R[j] for j in range(sources))
+        inv_Cxx = torch.linalg.inv(Cxx)
+        y = torch.stack([(v[..., j, None, None] * R[j] @ inv_Cxx @ x[..., None])[..., 0]
+                         for j in range(sources)], dim=-1)
+    return y
+
+
+def reference_wiener(mag, mix, iterations, residual, scale_factor=10.0):
+    # mag: [T, Fq, C, S], mix: [T, Fq, C]
+    y = mag * torch.exp(1j * mix.angle())[..., None]
+    if residual:
+        y = torch.cat([y, mix[..., None] - y.sum(dim=-1, keepdim=True)], dim=-1)
+    if iterations == 0:
+        return y
+
+    max_abs = max(1.0, mix.abs().max().item() / scale_factor)
+    return reference_em(y / max_abs, mix / max_abs, iterations) * max_abs
+
+
+def reference_windowed_wiener(mag_out, mix_stft, iterations, residual):
+    # mag_out: [B, S, C, Fq, T], mix_stft: [B, C, Fq, T]; every sample and window filtered on its own
+    S, T = mag_out.shape[1], mag_out.shape[-1]
+    mag_out = mag_out.permute(0, 4, 3, 2, 1)
+    mix_stft = mix_stft.permute(0, 3, 2, 1)
+    outs = []
+    for sample in range(mag_out.shape[0]):
+        out = []
+        for pos in range(0, T, WINDOW):
+            frame = slice(pos, pos + WINDOW)
+            out.append(reference_wiener(mag_out[sample, frame], mix_stft[sample, frame], iterations, residual))
+        outs.append(torch.cat(out, dim=0)[..., :S])
+    return torch.stack(outs).permute(0, 4, 3, 2, 1)
+
+
+@pytest.mark.parametrize("channels", [1, 2])
+@pytest.mark.parametrize("iterations", [0, 1, 2])
+@pytest.mark.parametrize("residual", [False, True])
+def test_matches_per_window_loop(channels, iterations, residual):
+    # 700 frames: two full windows and a partial one, padded with zeros by the batched version
+    B, S, Fq, T = 2, 4, 32, 700
+    generator = torch.Generator().manual_seed(channels * 10 + iterations)
+    mix = torch.randn(B, channels, Fq, T, dtype=torch.complex64, generator=generator) * 30
+    mag = torch.rand(B, S, channels, Fq, T, generator=generator) * 20
+
+    # small groups, so the windows are split across several calls
+    result = windowed_wiener(mag, mix, iterations, residual=residual, window=WINDOW, max_elements=1 << 16)
+    expected = reference_windowed_wiener(mag.double(), mix.to(torch.complex128), iterations, residual)
+
+    assert result.shape == (B, S, channels, Fq, T)
+    error = (result.to(torch.complex128) - expected).abs().max() / expected.abs().max()
+    assert error < 1e-5
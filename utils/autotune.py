@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import uuid
+import threading
+import torch
+
+from utils.user_data import get_user_data_dir
+from utils.quantization import is_quantization_applied
+
+# The first job of a model on a device and thread count measures batch and chunk sizes before it separates
+# (up to MAX_TUNING_SECONDS, once: the result is stored). AUDSEP_AUTOTUNE=0 skips it for the GUI and audsep alike,
+# the configured values are used then
+AUTOTUNE_ENABLED = os.environ.get("AUDSEP_AUTOTUNE", "1") != "0"
+TUNING_FILE_NAME = "autotune.json"
+
+BATCH_SIZE_CANDIDATES = (1, 2, 4, 8, 16)
+# Chunk sizes tried as multiples of the configured one (roformers only: HTDemucs has a fixed segment)
+CHUNK_SIZE_FACTORS = (1, 2)
+# A candidate replaces the configured values only if it is clearly faster, not just within measurement noise
+MIN_SPEEDUP = 1.05
+MAX_TUNING_SECONDS = 120
+MEMORY_BUDGET_FRACTION = 0.5
+# How often the RSS of the process is sampled while a candidate runs on the CPU, seconds
+MEMORY_SAMPLE_INTERVAL = 0.01
+
+
+def get_device_name(device):
+    device = torch.device(device)
+    if device.type == 'cuda' and torch.cuda.is_available():
+        return f"cuda:{torch.cuda.get_device_name(device)}"
+    return device.type
+
+
+def get_tuning_key(model_info, device, num_threads, quantized=False):
+    model_id = f"{model_info['model_id']}-int8" if quantized else model_info['model_id']
+    return f"{model_info['model']}:{model_id}:{get_device_name(device)}:{num_threads}"
+
+
+def get_tuning_path():
+    return get_user_data_dir() / TUNING_FILE_NAME
+
+
+def read_tunings():
+    try:
+        with open(get_tuning_path(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_tuning(key, tuning):
+    # Read-modify-write through a temporary file: several workers may tune different models at once
+    path = get_tuning_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tunings = read_tunings()
+    tunings[key] = tuning
+
+    temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+    with open(temp_path, 'w') as f:
+        json.dump(tunings, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def is_htdemucs(model_info):
+    return model_info["strategy"] == "demucs"
+
+
+def get_chunk_size(config, model_info):
+    if is_htdemucs(model_info):
+        return int(config.training.samplerate * config.training.segment)
+    return int(config.audio.chunk_size)
+
+
+def get_num_channels(config, model_info):
+    if is_htdemucs(model_info):
+        return int(config.training.channels)
+    return int(config.audio.get('num_channels', 2))
+
+
+def apply_params(config, model_info, batch_size, chunk_size):
+    config.inference.batch_size = int(batch_size)
+    if not is_htdemucs(model_info):
+        config.audio.chunk_size = int(chunk_size)
+
+
+def apply_saved_tuning(config, model_info, device=None, num_threads=None):
+    # Only looks up a previous measurement; returns the applied tuning or None
+    if not AUTOTUNE_ENABLED:
+        return None
+
+    device = device if device is not None else model_info["device"]
+    num_threads = num_threads or torch.get_num_threads()
+    quantized = is_quantization_applied(config, model_info)
+    tuning = read_tunings().get(get_tuning_key(model_info, device, num_threads, quantized))
+    if tuning is not None:
+        apply_params(config, model_info, tuning["batch_size"], tuning["chunk_size"])
+    return tuning
+
+
+def get_available_memory():
+    # MemAvailable counts reclaimable page cache, unlike SC_AVPHYS_PAGES (free pages only)
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_memory_budget(device):
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return int(torch.cuda.mem_get_info(device)[0] * MEMORY_BUDGET_FRACTION)
+    available = get_available_memory()
+    return int(available * MEMORY_BUDGET_FRACTION) if available is not None else None
+
+
+def get_current_rss():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+class PeakMemory:
+    # Peak memory a candidate takes on top of what was in use when it started: allocator statistics on CUDA,
+    # the RSS of the process sampled in a thread on the CPU (ru_maxrss is a lifetime peak and never goes down)
+    def __init__(self, device):
+        self.device = torch.device(device)
+        self.peak = None
+        self._start = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self._start = torch.cuda.memory_allocated(self.device)
+        elif self.device.type == 'cpu':
+            self._start = get_current_rss()
+            if self._start is not None:
+                self.peak = 0
+                self._thread = threading.Thread(target=self._sample, daemon=True)
+                self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(MEMORY_SAMPLE_INTERVAL):
+            self._update()
+
+    def _update(self):
+        rss = get_current_rss()
+        if rss is not None:
+            self.peak = max(self.peak, rss - self._start)
+
+    def __exit__(self, *exc):
+        if self.device.type == 'cuda':
+            self.peak = torch.cuda.max_memory_allocated(self.device) - self._start
+        elif self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._update()
+        return False
+
+
+def synchronize(device):
+    device = torch.device(device)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    elif device.type == 'mps':
+        torch.mps.synchronize()
+
+
+def empty_cache(device):
+    device = torch.device(device)
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+    elif device.type == 'mps':
+        torch.mps.empty_cache()
+
+
+def is_out_of_memory(error):
+    return isinstance(error, torch.cuda.OutOfMemoryError) or "out of memory" in str(error).lower()
+
+
+def measure(model, batch_size, channels, chunk_size, device, use_amp):
+    x = torch.randn(batch_size, channels, chunk_size, device=device) * 0.1
+    with torch.cuda.amp.autocast(enabled=use_amp):
+        with torch.inference_mode():
+            synchronize(device)
+            start = time.perf_counter()
+            model(x)
+            synchronize(device)
+    return time.perf_counter() - start
+
+
+def get_candidates(config, model_info):
+    default = (int(config.inference.batch_size), get_chunk_size(config, model_info))
+    factors = (1,) if is_htdemucs(model_info) else CHUNK_SIZE_FACTORS
+
+    candidates = [default]
+    for factor in factors:
+        for batch_size in BATCH_SIZE_CANDIDATES:
+            candidate = (batch_size, default[1] * factor)
+            if candidate not in candidates:
+                candidates.append(candidate)
+    return candidates
+
+
+def project_seconds(measured, batch_size, chunk_size):
+    # Time a candidate would take, scaled from the closest measured one (same chunk size if there is one)
+    if not measured:
+        return None
+    same_chunk = [m for m in measured if m[1] == chunk_size]
+    base_batch, base_chunk, base_seconds = (same_chunk or measured)[-1]
+    return base_seconds * (batch_size * chunk_size) / (base_batch * base_chunk)
+
+
+def tune(config, model, model_info, device=None, num_threads=None, progress_reporter=None):
+    # Measures chunk throughput (samples per second) of the candidate batch and chunk sizes, starting with the
+    # configured ones. For each chunk size, batch sizes grow until throughput stops improving, memory runs over
+    # the budget or the time limit is reached; candidates projected to overrun the time limit are skipped.
+    # The configured values are kept (and saved, so tuning is not repeated) unless a candidate beats them.
+    # Returns None only if cancelled
+    device = device if device is not None else model_info["device"]
+    num_threads = num_threads or torch.get_num_threads()
+    channels = get_num_channels(config, model_info)
+    use_amp = bool(config.training.get('use_amp', False))
+
+    budget = get_memory_budget(device)
+    candidates = get_candidates(config, model_info)
+    default = candidates[0]
+
+    # Warm-up: kernel selection, allocator and packed weights would otherwise be billed to the first candidate
+    measure(model, 1, channels, default[1], device, use_amp)
+
+    started = time.perf_counter()
+    results = []
+    measured = []
+    stopped_chunks = set()
+    last_throughput = {}
+    for index, (batch_size, chunk_size) in enumerate(candidates):
+        if progress_reporter is not None and progress_reporter.is_cancelled():
+            empty_cache(device)
+            return None
+
+        is_default = (batch_size, chunk_size) == default
+        if chunk_size in stopped_chunks and not is_default:
+            continue
+        remaining = MAX_TUNING_SECONDS - (time.perf_counter() - started)
+        projected = project_seconds(measured, batch_size, chunk_size)
+        if not is_default and (remaining <= 0 or (projected is not None and projected > remaining)):
+            continue
+
+        if progress_reporter is not None:
+            # A status, not progress: the progress bar belongs to the separation that follows
+            progress_reporter.update_status(f"Подбор параметров: вариант {index + 1} из {len(candidates)} "
+                                            f"(один раз, отключается AUDSEP_AUTOTUNE=0)")
+        try:
+            with PeakMemory(device) as peak_memory:
+                seconds = measure(model, batch_size, channels, chunk_size, device, use_amp)
+        except (RuntimeError, MemoryError) as e:
+            if not is_out_of_memory(e) and not isinstance(e, MemoryError):
+                raise
+            print(f"Недостаточно памяти для batch_size={batch_size}, chunk_size={chunk_size}")
+            stopped_chunks.add(chunk_size)
+            empty_cache(device)
+            continue
+
+        measured.append((batch_size, chunk_size, seconds))
+        throughput = batch_size * chunk_size / seconds
+        print(f"batch_size={batch_size}, chunk_size={chunk_size}: {throughput:.0f} сэмплов/с")
+
+        # The configured values stay a valid choice even over the budget: they are what would run anyway
+        if not is_default and budget is not None and peak_memory.peak is not None and peak_memory.peak > budget:
+            stopped_chunks.add(chunk_size)
+            continue
+        results.append({"batch_size": batch_size, "chunk_size": chunk_size, "throughput": round(throughput, 1)})
+
+        if not is_default:
+            if throughput < last_throughput.get(chunk_size, 0):
+                stopped_chunks.add(chunk_size)
+            last_throughput[chunk_size] = throughput
+
+    empty_cache(device)
+
+    default_result = next((result for result in results
+                           if (result["batch_size"], result["chunk_size"]) == default), None)
+    best = max(results, key=lambda result: result["throughput"]) if results else None
+    if best is None or (default_result is not None and best["throughput"] < default_result["throughput"] * MIN_SPEEDUP):
+        best = default_result or {"batch_size": default[0], "chunk_size": default[1], "throughput": None}
+
+    tuning = {
+        "batch_size": best["batch_size"],
+        "chunk_size": best["chunk_size"],
+        "throughput": best["throughput"],
+        "measured": results,
+        "timestamp": int(time.time()),
+    }
+    quantized = is_quantization_applied(config, model_info)
+    save_tuning(get_tuning_key(model_info, device, num_threads, quantized), tuning)
+    return tuning
+
+
+def autotune(config, model, model_info, progress_reporter=None):
+    # Applies the stored tuning for this model, device and thread count, measuring it first if there is none
+    if not AUTOTUNE_ENABLED:
+        return None
+
+    tuning = apply_saved_tuning(config, model_info)
+    if tuning is not None:
+        return tuning
+
+    print(f"Подбор batch_size и chunk_size для {get_device_name(model_info['device'])}, "
+          f"потоков: {torch.get_num_threads()}")
+    if progress_reporter is not None:
+        progress_reporter.update_status("Подбор параметров...")
+    tuning = tune(config, model, model_info, progress_reporter=progress_reporter)
+    if tuning is not None:
+        apply_params(config, model_info, tuning["batch_size"], tuning["chunk_size"])
+        print(f"Выбрано: batch_size={tuning['batch_size']}, chunk_size={tuning['chunk_size']}")
+    return tuning
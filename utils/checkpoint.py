@@ -0,0 +1,87 @@
+import os
+import time
+import uuid
+import torch
+
+from pathlib import Path
+
+from utils.user_data import get_user_data_dir
+
+# How often (seconds) a running separation saves its partial result; 0 disables checkpoints
+CHECKPOINT_INTERVAL = float(os.environ.get("AUDSEP_CHECKPOINT_INTERVAL", 120))
+# Checkpoints of jobs that were never resumed are removed after this many seconds
+CHECKPOINT_MAX_AGE = 7 * 24 * 3600
+CHECKPOINT_DIR_NAME = "checkpoints"
+
+
+def get_checkpoint_dir():
+    return get_user_data_dir() / CHECKPOINT_DIR_NAME
+
+
+class DemixCheckpoint:
+    # Partial overlap-add state of one separation: the accumulators and the next batch to run. Saved every
+    # `interval` seconds and when the job is cancelled, so a cancelled, killed or crashed job continues from
+    # the last saved batch instead of the start. params (model, quantization, chunk size, step, ...) are saved
+    # with the state; a state saved with other params is discarded when loaded, before anything resumes from it
+    def __init__(self, key, checkpoint_dir=None, interval=CHECKPOINT_INTERVAL, params=None):
+        checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir is not None else get_checkpoint_dir()
+        self.path = checkpoint_dir / f"{key}.pt"
+        self.params = params
+        self.interval = interval
+        # Set by the stream writer: frames written to the output files and their stems, saved with the state
+        self.output = None
+        self._state = None
+        self._loaded = False
+        self._last_saved = time.monotonic()
+
+    def load(self):
+        # The saved state, read once; None when there is nothing to resume
+        if not self._loaded:
+            self._loaded = True
+            try:
+                self._state = torch.load(self.path, map_location='cpu', weights_only=True)
+            except FileNotFoundError:
+                self._state = None
+            except Exception as e:
+                print(f"Повреждённая контрольная точка {self.path.name}: {e}")
+                self.clear()
+            if self._state is not None and self._state.get("params") != self.params:
+                print(f"Контрольная точка {self.path.name} сохранена с другими параметрами, начинаем сначала")
+                self.clear()
+        return self._state
+
+    def due(self):
+        return time.monotonic() - self._last_saved >= self.interval
+
+    def save(self, state):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}")
+        try:
+            torch.save(dict(state, output=self.output, params=self.params), temp_path)
+            os.replace(temp_path, self.path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        self._last_saved = time.monotonic()
+
+    def clear(self):
+        self._state = None
+        self._loaded = True
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def remove_stale_checkpoints(checkpoint_dir=None, max_age=CHECKPOINT_MAX_AGE):
+    checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir is not None else get_checkpoint_dir()
+    if not checkpoint_dir.exists():
+        return
+
+    now = time.time()
+    for path in checkpoint_dir.iterdir():
+        try:
+            if now - path.stat().st_mtime > max_age:
+                path.unlink()
+        except OSError:
+            pass
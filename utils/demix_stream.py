@@ -0,0 +1,287 @@
+import os
+import torch
+import torch.nn as nn
+import soundfile as sf
+
+from utils.demix_track import prefer_target_instrument
+from utils.overlap_add import (get_num_frames, get_frame_weights, fold_frames, reflect_pad_tail, run_model,
+                               get_silence_stem, report_progress, report_skipped_chunks, report_resumed, is_cancelled,
+                               select_stems, get_stems_model, fill_complement, COMPLEMENT_STEM, DemixCancelled)
+
+STREAM_BLOCK_SIZE = 44100 * 10
+
+
+def read_audio_blocks(audio_file, block_size=STREAM_BLOCK_SIZE):
+    for block in sf.blocks(audio_file, blocksize=block_size, dtype='float32', always_2d=True):
+        yield torch.from_numpy(block.T.copy())
+
+
+def get_audio_length(audio_file):
+    info = sf.info(audio_file)
+    return info.frames, info.samplerate
+
+
+def stream_overlap_add_demix(model, blocks, length, chunk_size, step, batch_size, num_stems, device,
+                             fade_size=None, pad_mode='constant', progress_bar=None, min_mean_abs=0.0,
+                             silence_stem=None, complement=False, checkpoint=None):
+    # Same framing as overlap_add_demix, but only a rolling window of input, result and counter is kept:
+    # once a batch is folded in, every sample before the next frame start is final and is yielded.
+    # With a checkpoint, the window is saved between batches, once the previous output block was consumed
+    # (so it matches what the writer has written), and a saved run continues from its next batch
+    num_frames = get_num_frames(length, step)
+
+    pending = None
+    in_start = 0
+    result = None
+    counter = None
+    out_start = 0
+    skipped = 0
+    first_frame = 0
+
+    state = checkpoint.load() if checkpoint is not None else None
+    if state is not None:
+        first_frame, in_start, out_start = state["next_frame"], state["in_start"], state["out_start"]
+        result, counter, skipped = state["result"], state["counter"], state["skipped"]
+        # The input before in_start went into the saved window already
+        blocks = _trim_blocks(blocks, in_start, length)
+        report_resumed(progress_bar, first_frame, num_frames)
+    blocks = iter(blocks)
+
+    report_progress(progress_bar, first_frame, num_frames)
+    for first in range(first_frame, num_frames, batch_size):
+        last = min(first + batch_size, num_frames)
+        start = first * step
+        need_end = min(length, (last - 1) * step + chunk_size)
+
+        while pending is None or in_start + pending.shape[-1] < need_end:
+            block = next(blocks, None)
+            if block is None:
+                break
+            pending = block if pending is None else torch.cat([pending, block], dim=-1)
+
+        span = (last - first - 1) * step + chunk_size
+        segment = pending[:, start - in_start:need_end - in_start]
+        segment = nn.functional.pad(segment, (0, span - segment.shape[-1]))
+        channels = segment.shape[0]
+
+        arr = segment.unfold(-1, chunk_size, step).transpose(0, 1).to(device).clone()
+        if pad_mode == 'reflect':
+            for j in range(first, last):
+                frame_length = length - j * step
+                if frame_length < chunk_size:
+                    arr[j - first] = reflect_pad_tail(arr[j - first], frame_length, chunk_size)
+
+        x, batch_skipped = run_model(model, arr, num_stems, min_mean_abs, silence_stem)
+        x = x.to('cpu', torch.float32)
+        skipped += batch_skipped
+
+        weights = get_frame_weights(first, last, num_frames, chunk_size, fade_size)
+        folded = fold_frames(x * weights[:, None, None, :], step)
+        folded_weights = fold_frames(weights, step)
+        del arr, x
+
+        span_end = min(length, start + span)
+        if result is None:
+            result = torch.zeros((num_stems, channels, 0), dtype=torch.float32)
+            counter = torch.zeros(0, dtype=torch.float32)
+        if out_start + result.shape[-1] < span_end:
+            grow = span_end - out_start - result.shape[-1]
+            result = torch.cat([result, torch.zeros((num_stems, channels, grow), dtype=torch.float32)], dim=-1)
+            counter = torch.cat([counter, torch.zeros(grow, dtype=torch.float32)], dim=-1)
+
+        result[..., start - out_start:span_end - out_start] += folded[..., :span_end - start]
+        counter[start - out_start:span_end - out_start] += folded_weights[:span_end - start]
+
+        final_end = length if last == num_frames else last * step
+        n = final_end - out_start
+        out = torch.nan_to_num(result[..., :n] / counter[:n], nan=0.0)
+        if complement:
+            # The input is kept from out_start on, so the finished samples are still there
+            out = fill_complement(torch.cat([out, out.new_empty((1,) + out.shape[1:])]), pending[:, :n])
+        yield out
+
+        result = result[..., n:].clone()
+        counter = counter[n:].clone()
+        out_start = final_end
+
+        drop = min(last * step, length) - in_start
+        pending = pending[:, drop:]
+        in_start += drop
+
+        report_progress(progress_bar, last, num_frames)
+
+        if last == num_frames:
+            break
+        cancelled = is_cancelled(progress_bar)
+        if checkpoint is not None and (cancelled or checkpoint.due()):
+            checkpoint.save({
+                "num_frames": num_frames,
+                "next_frame": last,
+                "in_start": in_start,
+                "out_start": out_start,
+                "skipped": skipped,
+                "result": result,
+                "counter": counter,
+            })
+        if cancelled:
+            raise DemixCancelled()
+
+    report_skipped_chunks(progress_bar, skipped, num_frames)
+
+
+def _reflect_padded_blocks(blocks, border):
+    # Streaming equivalent of nn.functional.pad(mix, (border, border), mode='reflect')
+    started = False
+    tail = None
+    for block in blocks:
+        tail = block if tail is None else torch.cat([tail, block], dim=-1)
+        if not started:
+            if tail.shape[-1] <= border:
+                continue
+            yield torch.flip(tail[:, 1:border + 1], dims=[-1])
+            started = True
+        if tail.shape[-1] > border + 1:
+            yield tail[:, :-(border + 1)]
+            tail = tail[:, -(border + 1):]
+    yield tail
+    yield torch.flip(tail[:, -(border + 1):-1], dims=[-1])
+
+
+def _trim_blocks(blocks, skip, length):
+    # Drop the first `skip` samples and anything past `length` samples
+    position = -skip
+    for block in blocks:
+        begin = max(0, -position)
+        end = min(block.shape[-1], length - position)
+        position += block.shape[-1]
+        if end > begin:
+            yield block[..., begin:end]
+
+
+def stream_demix_track(config, model, blocks, length, device, progress_bar=None, stems=None, checkpoint=None):
+    C = config.audio.chunk_size
+    N = config.inference.num_overlap
+    fade_size = C // 10
+    step = int(C // N)
+    border = C - step
+    batch_size = config.inference.batch_size
+
+    instruments, indices, complement = select_stems(prefer_target_instrument(config), stems)
+
+    # Do pad from the beginning and end to account floating window results better
+    padded = length > 2 * border and (border > 0)
+    if padded:
+        blocks = _reflect_padded_blocks(blocks, border)
+
+    # A resumed run yields the padded signal from where the saved one stopped
+    state = checkpoint.load() if checkpoint is not None else None
+    resumed_at = state["out_start"] if state is not None else 0
+
+    with torch.cuda.amp.autocast(enabled=config.training.use_amp):
+        with torch.inference_mode():
+            estimated = stream_overlap_add_demix(
+                get_stems_model(model, indices),
+                blocks,
+                length + 2 * border if padded else length,
+                C,
+                step,
+                batch_size,
+                len(instruments),
+                device,
+                fade_size=fade_size,
+                pad_mode='reflect',
+                progress_bar=progress_bar,
+                min_mean_abs=config.audio.get('min_mean_abs', 0.0),
+                silence_stem=get_silence_stem(instruments),
+                complement=complement,
+                checkpoint=checkpoint
+            )
+            if padded:
+                estimated = _trim_blocks(estimated, border - resumed_at, length)
+
+            if complement:
+                instruments = instruments + [COMPLEMENT_STEM]
+
+            for block in estimated:
+                yield {k: v for k, v in zip(instruments, block.numpy())}
+
+
+def stream_demix_track_demucs(config, model, blocks, length, device, progress_bar=None, stems=None,
+                              checkpoint=None):
+    instruments, indices, complement = select_stems(config.training.instruments, stems)
+    S = len(instruments)
+    C = config.training.samplerate * config.training.segment
+    N = config.inference.num_overlap
+    batch_size = config.inference.batch_size
+    step = C // N
+
+    with torch.cuda.amp.autocast(enabled=config.training.use_amp):
+        with torch.inference_mode():
+            estimated = stream_overlap_add_demix(
+                get_stems_model(model, indices),
+                blocks,
+                length,
+                C,
+                step,
+                batch_size,
+                S,
+                device,
+                pad_mode='constant',
+                progress_bar=progress_bar,
+                min_mean_abs=config.audio.get('min_mean_abs', 0.0),
+                silence_stem=get_silence_stem(instruments),
+                complement=complement,
+                checkpoint=checkpoint
+            )
+
+            if complement:
+                instruments = instruments + [COMPLEMENT_STEM]
+            for block in estimated:
+                yield {k: v for k, v in zip(instruments, block.numpy())}
+
+
+def open_stem_file(path, sample_rate, channels, subtype, frames=0):
+    # frames > 0: a file of a resumed job, cut back to what was written when its checkpoint was saved
+    if not frames:
+        return sf.SoundFile(path, 'w', samplerate=sample_rate, channels=channels, subtype=subtype)
+    f = sf.SoundFile(path, 'r+')
+    f.truncate(frames)
+    f.seek(0, sf.SEEK_END)
+    return f
+
+
+def stem_files_intact(output_dir, output):
+    # Whether the files a checkpoint refers to still hold at least the frames written before it was saved
+    try:
+        return all(sf.info(os.path.join(output_dir, f"{stem}.wav")).frames >= output["written"]
+                   for stem in output["stems"])
+    except (OSError, RuntimeError, KeyError, TypeError):
+        return False
+
+
+def write_stem_blocks(stem_blocks, output_dir, sample_rate, subtype='FLOAT', checkpoint=None):
+    # With a checkpoint, the files of a resumed job are continued and the frames written so far are recorded
+    # for its next save
+    os.makedirs(output_dir, exist_ok=True)
+
+    state = checkpoint.load() if checkpoint is not None else None
+    # No output recorded: the saved run had not got past the padding yet, the files start over
+    written = state["output"]["written"] if state is not None and state["output"] else 0
+
+    files = {}
+    paths = {}
+    try:
+        for stems in stem_blocks:
+            for stem, data in stems.items():
+                if stem not in files:
+                    paths[stem] = os.path.join(output_dir, f"{stem}.wav")
+                    files[stem] = open_stem_file(paths[stem], sample_rate, data.shape[0], subtype, written)
+                files[stem].write(data.T)
+            if stems and checkpoint is not None:
+                written += next(iter(stems.values())).shape[-1]
+                checkpoint.output = {"written": written, "stems": list(paths)}
+    finally:
+        for f in files.values():
+            f.close()
+
+    return paths
@@ -0,0 +1,207 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+import requests
+
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+from concurrent.futures import ThreadPoolExecutor
+
+# Where weights are fetched from before their original URLs: a local directory, a file:// URL or an http(s)
+# base URL with files named as in the weights directory (a copy of another machine's weights directory works)
+MIRROR = os.environ.get("AUDSEP_WEIGHTS_MIRROR", "")
+MANIFEST_NAME = "manifest.json"
+PARTIAL_SUFFIX = ".part"
+CHUNK_SIZE = 1 << 20
+MAX_ATTEMPTS = 3
+PREFETCH_WORKERS = 4
+TIMEOUT = (10, 60)
+PROGRESS_STEP = 10
+# Weights without a pinned SHA-256 are refused unless this is set: the digest of the first download would become
+# the reference, so a corrupt or tampered file would be trusted from then on
+ALLOW_UNPINNED = os.environ.get("AUDSEP_ALLOW_UNPINNED_WEIGHTS", "") == "1"
+# Shortest accepted pin: a digest prefix, as published by demucs in its file names
+MIN_PIN_LENGTH = 8
+
+_manifest_lock = threading.Lock()
+
+
+def is_remote(source):
+    return source.startswith(("http://", "https://"))
+
+
+def get_local_path(source):
+    return url2pathname(urlparse(source).path) if source.startswith("file://") else source
+
+
+def get_sources(url, filename):
+    # url may be None for weights that only come from the mirror
+    if not MIRROR:
+        sources = [url]
+    elif is_remote(MIRROR):
+        sources = [MIRROR.rstrip("/") + "/" + filename, url]
+    else:
+        sources = [os.path.join(get_local_path(MIRROR), filename), url]
+    return [source for source in sources if source]
+
+
+def get_manifest_path(weights_dir):
+    return os.path.join(weights_dir, MANIFEST_NAME)
+
+
+def read_manifest(weights_dir):
+    try:
+        with open(get_manifest_path(weights_dir), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_checksum(weights_dir, filename, entry):
+    with _manifest_lock:
+        manifest = read_manifest(weights_dir)
+        manifest[filename] = entry
+
+        path = get_manifest_path(weights_dir)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, path)
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def matches_pin(digest, pin):
+    return len(pin) >= MIN_PIN_LENGTH and digest.startswith(pin.lower())
+
+
+def copy_local(path, partial_path):
+    with open(path, 'rb') as source, open(partial_path, 'wb') as target:
+        shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+
+def download_http(url, partial_path, name):
+    # Continues a previous partial file with a range request, when the server supports it
+    offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+    with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        if offset and response.status_code == 416:
+            total = response.headers.get('content-range', '').rpartition('/')[2]
+            if total.isdigit() and int(total) == offset:
+                return
+            os.remove(partial_path)
+            raise IOError(f"partial file of {name} does not match the server, starting over")
+
+        response.raise_for_status()
+        if offset and response.status_code != 206:
+            print(f"Server does not support resuming, downloading {name} from the start")
+            offset = 0
+        elif offset:
+            print(f"Resuming {name} from {offset / 1024 ** 2:.1f} MB")
+
+        total = offset + int(response.headers.get('content-length', 0))
+        done = offset
+        reported = done * 100 // total if total else 0
+
+        with open(partial_path, 'ab' if offset else 'wb') as file:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                file.write(chunk)
+                done += len(chunk)
+                if total and done * 100 // total >= reported + PROGRESS_STEP:
+                    reported = done * 100 // total
+                    print(f"{name}: {reported}% ({done / 1024 ** 2:.0f} / {total / 1024 ** 2:.0f} MB)")
+
+    if total and done < total:
+        raise IOError(f"connection closed at {done} of {total} bytes")
+
+
+def fetch(source, partial_path, name):
+    if not is_remote(source):
+        copy_local(get_local_path(source), partial_path)
+        return
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            download_http(source, partial_path, name)
+            return
+        except (requests.RequestException, IOError) as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            print(f"Download of {name} interrupted ({e}), retrying ({attempt}/{MAX_ATTEMPTS - 1})")
+
+
+def download(url, weights_path, sha256=None):
+    # Streams the file into weights_path + '.part' and moves it into place only once its SHA-256 matches,
+    # so an interrupted download is resumed next time instead of being loaded as a corrupt checkpoint.
+    # sha256 is the pinned digest (or a published prefix of it). Without one the download is refused, unless
+    # AUDSEP_ALLOW_UNPINNED_WEIGHTS=1: then the digest of the first download is recorded and trusted after
+    weights_dir, name = os.path.split(weights_path)
+    partial_path = weights_path + PARTIAL_SUFFIX
+    if not sha256 and not ALLOW_UNPINNED:
+        raise RuntimeError(f"No pinned SHA-256 for {name}: add weights.sha256 to its models.yaml entry, "
+                           f"or set AUDSEP_ALLOW_UNPINNED_WEIGHTS=1 to trust the first download")
+
+    os.makedirs(weights_dir, exist_ok=True)
+    expected = sha256 or read_manifest(weights_dir).get(name, {}).get('sha256')
+
+    print(f"Downloading weights to: {weights_path}")
+
+    errors = []
+    for source in get_sources(url, name):
+        if not is_remote(source) and not os.path.exists(get_local_path(source)):
+            errors.append(f"{source}: not found")
+            continue
+
+        try:
+            fetch(source, partial_path, name)
+        except Exception as e:
+            print(f"Could not download {name} from {source}: {e}")
+            errors.append(f"{source}: {e}")
+            continue
+
+        digest = sha256_file(partial_path)
+        if expected and not matches_pin(digest, expected):
+            os.remove(partial_path)
+            print(f"Checksum mismatch for {name} from {source}: expected {expected}, got {digest}")
+            errors.append(f"{source}: checksum mismatch")
+            continue
+
+        os.replace(partial_path, weights_path)
+        if not expected:
+            record_checksum(weights_dir, name, {
+                'sha256': digest,
+                'size': os.path.getsize(weights_path),
+                'url': url,
+            })
+            print(f"Recorded SHA-256 of {name}: {digest}")
+
+        print(f"Downloaded weights to: {weights_path}")
+        return weights_path
+
+    raise RuntimeError(f"Could not download {name}: " + ("; ".join(errors) or "no URL and no mirror"))
+
+
+def prefetch(downloads, max_workers=PREFETCH_WORKERS):
+    # downloads: (url, weights_path, sha256) tuples; files already in place are skipped, the rest are fetched
+    # in parallel. Raises after all of them finished if any failed
+    missing = [entry for entry in downloads if not os.path.exists(entry[1])]
+    if not missing:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+        futures = [executor.submit(download, *entry) for entry in missing]
+
+    failed = [str(future.exception()) for future in futures if future.exception() is not None]
+    if failed:
+        raise RuntimeError("\n".join(failed))
+    return [future.result() for future in futures]
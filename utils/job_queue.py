@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import uuid
+import shutil
+
+from pathlib import Path
+
+from utils.user_data import get_user_data_dir
+
+QUEUE_FILE_NAME = "queue.json"
+
+# How many separations run at once on each device, e.g. "cpu=2,cuda=1"; unlisted devices get DEFAULT_PARALLELISM
+PARALLELISM = os.environ.get("AUDSEP_PARALLELISM", "")
+DEFAULT_PARALLELISM = 1
+
+# Jobs on this device run on the best available one, which is only known once the workers have looked
+AUTO_DEVICE = "auto"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# Fields written to the queue file; progress and timing only matter while the app runs
+SAVED_FIELDS = ("job_id", "audio_file", "model", "device", "output_dir", "state", "tracks", "error", "added")
+
+
+def get_output_root():
+    return get_user_data_dir() / "output"
+
+
+def parse_parallelism(value):
+    parallelism = {}
+    for item in value.split(","):
+        device, _, count = item.partition("=")
+        if device.strip() and count.strip().isdigit():
+            parallelism[device.strip()] = max(1, int(count))
+    return parallelism
+
+
+class SeparationJob:
+    def __init__(self, job_id, audio_file, model, device, output_dir, state=QUEUED, tracks=None, error=None,
+                 added=None):
+        self.job_id = job_id
+        self.audio_file = audio_file
+        self.model = model
+        self.device = device
+        self.output_dir = output_dir
+        self.state = state
+        self.tracks = tracks
+        self.error = error
+        self.added = added if added is not None else time.time()
+
+        self.progress = 0
+        self.status = ""
+        self.started = None
+        # Latest demix progress from the worker: chunks done / total, chunks per second, seconds left and when
+        self.chunks = None
+        self.speed = None
+        self.reported_eta = None
+        self.reported_at = None
+
+    @property
+    def name(self):
+        return Path(self.audio_file).name
+
+    def update_progress(self, progress, now=None):
+        # progress: the worker's progress message, {"percent": ...} plus chunk counts and ETA while demixing
+        self.progress = progress.get("percent", self.progress)
+        if "chunks_total" in progress:
+            self.chunks = (progress["chunks_done"], progress["chunks_total"])
+            self.speed = progress.get("chunks_per_second")
+            self.reported_eta = progress.get("eta")
+            self.reported_at = now if now is not None else time.time()
+
+    def reset_progress(self):
+        self.progress = 0
+        self.chunks = self.speed = self.reported_eta = self.reported_at = None
+
+    def eta(self, now=None):
+        # Seconds left: the worker's estimate counted down since it arrived, otherwise extrapolated from the
+        # progress so far; None until there is something to extrapolate
+        if self.state != RUNNING or self.started is None:
+            return None
+        now = now if now is not None else time.time()
+        if self.reported_eta is not None:
+            return max(0.0, self.reported_eta - (now - self.reported_at))
+        if self.progress <= 0:
+            return None
+        return (now - self.started) * (100 - self.progress) / self.progress
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in SAVED_FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{field: data.get(field) for field in SAVED_FIELDS})
+
+
+class JobQueue:
+    # Separation jobs of the app in order of addition. Knows which queued jobs may start (a free slot on their
+    # device) and keeps itself in a file, so the queue and finished results survive a restart
+    def __init__(self, path=None, parallelism=None, output_root=None):
+        self.path = Path(path) if path is not None else get_user_data_dir() / QUEUE_FILE_NAME
+        self.parallelism = parallelism if parallelism is not None else parse_parallelism(PARALLELISM)
+        self.output_root = Path(output_root) if output_root is not None else get_output_root()
+        # The device "auto" stands for (set_auto_device); until it is known, "auto" jobs wait
+        self.auto_device = None
+        self.jobs = []
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.jobs = [SeparationJob.from_dict(item) for item in data.get("jobs", [])]
+        except (OSError, ValueError, TypeError) as e:
+            if self.path.exists():
+                print(f"Не удалось прочитать очередь {self.path}: {e}")
+            self.jobs = []
+
+        # Jobs interrupted by the previous exit start over
+        for job in self.jobs:
+            if job.state == RUNNING:
+                job.state = QUEUED
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"jobs": [job.to_dict() for job in self.jobs]}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    def get(self, job_id):
+        for job in self.jobs:
+            if job.job_id == job_id:
+                return job
+        return None
+
+    def add(self, audio_file, model_info):
+        job_id = max((job.job_id for job in self.jobs), default=0) + 1
+        output_dir = self.output_root / f"{Path(audio_file).stem}_{model_info['model']}_{job_id}"
+        job = SeparationJob(job_id, str(audio_file), model_info["model"], str(model_info["device"]), str(output_dir))
+        self.jobs.append(job)
+        self.save()
+        return job
+
+    def set_auto_device(self, device):
+        self.auto_device = device
+
+    def get_device(self, job):
+        # The concrete device the job runs on; None while an "auto" job waits for detection
+        return self.auto_device if job.device == AUTO_DEVICE else job.device
+
+    def get_parallelism(self, device):
+        return self.parallelism.get(device, DEFAULT_PARALLELISM)
+
+    def count(self, *states):
+        return sum(job.state in states for job in self.jobs)
+
+    def next_jobs(self):
+        # Queued jobs that fit into the free slots of their devices, oldest first
+        # "auto" jobs count towards the device they resolve to
+        running = {}
+        for job in self.jobs:
+            if job.state == RUNNING:
+                device = self.get_device(job)
+                running[device] = running.get(device, 0) + 1
+
+        ready = []
+        for job in self.jobs:
+            device = self.get_device(job)
+            if job.state != QUEUED or device is None:
+                continue
+            if running.get(device, 0) < self.get_parallelism(device):
+                running[device] = running.get(device, 0) + 1
+                ready.append(job)
+        return ready
+
+    def start(self, job):
+        job.state = RUNNING
+        job.started = time.time()
+        job.reset_progress()
+        job.error = None
+        self.save()
+
+    def finish(self, job, state, tracks=None, error=None):
+        job.state = state
+        job.tracks = tracks
+        job.error = error
+        job.progress = 100 if state == DONE else job.progress
+        self.save()
+
+    def retry(self, job):
+        job.state = QUEUED
+        job.reset_progress()
+        job.status = ""
+        self.save()
+
+    def remove(self, job):
+        # The job's stems go with it: its output directory (hundreds of MB of WAV) belongs to nobody else
+        if job.state == RUNNING:
+            return
+        self.jobs.remove(job)
+        self.save()
+        self.remove_output(job)
+
+    def remove_output(self, job):
+        # Only directories the queue created itself, whatever a hand-edited queue file says
+        output_dir = Path(job.output_dir)
+        if output_dir.parent == self.output_root and output_dir.exists():
+            shutil.rmtree(output_dir, ignore_errors=True)
@@ -0,0 +1,89 @@
+import os
+import copy
+import yaml
+
+from utils.path_utils import get_resource_path
+from utils.user_data import get_user_data_dir
+
+REGISTRY_PATH = "./configs/models.yaml"
+USER_REGISTRY_NAME = "models.yaml"
+REQUIRED_FIELDS = ("name", "loader", "model_id", "config", "config_format", "strategy")
+
+# (path, parser) -> (mtime, data): every config file is parsed once per process, until it changes
+_yaml_cache = {}
+_models = None
+
+
+def resolve_path(path, base_dir=None):
+    if os.path.isabs(path):
+        return path
+    if base_dir is not None:
+        return os.path.normpath(os.path.join(base_dir, path))
+    return get_resource_path(path)
+
+
+def parse_yaml(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=yaml.SafeLoader) or {}
+
+
+def load_yaml(path, parse=parse_yaml):
+    # A deep copy of the cached data: callers are free to modify what they get
+    mtime = os.path.getmtime(path)
+    cached = _yaml_cache.get((path, parse))
+    if cached is None or cached[0] != mtime:
+        cached = _yaml_cache[(path, parse)] = (mtime, parse(path))
+    return copy.deepcopy(cached[1])
+
+
+def read_registry(path, base_dir=None):
+    models = {}
+    for key, entry in (load_yaml(path).get("models") or {}).items():
+        missing = [field for field in REQUIRED_FIELDS if field not in entry]
+        if missing:
+            raise ValueError(f"Модель {key} в {path}: не заданы {', '.join(missing)}")
+
+        entry["model"] = key
+        entry["config"] = resolve_path(entry["config"], base_dir)
+        entry.setdefault("description", "")
+        entry.setdefault("instruments", [])
+        entry.setdefault("quantizable", False)
+        entry.setdefault("device", "cpu")
+        entry.setdefault("profile", {})
+        models[key] = entry
+    return models
+
+
+def get_models():
+    # Registry key -> model entry, bundled models first, then the user's own ones
+    global _models
+    if _models is None:
+        models = read_registry(get_resource_path(REGISTRY_PATH))
+
+        user_path = get_user_data_dir() / USER_REGISTRY_NAME
+        if user_path.exists():
+            try:
+                models.update(read_registry(str(user_path), base_dir=str(user_path.parent)))
+            except Exception as e:
+                print(f"Не удалось прочитать {user_path}: {e}")
+
+        _models = models
+    return _models
+
+
+def get_model_info(key, **overrides):
+    # A job's own copy of the entry, with the given non-None fields (device, stems to separate, quantize) replaced
+    models = get_models()
+    if key not in models:
+        raise KeyError(f"Неизвестная модель: {key}")
+    model_info = copy.deepcopy(models[key])
+    model_info.update((name, value) for name, value in overrides.items() if value is not None)
+    return model_info
+
+
+def get_memory_estimate(model_info):
+    return int(model_info["profile"].get("memory_mb", 0) * 1024 ** 2)
+
+
+def get_cost_estimate(model_info, audio_seconds):
+    return model_info["profile"].get("cost", 1.0) * audio_seconds
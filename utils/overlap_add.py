@@ -0,0 +1,246 @@
+import torch
+import torch.nn as nn
+
+from functools import lru_cache, partial
+
+
+def get_num_frames(length, step):
+    return max(1, (length + step - 1) // step)
+
+
+def frame_signal(mix, chunk_size, step):
+    # (channels, length) -> (num_frames, channels, chunk_size) view over a zero-padded copy of the mix
+    length = mix.shape[-1]
+    num_frames = get_num_frames(length, step)
+    padded_length = (num_frames - 1) * step + chunk_size
+
+    padded = nn.functional.pad(mix, (0, padded_length - length))
+    return padded.unfold(-1, chunk_size, step).transpose(0, 1)
+
+
+def get_fade_window(window_size, fade_size):
+    # windowingArray crossfades at segment boundaries to mitigate clicking artifacts
+    fadein = torch.linspace(0, 1, fade_size)
+    fadeout = torch.linspace(1, 0, fade_size)
+    window = torch.ones(window_size)
+    window[-fade_size:] *= fadeout
+    window[:fade_size] *= fadein
+    return window
+
+
+def get_frame_weights(first, last, num_frames, chunk_size, fade_size=None):
+    if not fade_size:
+        return torch.ones(last - first, chunk_size)
+
+    weights = get_fade_window(chunk_size, fade_size).repeat(last - first, 1)
+    if first == 0:  # First audio chunk, no fadein
+        weights[0, :fade_size] = 1
+    if last == num_frames:  # Last audio chunk, no fadeout
+        weights[-1, -fade_size:] = 1
+    return weights
+
+
+def fold_frames(frames, step):
+    # Weighted overlap-add of (num_frames, ..., chunk_size) into (..., (num_frames - 1) * step + chunk_size)
+    num_frames, chunk_size = frames.shape[0], frames.shape[-1]
+    inner_shape = frames.shape[1:-1]
+    span = (num_frames - 1) * step + chunk_size
+
+    cols = frames.reshape(num_frames, -1, chunk_size).permute(1, 2, 0).reshape(1, -1, num_frames)
+    out = nn.functional.fold(cols, output_size=(1, span), kernel_size=(1, chunk_size), stride=(1, step))
+    return out.reshape(*inner_shape, span)
+
+
+@lru_cache(maxsize=16)
+def get_window_counter(length, chunk_size, step, fade_size=None):
+    # Window normalization only depends on the framing, so it is computed once per (length, chunk_size, step)
+    num_frames = get_num_frames(length, step)
+    window = get_fade_window(chunk_size, fade_size) if fade_size else torch.ones(chunk_size)
+
+    counter = nn.functional.conv_transpose1d(torch.ones(1, 1, num_frames), window.view(1, 1, -1), stride=step)[0, 0]
+    if fade_size:
+        end = (num_frames - 1) * step + chunk_size
+        counter[:fade_size] += 1 - window[:fade_size]
+        counter[end - fade_size:end] += 1 - window[-fade_size:]
+    return counter[:length]
+
+
+def reflect_pad_tail(part, length, chunk_size):
+    if length > chunk_size // 2 + 1:
+        return nn.functional.pad(part[..., :length], (0, chunk_size - length), mode='reflect')
+    return part
+
+
+def get_silence_stem(instruments):
+    # Stem that receives the mix of skipped (near silent) chunks, so the stems still sum up to the input.
+    # Without a catch-all stem the skipped chunks are left as zeros
+    instruments = list(instruments)
+    return instruments.index('other') if 'other' in instruments else None
+
+
+# Requested together with some model stems, 'other' is the mix minus those stems and costs no model pass
+COMPLEMENT_STEM = 'other'
+
+
+def select_stems(instruments, stems=None):
+    # Splits the requested stems into the model stems to run and the complement.
+    # Returns (model stem names, their indices in instruments or None for all of them, complement)
+    instruments = list(instruments)
+    if not stems:
+        return instruments, None, False
+
+    unknown = [stem for stem in stems if stem not in instruments and stem != COMPLEMENT_STEM]
+    if unknown:
+        raise ValueError(f"Модель не выделяет стемы: {', '.join(unknown)}")
+
+    names = [stem for stem in instruments if stem in stems and stem != COMPLEMENT_STEM]
+    complement = COMPLEMENT_STEM in stems
+    if complement and COMPLEMENT_STEM in instruments and (not names or len(names) + 1 == len(instruments)):
+        # The model's own catch-all stem: requested alone or together with all the others
+        names = [stem for stem in instruments if stem in stems]
+        complement = False
+    elif complement and not names:
+        # The complement of nothing would be the mix itself
+        names = [stem for stem in instruments if stem != COMPLEMENT_STEM]
+
+    indices = [instruments.index(stem) for stem in names]
+    return names, (indices if names != instruments else None), complement
+
+
+def get_stems_model(model, indices):
+    return model if indices is None else partial(model, stems=indices)
+
+
+def fill_complement(result, mix):
+    # result: (num_stems + 1, channels, length), the last stem is set to the mix minus the others
+    torch.sub(mix.to(result.device, torch.float32), result[:-1].sum(dim=0), out=result[-1])
+    return result
+
+
+def run_model(model, arr, num_stems, min_mean_abs=0.0, silence_stem=None):
+    # Runs the model on the chunks whose mean absolute level reaches min_mean_abs; returns
+    # ((batch, num_stems, channels, chunk_size) estimates, number of skipped chunks)
+    batch, channels, chunk_size = arr.shape
+    if min_mean_abs <= 0:
+        return model(arr).reshape(batch, num_stems, channels, chunk_size), 0
+
+    active = arr.abs().mean(dim=(1, 2)) >= min_mean_abs
+    num_active = int(active.sum())
+    if num_active == batch:
+        return model(arr).reshape(batch, num_stems, channels, chunk_size), 0
+
+    x = torch.zeros((batch, num_stems, channels, chunk_size), dtype=torch.float32, device=arr.device)
+    if silence_stem is not None:
+        x[~active, silence_stem] = arr[~active].float()
+    if num_active:
+        x[active] = model(arr[active]).reshape(num_active, num_stems, channels, chunk_size).float()
+    return x, batch - num_active
+
+
+def report_progress(progress_bar, done, total):
+    # Chunk counts let the reporter compute throughput and ETA; plain progress bars only get the percentage
+    if progress_bar is None:
+        return
+    if hasattr(progress_bar, 'update_chunks'):
+        progress_bar.update_chunks(done, total)
+    else:
+        progress_bar.update_progress(min(100, int(done * 100 / total)) if total else 100)
+
+
+class DemixCancelled(Exception):
+    # Raised by the demixers between batches once the job is cancelled (after saving its checkpoint)
+    pass
+
+
+def is_cancelled(progress_bar):
+    return progress_bar is not None and hasattr(progress_bar, 'is_cancelled') and progress_bar.is_cancelled()
+
+
+def report_stats(progress_bar, stats):
+    # The demixers print nothing: statistics go to the reporter, and the caller decides what to show
+    if progress_bar is not None and hasattr(progress_bar, 'update_stats'):
+        progress_bar.update_stats(stats)
+
+
+def report_skipped_chunks(progress_bar, skipped, total):
+    if skipped:
+        report_stats(progress_bar, {"skipped_chunks": skipped, "total_chunks": total})
+
+
+def report_resumed(progress_bar, first_frame, total):
+    report_stats(progress_bar, {"resumed_from_chunk": first_frame, "total_chunks": total})
+
+
+def overlap_add_demix(model, mix, chunk_size, step, batch_size, num_stems, device,
+                      fade_size=None, pad_mode='constant', result_device=None, progress_bar=None,
+                      min_mean_abs=0.0, silence_stem=None, complement=False, checkpoint=None):
+    # With complement, one more stem is returned: the mix minus the num_stems estimated ones.
+    # With a checkpoint, the estimates so far are saved between batches and a saved run is continued
+    length, channels = mix.shape[-1], mix.shape[0]
+    result_device = result_device if result_device is not None else mix.device
+
+    frames = frame_signal(mix, chunk_size, step)
+    num_frames = frames.shape[0]
+
+    result = torch.zeros((num_stems + int(complement), channels, length), dtype=torch.float32,
+                         device=result_device)
+    estimates = result[:num_stems]
+    skipped = 0
+    first_frame = 0
+
+    state = checkpoint.load() if checkpoint is not None else None
+    if state is not None and state["num_frames"] == num_frames and \
+            state["estimates"].shape[:2] == estimates.shape[:2]:
+        saved = state["estimates"]
+        estimates[..., :saved.shape[-1]] = saved.to(result_device)
+        first_frame = state["next_frame"]
+        skipped = state["skipped"]
+        report_resumed(progress_bar, first_frame, num_frames)
+
+    report_progress(progress_bar, first_frame, num_frames)
+    for first in range(first_frame, num_frames, batch_size):
+        last = min(first + batch_size, num_frames)
+
+        arr = frames[first:last].to(device).clone()
+        if pad_mode == 'reflect':
+            for j in range(first, last):
+                frame_length = length - j * step
+                if frame_length < chunk_size:
+                    arr[j - first] = reflect_pad_tail(arr[j - first], frame_length, chunk_size)
+
+        x, batch_skipped = run_model(model, arr, num_stems, min_mean_abs, silence_stem)
+        x = x.to(result_device, torch.float32)
+        skipped += batch_skipped
+
+        start = first * step
+        weights = get_frame_weights(first, last, num_frames, chunk_size, fade_size).to(result_device)
+        folded = fold_frames(x * weights[:, None, None, :], step)
+        end = min(length, start + folded.shape[-1])
+        estimates[..., start:end] += folded[..., :end - start]
+
+        del arr, x, folded
+
+        report_progress(progress_bar, last, num_frames)
+
+        if last == num_frames:
+            break
+        cancelled = is_cancelled(progress_bar)
+        if checkpoint is not None and (cancelled or checkpoint.due()):
+            # Only the part the finished batches reached is saved (copied, a view would save all of result)
+            checkpoint.save({
+                "num_frames": num_frames,
+                "next_frame": last,
+                "skipped": skipped,
+                "estimates": estimates[..., :end].to('cpu', copy=True),
+            })
+        if cancelled:
+            raise DemixCancelled()
+
+    report_skipped_chunks(progress_bar, skipped, num_frames)
+
+    counter = get_window_counter(length, chunk_size, step, fade_size).to(result_device)
+    estimates /= counter
+    torch.nan_to_num(estimates, nan=0.0, out=estimates)
+    if complement:
+        fill_complement(result, mix)
+    return result
@@ -0,0 +1,161 @@
+import os
+import math
+import torch
+import torch.nn as nn
+import torch.ao.nn.quantized.dynamic as nnqd
+
+from torch.ao.quantization import quantize_dynamic
+
+from utils.weights_cache import init_empty_parameters, load_model
+
+QUANTIZED_SUFFIX = '.int8.pt'
+QUANTIZED_FORMAT_VERSION = 1
+# The band split stays fp32: its fused per-bucket matmuls are faster than one int8 linear per band
+SKIPPED_PREFIXES = ('band_split.',)
+
+TEST_SIGNAL_SECONDS = 4
+TEST_SIGNAL_SAMPLE_RATE = 44100
+
+
+def is_quantization_enabled(config):
+    return bool(config.inference.get('quantize', False))
+
+
+def is_quantization_applied(config, model_info):
+    # Whether the loaded model really is int8: inference.quantize (from the config or the job's flag) on a
+    # quantizable model, on CPU (load_quantized_model loads fp32 elsewhere). Model, result and tuning keys use
+    # this, so fp32 and int8 models and their results are never mixed up
+    return bool(model_info["quantizable"]) and is_quantization_enabled(config) and \
+        torch.device(model_info["device"]).type == 'cpu'
+
+
+def get_quantized_path(weights_path):
+    return weights_path + QUANTIZED_SUFFIX
+
+
+def get_quantized_layers(model):
+    return sorted(name for name, module in model.named_modules()
+                  if type(module) is nn.Linear and not name.startswith(SKIPPED_PREFIXES))
+
+
+def quantize_model(model):
+    # Dynamic quantization: int8 weights, activations quantized per call, so no calibration data is needed
+    return quantize_dynamic(model.eval(), set(get_quantized_layers(model)), dtype=torch.qint8)
+
+
+def replace_quantized_layers(model):
+    # Empty int8 linears in place of the fp32 ones, to load a saved quantized state into
+    for name in get_quantized_layers(model):
+        parent_name, _, child = name.rpartition('.')
+        linear = model.get_submodule(name)
+        quantized = nnqd.Linear(linear.in_features, linear.out_features, bias_=linear.bias is not None,
+                                dtype=torch.qint8)
+        setattr(model.get_submodule(parent_name), child, quantized)
+    return model
+
+
+def make_test_signal(channels, seconds=TEST_SIGNAL_SECONDS, sample_rate=TEST_SIGNAL_SAMPLE_RATE):
+    # Deterministic stand-in for music: a harmonic melody, a bass line and decaying noise hits
+    generator = torch.Generator().manual_seed(0)
+    t = torch.arange(int(seconds * sample_rate)) / sample_rate
+    beat = (t * 4).floor()
+
+    melody = torch.zeros_like(t)
+    frequency = 220 * 2 ** (((beat * 5) % 12) / 12)
+    for harmonic in range(1, 6):
+        melody += torch.sin(2 * math.pi * harmonic * frequency * t) / harmonic
+    bass = torch.sin(2 * math.pi * 55 * 2 ** (((beat // 4) * 7 % 12) / 12) * t)
+    hits = torch.randn(len(t), generator=generator) * torch.exp(-30 * (t * 2 % 1))
+
+    signal = []
+    for channel in range(channels):
+        pan = 0.5 + 0.3 * (channel - (channels - 1) / 2)
+        signal.append(0.15 * pan * melody + 0.2 * bass + 0.1 * (1 - pan) * hits)
+    return torch.stack(signal)
+
+
+def measure_sdr_drift(reference_model, quantized_model, channels):
+    # SDR of the quantized model's stems against the fp32 ones, in dB per stem
+    x = make_test_signal(channels)[None]
+    with torch.inference_mode():
+        reference = reference_model(x).reshape(-1, channels, x.shape[-1]).double()
+        estimate = quantized_model(x).reshape(-1, channels, x.shape[-1]).double()
+
+    signal = reference.square().sum(dim=(1, 2))
+    noise = (reference - estimate).square().sum(dim=(1, 2))
+    sdr = 10 * torch.log10(signal.clamp(min=1e-12) / noise.clamp(min=1e-12))
+    return [round(float(value), 2) for value in sdr]
+
+
+def format_sdr_drift(drift):
+    return ", ".join(f"{value:.1f}" for value in drift) + " dB"
+
+
+def load_quantized_checkpoint(weights_path, fingerprint):
+    quantized_path = get_quantized_path(weights_path)
+    if not os.path.exists(quantized_path) or os.path.getmtime(quantized_path) < os.path.getmtime(weights_path):
+        return None
+
+    try:
+        payload = torch.load(quantized_path, map_location='cpu', weights_only=True)
+    except Exception as e:
+        print(f"Could not read quantized weights {quantized_path}: {e}")
+        return None
+
+    if payload.get('version') != QUANTIZED_FORMAT_VERSION or payload.get('fingerprint') != fingerprint:
+        return None
+    return payload
+
+
+def save_quantized_checkpoint(model, weights_path, fingerprint, sdr_drift):
+    quantized_path = get_quantized_path(weights_path)
+    payload = {
+        'version': QUANTIZED_FORMAT_VERSION,
+        'fingerprint': fingerprint,
+        'sdr_drift': sdr_drift,
+        'state_dict': model.state_dict(),
+    }
+
+    temp_path = quantized_path + '.tmp'
+    torch.save(payload, temp_path)
+    os.replace(temp_path, quantized_path)
+    print(f"Saved quantized weights: {quantized_path}")
+
+
+def load_quantized_model(model_factory, weights_path, device, fingerprint):
+    # Same contract as load_model, with the linears quantized to int8. The quantized state is cached next to
+    # the weights; it is created on first use, when the drift against fp32 is measured on a synthetic signal
+    if torch.device(device).type != 'cpu':
+        print(f"INT8 quantization runs on CPU only, loading fp32 weights for {device}")
+        return load_model(model_factory, weights_path, device, fingerprint)
+
+    quantized_fingerprint = f"{fingerprint}:int8:{SKIPPED_PREFIXES}"
+    payload = load_quantized_checkpoint(weights_path, quantized_fingerprint)
+
+    if payload is not None:
+        try:
+            with init_empty_parameters():
+                model = model_factory()
+            replace_quantized_layers(model)
+            model.load_state_dict(payload['state_dict'], assign=True)
+
+            print(f"Loaded quantized weights from: {get_quantized_path(weights_path)} "
+                  f"(SDR vs fp32: {format_sdr_drift(payload['sdr_drift'])})")
+            return model.eval()
+        except Exception as e:
+            print(f"Quantized load failed, quantizing the original weights again: {e}")
+
+    model = load_model(model_factory, weights_path, 'cpu', fingerprint)
+    quantized = quantize_model(model)
+
+    print("Measuring quantization drift against fp32...")
+    sdr_drift = measure_sdr_drift(model, quantized, getattr(model, 'audio_channels', 2))
+    print(f"SDR vs fp32: {format_sdr_drift(sdr_drift)}")
+    del model
+
+    try:
+        save_quantized_checkpoint(quantized, weights_path, quantized_fingerprint, sdr_drift)
+    except Exception as e:
+        print(f"Could not save quantized weights: {e}")
+
+    return quantized
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+
+import numpy as np
+import soundfile as sf
+import torch
+
+from pathlib import Path
+
+from utils.user_data import get_user_data_dir
+
+DEFAULT_CACHE_SIZE = int(os.environ.get("AUDSEP_CACHE_MB", 4096)) * 1024 ** 2
+
+MANIFEST_NAME = "manifest.json"
+
+
+def get_inference_params(config, strategy, quantized=False):
+    if strategy == "demucs":
+        chunk_size = config.training.samplerate * config.training.segment
+    else:
+        chunk_size = config.audio.chunk_size
+    params = {"chunk_size": int(chunk_size), "num_overlap": int(config.inference.num_overlap)}
+    if quantized:
+        params["quantize"] = "int8"
+    return params
+
+
+def hash_audio(mix, sample_rate):
+    digest = hashlib.sha256()
+    data = np.ascontiguousarray(torch.as_tensor(mix).float().cpu().numpy())
+    digest.update(f"{data.shape}:{sample_rate}:".encode())
+    digest.update(memoryview(data).cast('B'))
+    return digest.hexdigest()
+
+
+def make_cache_key(audio_hash, model_name, model_id, config_path, inference_params):
+    digest = hashlib.sha256()
+    digest.update(audio_hash.encode())
+    digest.update(f"{model_name}:{model_id}:".encode())
+    with open(config_path, 'rb') as f:
+        digest.update(f.read())
+    digest.update(json.dumps(inference_params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    # Separated stems on disk, addressed by the hash of the decoded input and everything that affects the output.
+    # Stems are stored as 24-bit FLAC normalized by a per-stem scale; entries are evicted least recently used first
+    def __init__(self, cache_dir=None, max_size=DEFAULT_CACHE_SIZE):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else get_user_data_dir() / "cache"
+        self.max_size = max_size
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        entry_dir = self.cache_dir / key
+        manifest_path = entry_dir / MANIFEST_NAME
+        try:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+
+            tracks = {}
+            for stem in manifest["stems"]:
+                data, _ = sf.read(str(entry_dir / f"{stem}.flac"), dtype='float32', always_2d=True)
+                data = torch.from_numpy(data.T.copy())
+                data *= manifest["scales"][stem]
+                tracks[stem] = {'data': data, 'sr': manifest["sr"]}
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            if entry_dir.exists():
+                print(f"Повреждённая запись кэша {key}: {e}")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        now = time.time()
+        os.utime(manifest_path, (now, now))
+        return tracks
+
+    def put(self, key, tracks):
+        if not self.enabled:
+            return
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed in one step, so other workers never see a half-written entry
+        temp_dir = self.cache_dir / f".{key}.{uuid.uuid4().hex}"
+        temp_dir.mkdir()
+        try:
+            manifest = {"stems": [], "scales": {}, "sr": None}
+            for stem, track in tracks.items():
+                data = torch.as_tensor(track['data']).float().cpu().numpy()
+                scale = float(np.max(np.abs(data))) if data.size else 0.0
+                scale = scale if scale > 0 else 1.0
+                sf.write(str(temp_dir / f"{stem}.flac"), (data / scale).T, track['sr'], subtype='PCM_24')
+
+                manifest["stems"].append(stem)
+                manifest["scales"][stem] = scale
+                manifest["sr"] = track['sr']
+
+            with open(temp_dir / MANIFEST_NAME, 'w') as f:
+                json.dump(manifest, f)
+
+            if (self.cache_dir / key).exists():
+                # Another worker cached the same result meanwhile
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                return
+            os.replace(temp_dir, self.cache_dir / key)
+        except OSError as e:
+            print(f"Не удалось сохранить результат в кэш: {e}")
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry_dir in self.cache_dir.iterdir():
+            manifest_path = entry_dir / MANIFEST_NAME
+            if entry_dir.name.startswith('.') or not manifest_path.exists():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in entry_dir.iterdir())
+                entries.append((manifest_path.stat().st_mtime, size, entry_dir))
+            except OSError:
+                continue
+            total += size
+
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_size:
+                break
+            print(f"Удаляем из кэша {entry_dir.name}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
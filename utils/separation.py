@@ -0,0 +1,441 @@
+import gc
+import os
+import time
+import hashlib
+import torch
+import torchaudio
+
+from collections import OrderedDict
+from pathlib import Path
+
+from ml_collections import ConfigDict
+from omegaconf import OmegaConf
+
+from model_loaders.htdemucs_loader import HTDemucsLoader
+from model_loaders.mel_band_roformer_loader import MelBandRoformerLoader
+from model_loaders.bs_roformer_loader import BSRoformerLoader
+from utils.demix_track import demix_track
+from utils.demix_track_demucs import demix_track_demucs
+from utils.demix_stream import (stream_demix_track, stream_demix_track_demucs, read_audio_blocks,
+                                get_audio_length, write_stem_blocks, stem_files_intact)
+from utils.overlap_add import DemixCancelled
+from utils.checkpoint import DemixCheckpoint, CHECKPOINT_INTERVAL
+from utils.model_registry import load_yaml, parse_yaml, get_memory_estimate
+from utils.result_cache import get_inference_params, hash_audio, make_cache_key
+from utils.quantization import is_quantization_applied
+from utils.autotune import autotune, apply_saved_tuning
+from utils.user_data import get_user_data_dir, get_weights_dir
+from utils.downloader import prefetch
+
+STREAMING_MIN_DURATION = 20 * 60
+
+DEFAULT_MODEL_MEMORY_BUDGET = int(os.environ.get("AUDSEP_MODEL_MEMORY_MB", 4096)) * 1024 ** 2
+
+# Names used by the model registry (configs/models.yaml)
+LOADERS = {
+    "htdemucs": HTDemucsLoader,
+    "mel_band_roformer": MelBandRoformerLoader,
+    "bs_roformer": BSRoformerLoader,
+}
+
+# Demix strategy -> (in-memory, streaming) demix functions
+STRATEGIES = {
+    "demucs": (demix_track_demucs, stream_demix_track_demucs),
+    "roformer": (demix_track, stream_demix_track),
+}
+
+# Config format -> (parse the file into plain data, build the config object from it). OmegaConf parses with its
+# own yaml rules (1e-3 is a float there), so its configs are not read with the plain safe loader
+CONFIG_FORMATS = {
+    "omegaconf": (lambda path: OmegaConf.to_container(OmegaConf.load(path)), OmegaConf.create),
+    "ml_collections": (parse_yaml, ConfigDict),
+}
+
+# Progress is sent to the app at most this often (seconds); the start and the end of a pass always go through
+PROGRESS_INTERVAL = 0.25
+
+_loader_classes = {}
+
+
+class ProgressReporter:
+    def __init__(self, progress_queue, cancel_event, interval=PROGRESS_INTERVAL):
+        self.progress_queue = progress_queue
+        self.cancel_event = cancel_event
+        self.interval = interval
+        self._last_sent = None
+        # (time, chunks done) at the start of the current demix pass, the base for throughput and ETA
+        self._pass_start = None
+
+    def _send_progress(self, progress, force=False):
+        now = time.monotonic()
+        if not force and self._last_sent is not None and now - self._last_sent < self.interval:
+            return False
+        self._last_sent = now
+        try:
+            self.progress_queue.put(("progress", progress))
+        except:
+            pass
+        return True
+
+    def update_progress(self, progress):
+        percent = min(100, max(0, int(progress)))
+        self._send_progress({"percent": percent}, force=percent >= 100)
+
+    def update_chunks(self, done, total):
+        # Called by the demixers after every batch; coalesced to one message per interval
+        now = time.monotonic()
+        if self._pass_start is None or done == 0 or done < self._pass_start[1]:
+            self._pass_start = (now, done)
+            self._last_sent = None
+        finished = done >= total
+        if not finished and self._last_sent is not None and now - self._last_sent < self.interval:
+            return
+
+        start_time, start_done = self._pass_start
+        elapsed = now - start_time
+        speed = (done - start_done) / elapsed if elapsed > 0 and done > start_done else None
+        self._send_progress({
+            "percent": min(100, int(done * 100 / total)) if total else 100,
+            "chunks_done": done,
+            "chunks_total": total,
+            "chunks_per_second": round(speed, 2) if speed else None,
+            "eta": round((total - done) / speed, 1) if speed else None,
+        }, force=True)
+
+    def update_status(self, status):
+        try:
+            self.progress_queue.put(("status", str(status)))
+        except:
+            pass
+
+    def update_stats(self, stats):
+        try:
+            self.progress_queue.put(("stats", dict(stats)))
+        except:
+            pass
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def emit(self, value):
+        self.update_progress(value)
+
+
+def get_model_size(model):
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def default_device():
+    if torch.cuda.is_available():
+        return "cuda"
+    if hasattr(torch, 'mps') and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def empty_device_cache():
+    try:
+        torch.cuda.empty_cache() if torch.cuda.is_available() else None
+        if hasattr(torch, 'mps') and torch.backends.mps.is_available():
+            torch.mps.empty_cache()
+    except:
+        pass
+
+
+class ResidentModelCache:
+    # Keeps loaded models between jobs, evicting the least recently used ones over the memory budget
+    def __init__(self, memory_budget=DEFAULT_MODEL_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()
+
+    def get(self, key, load_fn, expected_size=0):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            print(f"Модель {key} уже загружена")
+            return self._entries[key][:2]
+
+        # Room for the new model is made before loading it, not after both are in memory
+        self._evict(keep=None, reserve=expected_size)
+        config, model = load_fn()
+        self._entries[key] = (config, model, get_model_size(model))
+        self._evict(keep=key)
+        return config, model
+
+    def memory_used(self):
+        return sum(size for _, _, size in self._entries.values())
+
+    def _evict(self, keep, reserve=0):
+        while self._entries and self.memory_used() + reserve > self.memory_budget:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            print(f"Выгружаем модель {key} из памяти")
+            del self._entries[key]
+            gc.collect()
+            empty_device_cache()
+
+    def clear(self):
+        self._entries.clear()
+        gc.collect()
+        empty_device_cache()
+
+
+def get_loader_cls(model_info):
+    # A registry entry with its own weights gets a subclass of its loader pointing at them
+    loader_cls = LOADERS[model_info["loader"]]
+    weights = model_info.get("weights")
+    if not weights:
+        return loader_cls
+
+    key = (loader_cls, weights["filename"], weights.get("url"), weights.get("sha256"))
+    if key not in _loader_classes:
+        _loader_classes[key] = type(loader_cls.__name__, (loader_cls,), {
+            "WEIGHTS_FILENAME": weights["filename"],
+            "WEIGHTS_URL": weights.get("url"),
+            "WEIGHTS_SHA256": weights.get("sha256"),
+        })
+    return _loader_classes[key]
+
+
+def prefetch_weights(model_infos):
+    # Downloads the missing weights of all given models in parallel, before any worker needs them
+    loaders = []
+    for model_info in model_infos:
+        loader_cls = get_loader_cls(model_info)
+        if loader_cls not in loaders:
+            loaders.append(loader_cls)
+
+    return prefetch([(loader_cls.WEIGHTS_URL, os.path.join(get_weights_dir(), loader_cls.WEIGHTS_FILENAME),
+                      loader_cls.WEIGHTS_SHA256) for loader_cls in loaders])
+
+
+def load_config(model_info):
+    # The yaml is parsed once per process; every call gets its own config object, autotune modifies it
+    parse, build = CONFIG_FORMATS[model_info["config_format"]]
+    config = build(load_yaml(model_info["config"], parse))
+    if model_info["quantizable"] and model_info.get("quantize") is not None:
+        config.inference.quantize = bool(model_info["quantize"])
+    return config
+
+
+def load_separation_model(model_info, model_cache=None):
+    loader_cls = get_loader_cls(model_info)
+
+    def load_fn():
+        config = load_config(model_info)
+        model = loader_cls().load(model_info["model_id"], model_info["device"], config)
+        return config, model
+
+    if model_cache is None:
+        return load_fn()
+
+    quantized = is_quantization_applied(load_config(model_info), model_info)
+    key = (model_info["model"], model_info["model_id"], str(model_info["device"]), quantized)
+    return model_cache.get(key, load_fn, get_memory_estimate(model_info))
+
+
+def should_stream(audio_file):
+    # Long inputs (DJ sets, podcast archives) are separated block by block straight into files
+    try:
+        length, sample_rate = get_audio_length(audio_file)
+    except Exception as e:
+        print(f"Не удалось определить длительность файла: {e}")
+        return False
+    return length > STREAMING_MIN_DURATION * sample_rate
+
+
+def get_default_output_dir(audio_file, model_info):
+    # Streamed stems without an output directory go to the user data dir, one directory per job: keyed by the
+    # absolute input path and the requested stems, so same-named inputs neither mix nor truncate each other's
+    # files on resume
+    source = f"{os.path.abspath(audio_file)}:{sorted(model_info.get('stems') or [])}"
+    digest = hashlib.sha256(source.encode()).hexdigest()[:12]
+    return get_user_data_dir() / "output" / f"{Path(audio_file).stem}_{model_info['model_id']}_{digest}"
+
+
+def separate_streaming(audio_file, model_info, config, model, stream_fn, progress_reporter, checkpoint=None):
+    length, sample_rate = get_audio_length(audio_file)
+    output_dir = model_info.get("output_dir") or get_default_output_dir(audio_file, model_info)
+
+    print(f"Потоковая обработка: {length} сэмплов -> {output_dir}")
+
+    state = checkpoint.load() if checkpoint is not None else None
+    if state is not None and state["output"] and not stem_files_intact(str(output_dir), state["output"]):
+        print("Файлы прерванной обработки изменены или удалены, начинаем сначала")
+        checkpoint.clear()
+
+    stem_blocks = stream_fn(
+        config,
+        model,
+        read_audio_blocks(audio_file),
+        length,
+        model_info["device"],
+        progress_bar=progress_reporter,
+        stems=model_info.get("stems"),
+        checkpoint=checkpoint
+    )
+    paths = write_stem_blocks(stem_blocks, str(output_dir), sample_rate, checkpoint=checkpoint)
+
+    return {stem: {'path': path, 'sr': sample_rate} for stem, path in paths.items()}
+
+
+def write_tracks(tracks, output_dir):
+    # In-memory stems go to <output_dir>/<stem>.wav, the tracks then refer to the files
+    data = {stem: torch.as_tensor(track['data']).float().cpu().numpy()
+            for stem, track in tracks.items() if 'data' in track}
+    if not data:
+        return tracks
+
+    sample_rate = next(track['sr'] for track in tracks.values() if 'data' in track)
+    paths = write_stem_blocks([data], str(output_dir), sample_rate)
+    return dict(tracks, **{stem: {'path': path, 'sr': sample_rate} for stem, path in paths.items()})
+
+
+def get_job_key(audio_hash, model_info, config):
+    loader_cls = get_loader_cls(model_info)
+    quantized = is_quantization_applied(config, model_info)
+    inference_params = get_inference_params(config, model_info["strategy"], quantized)
+    if model_info.get("stems"):
+        inference_params["stems"] = sorted(model_info["stems"])
+    return make_cache_key(
+        audio_hash,
+        f"{loader_cls.__name__}:{loader_cls.WEIGHTS_FILENAME}",
+        model_info["model_id"],
+        model_info["config"],
+        inference_params
+    )
+
+
+def get_result_cache_key(mix, sample_rate, model_info, config=None):
+    # Chunk size is part of the key: take it from the tuned config when one is given
+    if config is None:
+        config = load_config(model_info)
+        apply_saved_tuning(config, model_info)
+    return get_job_key(hash_audio(mix, sample_rate), model_info, config)
+
+
+def get_checkpoint_key(audio_file, model_info, config):
+    # The input is identified by path, size and mtime rather than by its samples (streamed inputs are never
+    # in memory as a whole); the output directory is part of the key, a resumed job continues its files there
+    stat = os.stat(audio_file)
+    output_dir = model_info.get("output_dir") or ""
+    source = f"{os.path.abspath(audio_file)}:{stat.st_size}:{stat.st_mtime_ns}:{output_dir}"
+    return get_job_key(hashlib.sha256(source.encode()).hexdigest(), model_info, config)
+
+
+def get_checkpoint_params(model_info, config):
+    # What a saved partial result depends on besides the input, checked when it is resumed: the model and its
+    # quantization, the framing (chunk size and step) and the stems
+    loader_cls = get_loader_cls(model_info)
+    params = get_inference_params(config, model_info["strategy"], is_quantization_applied(config, model_info))
+    params["step"] = params["chunk_size"] // params["num_overlap"]
+    params["model"] = f"{loader_cls.__name__}:{loader_cls.WEIGHTS_FILENAME}:{model_info['model_id']}"
+    params["stems"] = sorted(model_info.get("stems") or [])
+    return params
+
+
+def separate(audio_file, model_info, progress_reporter, model_cache=None, result_cache=None):
+    # Returns the separated tracks, or None if the job was cancelled
+    if model_info["strategy"] not in STRATEGIES:
+        raise NotImplementedError(f"Неизвестная стратегия разделения: {model_info['strategy']}")
+    if model_info["loader"] not in LOADERS:
+        raise NotImplementedError(f"Неизвестный загрузчик: {model_info['loader']}")
+    demix_fn, stream_fn = STRATEGIES[model_info["strategy"]]
+    model_name = model_info["name"]
+
+    if progress_reporter.is_cancelled():
+        return None
+
+    streaming = should_stream(audio_file)
+
+    progress_reporter.update_status("Загрузка аудио...")
+
+    if not streaming:
+        mix, sample_rate = torchaudio.load(audio_file)
+        print(f"Аудио загружено: {mix.shape}")
+
+    if progress_reporter.is_cancelled():
+        return None
+
+    # Кэш проверяется до загрузки модели: при попадании модель не нужна вовсе
+    cache_key = None
+    if not streaming and result_cache is not None and result_cache.enabled:
+        progress_reporter.update_status("Поиск в кэше...")
+        cache_key = get_result_cache_key(mix, sample_rate, model_info)
+        tracks = result_cache.get(cache_key)
+        if tracks is not None:
+            print(f"Результат найден в кэше: {cache_key}")
+            if model_info.get("output_dir"):
+                tracks = write_tracks(tracks, model_info["output_dir"])
+            return tracks
+
+    progress_reporter.update_status(f"Загрузка модели {model_name}...")
+
+    config, model = load_separation_model(model_info, model_cache)
+
+    if progress_reporter.is_cancelled():
+        return None
+
+    # Подбор параметров сообщает о себе статусами, только когда он действительно выполняется
+    if autotune(config, model, model_info, progress_reporter) is not None and cache_key is not None:
+        cache_key = get_result_cache_key(mix, sample_rate, model_info, config)
+
+    if progress_reporter.is_cancelled():
+        return None
+
+    # Частичный результат сохраняется по ходу обработки: прерванная задача продолжится с последнего сохранения
+    checkpoint = None
+    if CHECKPOINT_INTERVAL > 0:
+        checkpoint = DemixCheckpoint(get_checkpoint_key(audio_file, model_info, config),
+                                     params=get_checkpoint_params(model_info, config))
+
+    if checkpoint is not None and checkpoint.load() is not None:
+        progress_reporter.update_status("Продолжение прерванной обработки...")
+    else:
+        progress_reporter.update_status("Обработка аудио...")
+
+    try:
+        if streaming:
+            tracks = separate_streaming(audio_file, model_info, config, model, stream_fn, progress_reporter,
+                                        checkpoint)
+        else:
+            mix = mix.to(model_info["device"])
+
+            waveform = demix_fn(
+                config,
+                model,
+                mix,
+                model_info["device"],
+                progress_bar=progress_reporter,
+                stems=model_info.get("stems"),
+                checkpoint=checkpoint
+            )
+    except DemixCancelled:
+        print("Обработка остановлена, прогресс сохранён")
+        return None
+
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    if not streaming:
+        if progress_reporter.is_cancelled():
+            return None
+
+        progress_reporter.update_status("Формирование результата...")
+
+        tracks = {}
+        for stem in waveform.keys():
+            tracks[stem] = {'data': torch.as_tensor(waveform[stem]).float().cpu(), 'sr': sample_rate}
+
+        if cache_key is not None:
+            result_cache.put(cache_key, tracks)
+
+        if model_info.get("output_dir"):
+            progress_reporter.update_status("Сохранение стемов...")
+            tracks = write_tracks(tracks, model_info["output_dir"])
+
+    if progress_reporter.is_cancelled():
+        return None
+
+    return tracks
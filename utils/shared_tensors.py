@@ -0,0 +1,84 @@
+import numpy as np
+
+from multiprocessing import shared_memory, resource_tracker
+
+
+def _untrack(shm):
+    # The segment outlives the worker: the GUI unlinks it, not the worker's resource tracker
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+def export_tracks(tracks):
+    # Worker side: in-memory stems go into one shared (stems, channels, length) block,
+    # only a small descriptor is sent back over the pipe. Stems already written to files (jobs with an
+    # output_dir, e.g. every job of the app's queue) are passed as paths
+    stems = [stem for stem, track in tracks.items() if 'data' in track]
+    files = {stem: track for stem, track in tracks.items() if 'data' not in track}
+    descriptor = {"name": None, "shape": None, "dtype": "float32", "stems": stems, "sr": None, "files": files}
+    if not stems:
+        return descriptor
+
+    # torch is only needed on the worker side, the receiving process must not load it just for SharedTracks
+    import torch
+
+    data = [torch.as_tensor(tracks[stem]['data']).float().cpu().numpy() for stem in stems]
+    shape = (len(stems),) + data[0].shape
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 4))
+    buffer = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    for index, stem_data in enumerate(data):
+        buffer[index] = stem_data
+    del buffer
+
+    _untrack(shm)
+    shm.close()
+
+    descriptor.update(name=shm.name, shape=shape, sr=tracks[stems[0]]['sr'])
+    return descriptor
+
+
+class SharedTracks:
+    # Receiving side (audsep): stems are numpy views straight into the worker's shared memory block
+    def __init__(self, descriptor):
+        self.name = descriptor["name"]
+        self.shm = None
+        self.tracks = {}
+
+        if self.name is not None:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+            data = np.ndarray(descriptor["shape"], dtype=descriptor["dtype"], buffer=self.shm.buf)
+            for index, stem in enumerate(descriptor["stems"]):
+                self.tracks[stem] = {'data': data[index], 'sr': descriptor["sr"]}
+
+        self.tracks.update(descriptor["files"])
+
+    def release(self):
+        self.tracks = {}
+        if self.shm is None:
+            return
+
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            self.shm.close()
+        except BufferError:
+            # Someone still holds a view; the mapping goes away with the last reference
+            pass
+        self.shm = None
+
+
+def discard_tracks(descriptor):
+    # Result nobody is going to look at (job cancelled after it finished)
+    if descriptor is None or descriptor.get("name") is None:
+        return
+    try:
+        shm = shared_memory.SharedMemory(name=descriptor["name"])
+    except FileNotFoundError:
+        return
+    shm.unlink()
+    shm.close()
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import builtins
+import threading
+import importlib
+
+# AUDSEP_PROFILE_STARTUP=1 prints how long every top-level package took to import before the window appeared
+PROFILE_STARTUP = os.environ.get("AUDSEP_PROFILE_STARTUP", "0") == "1"
+REPORT_TOP = 15
+
+_started = time.perf_counter()
+_import_times = {}
+_local = threading.local()
+_original_import = builtins.__import__
+
+
+def _get_package(name, globals_, level):
+    if level and globals_:
+        name = globals_.get('__package__') or globals_.get('__name__') or name
+    return name.partition('.')[0]
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if not level and name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    # Exclusive time: what nested imports took is billed to their own packages
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        package = _get_package(name, globals, level)
+        _import_times[package] = _import_times.get(package, 0.0) + elapsed - nested
+
+
+def enable_import_profiling():
+    if PROFILE_STARTUP and builtins.__import__ is _original_import:
+        builtins.__import__ = _timed_import
+
+
+def report_startup(stage):
+    elapsed = time.perf_counter() - _started
+    print(f"{stage}: {elapsed:.2f} с от запуска")
+    if not PROFILE_STARTUP:
+        return
+
+    total = sum(_import_times.values())
+    print(f"Импорт модулей: {total:.2f} с")
+    for package, seconds in sorted(_import_times.items(), key=lambda item: -item[1])[:REPORT_TOP]:
+        print(f"  {package:<30} {seconds:.3f} с")
+
+
+def preload_modules(modules):
+    # Imports the given modules in a daemon thread, so their first use does not stall the GUI
+    def run():
+        for module in modules:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(module)
+            except Exception as e:
+                print(f"Не удалось предзагрузить {module}: {e}")
+                continue
+            if PROFILE_STARTUP:
+                print(f"Предзагружен {module}: {time.perf_counter() - start:.2f} с")
+
+    thread = threading.Thread(target=run, name="preload", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,113 @@
+import os
+import threading
+import torch
+import torch.nn as nn
+
+from contextlib import contextmanager
+
+MMAP_SUFFIX = '.mmap.pt'
+MMAP_FORMAT_VERSION = 3
+
+# init_empty_parameters patches nn.init for the whole process: held for as long as the patch is in place and
+# while models are built the regular way, so a model built on another thread (preload, worker threads) never
+# picks up the no-op initializers
+_init_lock = threading.Lock()
+
+
+def get_mmap_path(weights_path):
+    return weights_path + MMAP_SUFFIX
+
+
+def read_checkpoint(weights_path, device='cpu'):
+    state_dict = torch.load(weights_path, map_location=device, weights_only=False)
+    if 'state' in state_dict:
+        state_dict = state_dict['state']
+    if 'state_dict' in state_dict:
+        state_dict = state_dict['state_dict']
+    return state_dict
+
+
+@contextmanager
+def init_empty_parameters():
+    # The nn.init functions are no-ops while the module is built, so its parameters keep the uninitialized memory
+    # torch.empty gave them: never touched, never paged in, and freed when load_state_dict(assign=True) puts the
+    # loaded tensors in their place. Constructors that compute on their weights (demucs' ScaledEmbedding,
+    # rescale_module) stay cheap, unlike on the meta device, where such ops go through torch._refs and import
+    # torch._dynamo
+    def skip_init(tensor, *args, **kwargs):
+        return tensor
+
+    with _init_lock:
+        init_functions = {name: getattr(nn.init, name) for name in dir(nn.init)
+                          if name.endswith('_') and not name.startswith('_')}
+        for name in init_functions:
+            setattr(nn.init, name, skip_init)
+        try:
+            yield
+        finally:
+            for name, function in init_functions.items():
+                setattr(nn.init, name, function)
+
+
+def convert_checkpoint(model, weights_path, fingerprint):
+    # Saved with torch.save's zip format, whose storages torch.load(mmap=True) maps without copying. Tensors are
+    # kept as they are: views into a shared storage (packed layouts) are saved as views and load back as views
+    mmap_path = get_mmap_path(weights_path)
+    payload = {
+        'version': MMAP_FORMAT_VERSION,
+        'fingerprint': fingerprint,
+        'state_dict': {k: v.detach().cpu() for k, v in model.state_dict().items()},
+    }
+
+    temp_path = mmap_path + '.tmp'
+    torch.save(payload, temp_path)
+    os.replace(temp_path, mmap_path)
+    print(f"Converted weights to memory-mapped format: {mmap_path}")
+
+
+def load_mmap_checkpoint(weights_path, fingerprint):
+    mmap_path = get_mmap_path(weights_path)
+    if not os.path.exists(mmap_path) or os.path.getmtime(mmap_path) < os.path.getmtime(weights_path):
+        return None
+
+    try:
+        payload = torch.load(mmap_path, map_location='cpu', mmap=True, weights_only=True)
+    except Exception as e:
+        print(f"Could not read memory-mapped weights {mmap_path}: {e}")
+        return None
+
+    if payload.get('version') != MMAP_FORMAT_VERSION or payload.get('fingerprint') != fingerprint:
+        return None
+    return payload
+
+
+def load_model(model_factory, weights_path, device, fingerprint):
+    # model_factory() builds the bare module; fingerprint identifies its hyperparameters
+    payload = load_mmap_checkpoint(weights_path, fingerprint)
+
+    if payload is not None:
+        try:
+            with init_empty_parameters():
+                model = model_factory()
+            model.load_state_dict(payload['state_dict'], assign=True)
+            print(f"Loaded memory-mapped weights from: {get_mmap_path(weights_path)}")
+            return model.to(device)
+        except Exception as e:
+            print(f"Memory-mapped load failed, falling back to the original checkpoint: {e}")
+
+    print(f"Loading weights from: {weights_path}")
+    with _init_lock:
+        model = model_factory()
+    model.load_state_dict(read_checkpoint(weights_path))
+
+    # Models with a packed inference layout take it before conversion, so the memory-mapped weights are loaded
+    # in that layout and nothing is copied out of the mapping later
+    if hasattr(model, 'pack_weights'):
+        model.pack_weights()
+
+    try:
+        convert_checkpoint(model, weights_path, fingerprint)
+    except Exception as e:
+        print(f"Could not convert weights to memory-mapped format: {e}")
+
+    return model.to(device)
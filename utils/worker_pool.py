@@ -0,0 +1,263 @@
+import os
+import queue
+import signal
+import threading
+import itertools
+import multiprocessing
+
+from multiprocessing.connection import wait
+from utils.shared_tensors import discard_tracks
+
+WORKER_POLL_INTERVAL = 0.5
+
+
+class _JobChannel:
+    def __init__(self, event_conn, job_id):
+        self.event_conn = event_conn
+        self.job_id = job_id
+
+    def put(self, item):
+        self.event_conn.send((self.job_id,) + tuple(item))
+
+
+class _JobCancelToken:
+    # A worker runs one job at a time, so cancellation is the id of the job to stop
+    def __init__(self, cancel_job, job_id):
+        self.cancel_job = cancel_job
+        self.job_id = job_id
+
+    def is_set(self):
+        return self.cancel_job.value == self.job_id
+
+
+def pool_worker(worker_index, job_queue, event_conn, cancel_job, memory_budget, device=None, num_threads=None):
+    from utils.separation import ProgressReporter, ResidentModelCache, separate, empty_device_cache, default_device
+    from utils.shared_tensors import export_tracks
+    from utils.result_cache import ResultCache
+    from utils.checkpoint import remove_stale_checkpoints
+
+    def signal_handler(signum, frame):
+        print(f"Процесс получил сигнал {signum}, завершаемся...")
+        empty_device_cache()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+
+    model_cache = ResidentModelCache(memory_budget) if memory_budget is not None else ResidentModelCache()
+    result_cache = ResultCache()
+    if worker_index == 0:
+        remove_stale_checkpoints()
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+
+        job_id, audio_file, model_info = job
+        if device is not None:
+            model_info = dict(model_info, device=device)
+        if model_info["device"] == "auto":
+            model_info = dict(model_info, device=default_device())
+            print(f"Используется устройство: {model_info['device']}")
+        event_conn.send((job_id, "started", worker_index))
+
+        cancel_token = _JobCancelToken(cancel_job, job_id)
+        progress_reporter = ProgressReporter(_JobChannel(event_conn, job_id), cancel_token)
+
+        try:
+            tracks = separate(audio_file, model_info, progress_reporter, model_cache, result_cache)
+            if tracks is None:
+                event_conn.send((job_id, "cancelled", None))
+            else:
+                progress_reporter.update_progress(100)
+                progress_reporter.update_status("Готово!")
+                event_conn.send((job_id, "success", export_tracks(tracks)))
+            del tracks
+        except Exception as e:
+            if cancel_token.is_set():
+                event_conn.send((job_id, "cancelled", None))
+            else:
+                event_conn.send((job_id, "error", str(e)))
+
+    model_cache.clear()
+
+
+def _send_default_device(conn):
+    from utils.separation import default_device
+    conn.send(default_device())
+    conn.close()
+
+
+def detect_default_device():
+    # The device "auto" stands for, found in a child process: this module must not import torch. Blocks while
+    # the child imports it, so callers with a GUI run it in a thread
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_send_default_device, args=(writer,), daemon=True)
+    process.start()
+    writer.close()
+    try:
+        return reader.recv()
+    except EOFError:
+        return "cpu"
+    finally:
+        process.join()
+
+
+class SeparationWorkerPool:
+    # Long-lived worker processes that keep loaded models resident between separations
+    def __init__(self, num_workers=1, memory_budget=None, devices=None, num_threads=None):
+        self.num_workers = num_workers
+        # None: the workers' default (utils.separation.DEFAULT_MODEL_MEMORY_BUDGET), this module must not import torch
+        self.memory_budget = memory_budget
+        # Optional per-worker device (overrides the job's device) and torch intra-op thread count
+        self.devices = devices
+        self.num_threads = num_threads
+
+        self._job_queue = multiprocessing.Queue()
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._listeners = {}
+        self._running = {}
+        self._pending_cancel = set()
+        self._workers = [None] * num_workers
+        self._closed = False
+
+        for index in range(num_workers):
+            self._start_worker(index)
+
+        self._dispatcher = threading.Thread(target=self._dispatch_events, daemon=True)
+        self._dispatcher.start()
+
+    def _start_worker(self, index):
+        # Every worker gets its own event pipe, so killing one mid-send cannot corrupt the others
+        cancel_job = multiprocessing.Value('q', 0)
+        event_reader, event_writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=pool_worker,
+            args=(index, self._job_queue, event_writer, cancel_job, self.memory_budget,
+                  self.devices[index % len(self.devices)] if self.devices else None, self.num_threads),
+            daemon=True
+        )
+        process.start()
+        event_writer.close()
+        self._workers[index] = (process, cancel_job, event_reader)
+        print(f"Запущен рабочий процесс #{index} (pid {process.pid})")
+
+    def submit(self, audio_file, model_info, events=None):
+        # events: anything with put((kind, payload)); a fresh queue per job by default
+        job_id = next(self._job_ids)
+        events = events if events is not None else queue.Queue()
+        with self._lock:
+            self._listeners[job_id] = events
+        self._job_queue.put((job_id, str(audio_file), model_info))
+        return job_id, events
+
+    def cancel(self, job_id):
+        with self._lock:
+            index = self._running.get(job_id)
+            if index is None:
+                # Not started yet: the token is set as soon as a worker reports picking the job up
+                self._pending_cancel.add(job_id)
+                return
+            self._workers[index][1].value = job_id
+
+    def kill_job(self, job_id):
+        # Hard stop for a job that ignores cancellation; the dispatcher restarts its worker without resident models
+        with self._lock:
+            index = self._running.pop(job_id, None)
+            listener = self._listeners.pop(job_id, None)
+        if index is None:
+            return
+
+        process = self._workers[index][0]
+        if process.is_alive():
+            print(f"Принудительное уничтожение процесса #{index}")
+            process.terminate()
+            process.join(timeout=2)
+            if process.is_alive():
+                process.kill()
+                process.join(timeout=1)
+
+        if listener is not None:
+            listener.put(("cancelled", None))
+
+    def _dispatch_events(self):
+        # Wakes up on worker events and on worker exits (process sentinels); the timeout only bounds shutdown
+        while not self._closed:
+            readers = [event_reader for _, _, event_reader in self._workers]
+            sentinels = [process.sentinel for process, _, _ in self._workers]
+            try:
+                ready = wait(readers + sentinels, timeout=WORKER_POLL_INTERVAL)
+            except OSError:
+                ready = []
+
+            for reader in ready:
+                if reader in sentinels:
+                    continue
+                try:
+                    job_id, kind, payload = reader.recv()
+                except (EOFError, OSError):
+                    continue
+                self._handle_event(job_id, kind, payload)
+
+            self._check_workers()
+
+    def _handle_event(self, job_id, kind, payload):
+        with self._lock:
+            listener = self._listeners.get(job_id)
+            if kind == "started":
+                self._running[job_id] = payload
+                if job_id in self._pending_cancel:
+                    self._pending_cancel.discard(job_id)
+                    self._workers[payload][1].value = job_id
+            if kind in ("success", "error", "cancelled"):
+                self._running.pop(job_id, None)
+                self._listeners.pop(job_id, None)
+
+        if listener is not None:
+            listener.put((kind, payload))
+        elif kind == "success":
+            discard_tracks(payload)
+
+    def _check_workers(self):
+        for index, (process, _, event_reader) in enumerate(self._workers):
+            if process.is_alive() or self._closed:
+                continue
+
+            with self._lock:
+                jobs = [job_id for job_id, worker in self._running.items() if worker == index]
+                listeners = [self._listeners.pop(job_id, None) for job_id in jobs]
+                for job_id in jobs:
+                    del self._running[job_id]
+
+            for listener in listeners:
+                if listener is not None:
+                    listener.put(("error", "Процесс завершился с ошибкой"))
+
+            print(f"Рабочий процесс #{index} завершился (код {process.exitcode}), перезапускаем")
+            event_reader.close()
+            self._start_worker(index)
+
+    def shutdown(self):
+        self._closed = True
+        with self._lock:
+            listeners = list(self._listeners.values())
+            self._listeners.clear()
+            self._running.clear()
+        # Whoever still waits for a job's events is released
+        for listener in listeners:
+            listener.put(("cancelled", None))
+
+        for _ in self._workers:
+            self._job_queue.put(None)
+
+        for process, _, _ in self._workers:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout=1)